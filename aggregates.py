@@ -0,0 +1,130 @@
+# aggregates.py — exact per-message metadata kept beside the vector index
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+AGGREGATES_FILE = "aggregates.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id          TEXT PRIMARY KEY,
+    received_ts INTEGER NOT NULL,
+    received    TEXT,
+    sender      TEXT,
+    domain      TEXT,
+    subject     TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_agg_received ON messages(received_ts);
+CREATE INDEX IF NOT EXISTS idx_agg_sender ON messages(sender, received_ts);
+CREATE INDEX IF NOT EXISTS idx_agg_domain ON messages(domain, received_ts);
+"""
+
+
+def received_timestamp(received):
+    """Graph receivedDateTime → epoch seconds (what range filters compare)."""
+    if not received:
+        return 0
+    try:
+        return int(datetime.fromisoformat(received.replace("Z", "+00:00")).timestamp())
+    except ValueError:
+        return 0
+
+
+def sender_domain(sender):
+    return sender.rsplit("@", 1)[-1].lower() if "@" in sender else ""
+
+
+def _where(start=None, end=None, sender=None, domain=None):
+    clauses, args = [], []
+    if start is not None:
+        clauses.append("received_ts >= ?")
+        args.append(int(start.timestamp()))
+    if end is not None:
+        clauses.append("received_ts < ?")
+        args.append(int(end.timestamp()))
+    if sender:
+        clauses.append("sender = ?")
+        args.append(sender.lower())
+    if domain:
+        clauses.append("domain = ?")
+        args.append(domain.lower())
+    return (" WHERE " + " AND ".join(clauses) if clauses else ""), args
+
+
+class AggregateStore:
+    """
+    One row per indexed message (time, sender, domain, subject), updated by the
+    indexers together with Chroma, so counts and listings are exact and need
+    neither retrieval nor the LLM.
+    """
+
+    def __init__(self, persist_dir):
+        os.makedirs(persist_dir, exist_ok=True)
+        self.path = os.path.join(persist_dir, AGGREGATES_FILE)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.executescript(_SCHEMA)
+
+    def upsert(self, metadatas):
+        """Add/refresh messages from Document metadata dicts (several chunks of one message collapse)."""
+        rows = {
+            md["id"]: (
+                md["id"],
+                md.get("received_ts") or received_timestamp(md.get("received")),
+                md.get("received"),
+                (md.get("from") or "").lower(),
+                md.get("domain") or sender_domain(md.get("from") or ""),
+                md.get("subject") or "",
+            )
+            for md in metadatas
+            if md.get("id")
+        }
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO messages (id, received_ts, received, sender, domain, subject) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                list(rows.values()),
+            )
+
+    def delete(self, message_ids):
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM messages WHERE id = ?", [(i,) for i in message_ids])
+
+    def _query(self, sql, args):
+        with self._lock:
+            return self._conn.execute(sql, args).fetchall()
+
+    def count(self, **filters):
+        where, args = _where(**filters)
+        return self._query(f"SELECT COUNT(*) FROM messages{where}", args)[0][0]
+
+    def latest(self, n=1, **filters):
+        """Newest messages as dicts with from/subject/received keys."""
+        where, args = _where(**filters)
+        rows = self._query(
+            f"SELECT sender, subject, received FROM messages{where} ORDER BY received_ts DESC LIMIT ?",
+            args + [n],
+        )
+        return [{"from": r[0], "subject": r[1], "received": r[2]} for r in rows]
+
+    def top_senders(self, n=5, **filters):
+        where, args = _where(**filters)
+        return self._query(
+            f"SELECT sender, COUNT(*) AS c FROM messages{where} GROUP BY sender ORDER BY c DESC LIMIT ?",
+            args + [n],
+        )
+
+    def per_domain(self, n=10, **filters):
+        where, args = _where(**filters)
+        return self._query(
+            f"SELECT domain, COUNT(*) AS c FROM messages{where} GROUP BY domain ORDER BY c DESC LIMIT ?",
+            args + [n],
+        )
+
+    def backfill_from_chroma(self, db):
+        """Fill an empty store from an index built before aggregates existed."""
+        if self.count() == 0:
+            metadatas = db.get(include=["metadatas"]).get("metadatas") or []
+            self.upsert(metadatas)
+        return self.count()
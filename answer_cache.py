@@ -0,0 +1,147 @@
+# answer_cache.py — semantic cache of answers, scoped to one version of an index
+import math
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+from raganizer import MANIFEST_FILE, load_manifest
+
+ANSWER_CACHE_FILE = "answers.sqlite"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "3600"))  # seconds
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "500"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    id        INTEGER PRIMARY KEY,
+    version   TEXT,
+    scope     TEXT NOT NULL,
+    query     TEXT NOT NULL,
+    vector    BLOB NOT NULL,
+    answer    TEXT NOT NULL,
+    created   REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_answers_scope ON answers(version, scope);
+CREATE INDEX IF NOT EXISTS idx_answers_last_used ON answers(last_used);
+"""
+
+
+def normalize_query(query):
+    return " ".join(query.lower().split()).rstrip("?!. ")
+
+
+def _unit(vector):
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+class AnswerCache:
+    """
+    Answers to earlier questions, matched to new ones by cosine similarity of
+    their query embeddings (>= `threshold`). Entries belong to the manifest
+    version of `persist_dir` and to a `scope` (the caller's resolved filters),
+    so a re-index or a different date window never returns a stale answer. The
+    version only changes when an index run finishes, not at its checkpoints.
+    Expired (`ttl`) and least-recently-used entries beyond `max_entries` are dropped.
+    """
+
+    def __init__(self, persist_dir, embeddings, threshold=ANSWER_CACHE_THRESHOLD,
+                 ttl=ANSWER_CACHE_TTL, max_entries=ANSWER_CACHE_MAX_ENTRIES):
+        os.makedirs(persist_dir, exist_ok=True)
+        self.persist_dir = persist_dir
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._manifest_mtime = None
+        self._version = None
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            os.path.join(persist_dir, ANSWER_CACHE_FILE), check_same_thread=False, timeout=30
+        )
+        self._conn.executescript(_SCHEMA)
+
+    def index_version(self):
+        """Manifest version of the index; the manifest is only re-read when it changes on disk."""
+        path = os.path.join(self.persist_dir, MANIFEST_FILE)
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        if mtime != self._manifest_mtime:
+            self._manifest_mtime = mtime
+            self._version = load_manifest(self.persist_dir).get("version")
+        return self._version
+
+    def _expire(self, version):
+        """Drop answers from other index versions and past their TTL."""
+        with self._conn:
+            self._conn.execute(
+                "DELETE FROM answers WHERE version IS NOT ? OR created < ?", (version, time.time() - self.ttl)
+            )
+
+    def get(self, query, scope=""):
+        """Return (answer, similarity) for a close enough earlier question, or None."""
+        norm = normalize_query(query)
+        with self._lock:
+            version = self.index_version()
+            self._expire(version)
+            rows = self._conn.execute(
+                "SELECT id, query, vector, answer FROM answers WHERE version IS ? AND scope = ?",
+                (version, scope),
+            ).fetchall()
+            if not rows:
+                self.misses += 1
+                return None
+
+        # Verbatim repeats don't need an embedding at all
+        best = next(((row_id, answer, 1.0) for row_id, q, _, answer in rows if q == norm), None)
+        if best is None:
+            vector = _unit(self.embeddings.embed_query(norm))
+            for row_id, _, blob, answer in rows:
+                similarity = sum(a * b for a, b in zip(vector, array("f", blob)))
+                if similarity >= self.threshold and (best is None or similarity > best[2]):
+                    best = (row_id, answer, similarity)
+        with self._lock, self._conn:
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE answers SET last_used = ? WHERE id = ?", (time.time(), best[0]))
+        return best[1], best[2]
+
+    def put(self, query, answer, scope=""):
+        norm = normalize_query(query)
+        vector = array("f", _unit(self.embeddings.embed_query(norm))).tobytes()
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM answers WHERE query = ? AND scope = ?", (norm, scope))
+            self._conn.execute(
+                "INSERT INTO answers (version, scope, query, vector, answer, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self.index_version(), scope, norm, vector, answer, now, now),
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM answers WHERE id IN (SELECT id FROM answers ORDER BY last_used ASC LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM answers")
+
+    def stats(self):
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            "entries": size,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+        }
@@ -1,6 +1,7 @@
 # app.py — Streamlit UI for Outlook → LangChain email Q&A
 import os
-import json
+import tempfile
+import uuid
 import streamlit as st
 from datetime import datetime, date
 from dotenv import load_dotenv
@@ -9,46 +10,81 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # Local helper modules (from your project)
-from auth_utils import get_access_token
-from graph_utils import list_messages
-from raganizer import emails_to_documents, make_or_load_chroma
-from qa import load_qa_chain, smart_answer
+from attachments import AttachmentIngestor
+from auth_utils import token_manager
+from graph_utils import day_range, fetch_controller
+from embedding_service import get_embeddings, warm_up
+from mail_store import MessageStore
+from metrics import metrics
+from mail_sync import iter_pages_with_bodies, sync_mailbox, sync_covers, last_synced
+from index_jobs import current_job, start_job
+from raganizer import INDEX_DIR, MANIFEST_FILE
+from retrieval_service import ServiceBusy, get_service
 
 st.set_page_config(page_title="Outlook Email QA", layout="wide")
 
+
+@st.cache_resource
+def get_store():
+    """One local mailbox store per process, shared by all sessions."""
+    return MessageStore()
+
+
+store = get_store()
+
+
+@st.cache_resource
+def start_embedding_service():
+    """Load the shared embedding model in the background once per process."""
+    warm_up()
+    return get_embeddings()
+
+
+start_embedding_service()
+
 # ---- Sidebar: Sign-in + settings ----
 st.sidebar.title("Settings & Login")
 
 if "token" not in st.session_state:
     st.session_state["token"] = None
 
-if "emails" not in st.session_state:
-    st.session_state["emails"] = []
+if "fetched_day" not in st.session_state:
+    # Only the selected day is kept per session; messages stay in the store
+    st.session_state["fetched_day"] = None
 
 if "docs" not in st.session_state:
     st.session_state["docs"] = []
 
 if "chroma_dir" not in st.session_state:
-    st.session_state["chroma_dir"] = None
+    # One index holds every indexed day; it is usable as soon as it exists
+    index_ready = os.path.exists(os.path.join(INDEX_DIR, MANIFEST_FILE))
+    st.session_state["chroma_dir"] = INDEX_DIR if index_ready else None
+
+if "user_id" not in st.session_state:
+    # Admission control in the shared retrieval service is per session
+    st.session_state["user_id"] = uuid.uuid4().hex[:8]
 
-if "qa_objs" not in st.session_state:
-    st.session_state["qa_objs"] = None  # will hold (qa, retriever, llm, db)
+if "service" not in st.session_state:
+    st.session_state["service"] = None  # the process-wide RetrievalService of the index
 
 st.sidebar.markdown("### Azure / App settings")
 st.sidebar.write("Client/Tenant read from environment or `.env`")
 
 st.sidebar.markdown("---")
 st.sidebar.markdown("### Fetch options")
-top_default = 200
 top_val = st.sidebar.number_input(
-    "Max emails to fetch (top)", min_value=20, max_value=2000, value=top_default, step=20
-)
+    "Page size (emails per Graph request, 0 = adaptive)", min_value=0, max_value=1000, value=0, step=20
+) or None
+st.sidebar.caption("Adaptive fetch: " + ", ".join(f"{k} {v}" for k, v in fetch_controller().settings().items()))
 
 # Sign in button
 if st.sidebar.button("Sign in (device code)"):
     try:
-        token = get_access_token()
-        st.session_state["token"] = token
+        # The manager (not a token string) goes into the session: it hands out
+        # fresh tokens and refreshes them in the background
+        manager = token_manager()
+        manager.sign_in()
+        st.session_state["token"] = manager
         st.sidebar.success("Signed in — token cached.")
     except Exception as e:
         st.sidebar.error(f"Sign in failed: {e}")
@@ -58,10 +94,49 @@ if st.session_state["token"]:
 else:
     st.sidebar.warning("Not signed in — click Sign in above")
 
+st.sidebar.caption(f"Local store: {store.count()} messages, last sync {last_synced(store) or 'never'}")
+if st.sidebar.button("🔄 Sync new mail"):
+    if not st.session_state["token"]:
+        st.sidebar.error("You must sign in first.")
+    elif last_synced(store) is None:
+        st.sidebar.info("Nothing synced yet — fetch a date first.")
+    else:
+        with st.spinner("Syncing changes from Outlook..."):
+            try:
+                # Replays the saved delta link: only changes since the last sync are transferred
+                stats = sync_mailbox(st.session_state["token"], store, page_size=top_val, headers_only=True)
+                st.sidebar.success(f"{stats['upserted']} changed, {stats['removed']} removed")
+            except Exception as e:
+                st.sidebar.error(f"Sync failed: {e}")
+
 st.sidebar.markdown("---")
 st.sidebar.markdown("Made with ❤️ — Kaz")
 st.sidebar.caption("Tip: choose a date and click Fetch emails")
 
+@st.fragment(run_every=1)
+def index_job_panel():
+    """Live progress of the background indexing job, with cancel / resume."""
+    job = current_job(INDEX_DIR)
+    if job is None:
+        return
+    p = job.progress()
+    total = p["total"] or "?"
+    text = (f"{p['status'].title()} {p['label']}: {p['done']}/{total} emails "
+            f"({p['indexed']} indexed, {p['duplicates']} near-duplicates collapsed, {p['skipped']} unchanged) "
+            f"— {p['rate']:.1f} emails/s")
+    st.progress(p["fraction"] or 0.0, text=text)
+    if job.running:
+        if st.button("⏹️ Cancel indexing"):
+            job.cancel()
+    elif p["status"] in ("cancelled", "failed"):
+        if p["error"]:
+            st.error(f"Indexing failed: {p['error']}")
+        if st.button("▶️ Resume indexing"):
+            job.resume()
+    elif p["status"] == "done":
+        st.success("✅ Indexing complete. Ready for QA.")
+
+
 # ---- Main layout ----
 st.title("📧 Outlook Email Q&A (LangChain + Chroma)")
 
@@ -74,47 +149,60 @@ with col1:
     pick_date_str = pick_date.isoformat()
 
     if st.button("📨 Fetch emails for this date"):
-        if not st.session_state["token"]:
+        day_start, _ = day_range(pick_date)
+        if sync_covers(store, day_start):
+            # Already synced: read straight from the local store, no network
+            st.session_state["fetched_day"] = pick_date
+            st.success(f"📬 Loaded {store.count(*day_range(pick_date))} messages for {pick_date_str} from the local store")
+        elif not st.session_state["token"]:
             st.error("You must sign in first (see sidebar).")
         else:
-            with st.spinner("Fetching emails from Outlook..."):
+            with st.spinner("Syncing emails from Outlook..."):
                 try:
-                    all_msgs = list_messages(st.session_state["token"], top=top_val)
+                    # Headers only: bodies are downloaded in $batch requests when indexing
+                    sync_mailbox(
+                        st.session_state["token"], store, since=day_start, page_size=top_val, headers_only=True
+                    )
                 except Exception as e:
                     st.error(f"Error fetching emails: {e}")
-                    all_msgs = []
-
-                filtered = [
-                    m for m in all_msgs if m.get("receivedDateTime", "").startswith(pick_date_str)
-                ]
-                st.session_state["emails"] = filtered
-                st.success(f"📬 Fetched {len(filtered)} messages for {pick_date_str}")
-
-    # quick summary / preview
-    if st.session_state["emails"]:
-        st.markdown("**Preview of fetched emails (first 10)**")
-        for i, m in enumerate(st.session_state["emails"][:10]):
-            subject = m.get("subject", "(no subject)")
-            sender = m.get("from", {}).get("emailAddress", {}).get("address", "")
-            received = m.get("receivedDateTime", "")
-            st.write(f"**{i+1}.** {subject} — `{sender}` — {received}")
-
-        # ✅ FIXED block — auto-refreshes after embedding
+                else:
+                    st.success(f"📬 Fetched {store.count(*day_range(pick_date))} messages for {pick_date_str}")
+                # Whatever was synced before a failure is still in the store: preview it
+                st.session_state["fetched_day"] = pick_date
+
+    # quick summary / preview: header rows only, bodies stay on disk
+    fetched_day = st.session_state["fetched_day"]
+    fetched_count = store.count(*day_range(fetched_day)) if fetched_day else 0
+    if fetched_count:
+        st.markdown(f"**Preview of fetched emails for {fetched_day} (first 10 of {fetched_count})**")
+        for i, row in enumerate(store.rows(*day_range(fetched_day), limit=10)):
+            st.write(f"**{i+1}.** {row.subject or '(no subject)'} — `{row.sender}` — {row.received}")
+
+        # Indexing runs as a background job: the page stays responsive, and
+        # QA works against whatever is already indexed while it runs
         if st.button("🧠 Index these emails (create embeddings & Chroma)"):
-            with st.spinner("Creating documents & embeddings... (this may take a while)"):
-                try:
-                    docs = emails_to_documents(st.session_state["emails"])
-                    persist_dir = f"chroma_db_{pick_date_str}"
-                    st.session_state["chroma_dir"] = persist_dir
-                    make_or_load_chroma(docs, persist_dir=persist_dir)
-                    st.success("✅ Indexing complete. Ready for QA.")
-                    st.toast("Reloading UI to activate Q&A...", icon="🔄")
-                    st.rerun()
-                except Exception as e:
-                    st.error(f"Indexing failed: {e}")
+            # Stream the day's messages from the local store into the shared index;
+            # pruning is limited to this day so other indexed days are kept
+            start, end = day_range(fetched_day)
+            token = st.session_state["token"]
+            options = {}
+            if token:
+                pages = lambda: iter_pages_with_bodies(token, store, start, end)
+                # Attachment text is streamed in for the messages that actually get (re)indexed
+                options["enrich"] = AttachmentIngestor(token).enrich
+            else:
+                pages = lambda: store.iter_pages(start, end)  # offline: only bodies already stored
+            job = start_job(
+                pages, persist_dir=INDEX_DIR, scope=(start, end),
+                total=fetched_count, label=fetched_day.isoformat(), **options,
+            )
+            st.session_state["chroma_dir"] = INDEX_DIR
+            st.toast(f"Indexing {job.label} in the background...", icon="🧠")
     else:
         st.info("No fetched emails yet. Pick a date and click 'Fetch emails'.")
 
+    index_job_panel()
+
 # ---------------- RIGHT COLUMN ----------------
 with col2:
     st.header("2️⃣ Ask questions (natural language)")
@@ -123,20 +211,20 @@ with col2:
     if st.session_state.get("chroma_dir") is None:
         st.info("⚠️ Index a date's emails first (left column).")
     else:
-        # Load QA chain (if not already loaded)
-        if st.session_state["qa_objs"] is None:
+        # Attach to the shared retrieval service (opened once per process, not per session)
+        if st.session_state["service"] is None:
             with st.spinner("Loading QA chain and retriever..."):
                 try:
-                    qa, retriever, llm, db = load_qa_chain(persist_dir=st.session_state["chroma_dir"])
-                    st.session_state["qa_objs"] = (qa, retriever, llm, db)
+                    st.session_state["service"] = get_service(st.session_state["chroma_dir"])
                     st.success("✅ QA chain loaded.")
                 except Exception as e:
                     st.error(f"Failed to load QA chain: {e}")
-                    st.session_state["qa_objs"] = None
+                    st.session_state["service"] = None
 
-        if st.session_state["qa_objs"]:
-            qa, retriever, llm, db = st.session_state["qa_objs"]
-            query = st.text_area("💬 Ask a question about today's emails", height=120)
+        if st.session_state["service"]:
+            service = st.session_state["service"]
+            user = st.session_state["user_id"]
+            query = st.text_area("💬 Ask a question about your indexed emails", height=120)
 
             colq1, colq2 = st.columns([1, 1])
             with colq1:
@@ -144,18 +232,32 @@ with col2:
                     if not query.strip():
                         st.warning("Type a question first.")
                     else:
-                        with st.spinner("🤔 Thinking..."):
-                            try:
-                                answer = smart_answer(query, retriever, llm)
-                                st.markdown("### 🤖 Answer:")
-                                st.write(answer)
-                            except Exception as e:
-                                st.error(f"Error while answering: {e}")
+                        try:
+                            answer_stats = {}
+                            st.markdown("### 🤖 Answer:")
+
+                            def show_sources(citations):
+                                st.markdown("**Sources**\n" + "\n".join(f"- {c}" for c in citations))
+
+                            st.write_stream(service.stream(
+                                query, user=user, stats=answer_stats, on_citations=show_sources,
+                            ))
+                            timing = f"first token {answer_stats.get('ttft', 0):.2f}s, total {answer_stats.get('elapsed', 0):.2f}s"
+                            if answer_stats.get("cached"):
+                                st.caption(f"⚡ Cached answer (similarity {answer_stats['similarity']:.2f}) — {timing}")
+                            elif "prompt_tokens" in answer_stats:
+                                st.caption(f"Prompt: {answer_stats['prompt_tokens']} tokens — {timing}")
+                            else:
+                                st.caption(timing)
+                        except ServiceBusy as e:
+                            st.warning(f"⏳ {e}")
+                        except Exception as e:
+                            st.error(f"Error while answering: {e}")
             with colq2:
                 if st.button("📄 Show top retrieved docs"):
                     with st.spinner("Retrieving top docs..."):
                         try:
-                            hits = retriever.get_relevant_documents(query or "summary")
+                            hits = service.retrieve(query or "summary", user=user)
                             st.markdown("### Top retrieved documents")
                             for i, h in enumerate(hits[:8], 1):
                                 st.write(
@@ -165,6 +267,8 @@ with col2:
                                 )
                                 snippet = (h.page_content or "")[:500].replace("\n", " ")
                                 st.caption(snippet)
+                        except ServiceBusy as e:
+                            st.warning(f"⏳ {e}")
                         except Exception as e:
                             st.error(f"Error retrieving docs: {e}")
 
@@ -174,28 +278,52 @@ col_a, col_b = st.columns([1, 1])
 
 with col_a:
     st.header("💾 Export & Save")
-    if st.session_state.get("emails"):
-        data = json.dumps(st.session_state["emails"], indent=2)
-        st.download_button(
-            "⬇️ Download fetched emails (JSON)",
-            data=data,
-            file_name=f"emails_{pick_date_str}.json",
-            mime="application/json",
-        )
+    if fetched_count:
+        # Built only on request, streamed from the store into a gzipped JSON-lines file
+        path = os.path.join(tempfile.gettempdir(), f"emails_{fetched_day.isoformat()}.jsonl.gz")
+        if st.button("📦 Prepare export"):
+            with st.spinner("Writing export..."):
+                written = store.export(path, *day_range(fetched_day))
+            st.session_state["export_path"] = path
+            st.caption(f"{written} messages, {os.path.getsize(path) / 1024:.0f} KiB compressed")
+        if st.session_state.get("export_path") == path and os.path.exists(path):
+            with open(path, "rb") as f:
+                st.download_button(
+                    "⬇️ Download fetched emails (JSON lines, gzip)",
+                    data=f,
+                    file_name=os.path.basename(path),
+                    mime="application/gzip",
+                )
 
 with col_b:
     st.header("🧩 Debug / Info")
     if st.button("Show session info"):
         st.write({
             "token_present": bool(st.session_state.get("token")),
-            "num_fetched_emails": len(st.session_state.get("emails", [])),
+            "num_fetched_emails": fetched_count,
             "chroma_dir": st.session_state.get("chroma_dir"),
-            "qa_loaded": bool(st.session_state.get("qa_objs")),
+            "user_id": st.session_state.get("user_id"),
+            "qa_loaded": bool(st.session_state.get("service")),
+            "service": st.session_state["service"].stats() if st.session_state.get("service") else None,
         })
 
+    st.markdown("**Per-stage timings** (since process start)")
+    breakdown = metrics.breakdown()
+    if breakdown:
+        st.dataframe(breakdown, use_container_width=True)
+    else:
+        st.caption("Nothing measured yet.")
+    colm1, colm2 = st.columns([1, 1])
+    with colm1:
+        if st.button("📈 Export metrics"):
+            st.success(f"Wrote {metrics.write_prometheus()} and {metrics.write_jsonl('metrics.jsonl')}")
+    with colm2:
+        if st.button("♻️ Reset metrics"):
+            metrics.reset()
+
 st.markdown("""
 **Notes:**
-- Embeddings are stored in the folder named `chroma_db_<date>`.
+- Embeddings for every indexed date are stored in one index folder, `chroma_db`.
 - Use the sidebar **Sign in** button to authenticate via device code.
-- If embedding many emails, it may take a few minutes — please wait patiently.
+- Indexing runs in the background: you can keep asking questions, cancel it, and resume later.
 """)
@@ -0,0 +1,281 @@
+# attachments.py — stream message attachments to a spool and extract their text with bounded memory
+import os
+import re
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from xml.etree.ElementTree import iterparse
+
+import requests
+
+import graph_utils
+from graph_utils import (
+    THROTTLE_ATTEMPTS, auth_headers, fetch_controller, get_page, retry_after_seconds, session_for,
+)
+from metrics import incr, span
+from raganizer import clean_html_fast
+
+ATTACHMENT_TYPES = set(os.getenv("ATTACHMENT_TYPES", "pdf,docx,pptx,xlsx,txt,csv,md,html,htm").split(","))
+ATTACHMENT_MAX_MB = float(os.getenv("ATTACHMENT_MAX_MB", "25"))  # larger attachments are skipped
+# Ceiling on attachment bytes being downloaded / extracted at once, across all workers
+ATTACHMENT_MEMORY_MB = float(os.getenv("ATTACHMENT_MEMORY_MB", "128"))
+ATTACHMENT_WORKERS = int(os.getenv("ATTACHMENT_WORKERS", "4"))
+ATTACHMENT_MAX_CHARS = int(os.getenv("ATTACHMENT_MAX_CHARS", "100000"))  # extracted text kept per attachment
+SPOOL_DIR = os.getenv("ATTACHMENT_SPOOL_DIR") or tempfile.gettempdir()
+STREAM_CHUNK = 64 * 1024
+MAX_EXPANSION = 50  # a zip member may unpack to at most this × the attachment size
+
+ATTACHMENT_FIELDS = "id,name,contentType,size,isInline"
+_FILE_ATTACHMENT = "#microsoft.graph.fileAttachment"
+_SPACES = re.compile(r"[ \t\r\f\v]+")
+_warned = set()
+
+
+class ByteBudget:
+    """Counting semaphore over bytes: acquire(n) blocks while `n` more would exceed the ceiling."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, n):
+        n = min(n, self.limit)  # a single item may always run on its own
+        with self._cond:
+            self._cond.wait_for(lambda: self.used + n <= self.limit)
+            self.used += n
+        return n
+
+    def release(self, n):
+        with self._cond:
+            self.used -= n
+            self._cond.notify_all()
+
+
+def extension(name):
+    return os.path.splitext(name or "")[1].lower().lstrip(".")
+
+
+def wanted(attachment, max_bytes=None):
+    """Skip reason for a listed attachment, or None if it should be ingested."""
+    max_bytes = max_bytes or ATTACHMENT_MAX_MB * 1024 * 1024
+    if attachment.get("@odata.type", _FILE_ATTACHMENT) != _FILE_ATTACHMENT:
+        return "not a file"
+    if attachment.get("isInline"):
+        return "inline"
+    if extension(attachment.get("name")) not in ATTACHMENT_TYPES:
+        return "type"
+    if (attachment.get("size") or 0) > max_bytes:
+        return "size"
+    return None
+
+
+# --- text extraction (from the spooled file, never from an in-memory blob) ---
+def _limit(parts, max_chars):
+    text = _SPACES.sub(" ", "".join(parts))
+    return re.sub(r"\n\s*\n+", "\n\n", text).strip()[:max_chars]
+
+
+def _xml_text(stream, text_tag, break_tag, max_chars):
+    """Text of every `text_tag` element, a newline after each `break_tag`; elements are freed as parsed."""
+    parts, size = [], 0
+    for _, elem in iterparse(stream, events=("end",)):
+        tag = elem.tag.rsplit("}", 1)[-1]
+        if tag == text_tag and elem.text:
+            parts.append(elem.text)
+            size += len(elem.text)
+        elif tag == break_tag:
+            parts.append("\n")
+            elem.clear()
+        if size >= max_chars:
+            break
+    return parts
+
+
+def _office_text(path, members, text_tag, break_tag, max_chars, max_member_bytes):
+    parts = []
+    with zipfile.ZipFile(path) as zf:
+        names = sorted((n for n in zf.namelist() if members(n)),
+                       key=lambda n: [int(d) if d.isdigit() else d for d in re.split(r"(\d+)", n)])
+        for name in names:
+            if zf.getinfo(name).file_size > max_member_bytes:
+                raise ValueError(f"{name} unpacks to more than {max_member_bytes} bytes")
+            with zf.open(name) as stream:
+                parts += _xml_text(stream, text_tag, break_tag, max_chars)
+            parts.append("\n\n")
+            if sum(map(len, parts)) >= max_chars:
+                break
+    return _limit(parts, max_chars)
+
+
+def _pdf_text(path, max_chars):
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        if "pdf" not in _warned:
+            _warned.add("pdf")
+            print("⚠️ pypdf is not installed; PDF attachments are skipped (pip install pypdf).")
+        return None
+    parts, size = [], 0
+    for page in PdfReader(path).pages:  # pages are parsed one at a time from the file
+        text = page.extract_text() or ""
+        parts.append(text + "\n\n")
+        size += len(text)
+        if size >= max_chars:
+            break
+    return _limit(parts, max_chars)
+
+
+def _plain_text(path, max_chars):
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        return f.read(max_chars)
+
+
+def extract_text(path, name, max_chars=ATTACHMENT_MAX_CHARS):
+    """Plain text of a spooled attachment by file type, at most `max_chars`; None if unsupported."""
+    ext = extension(name)
+    member_limit = max(os.path.getsize(path), 1) * MAX_EXPANSION
+    if ext == "docx":
+        return _office_text(path, lambda n: n == "word/document.xml", "t", "p", max_chars, member_limit)
+    if ext == "pptx":
+        return _office_text(path, lambda n: re.fullmatch(r"ppt/slides/slide\d+\.xml", n), "t", "p",
+                            max_chars, member_limit)
+    if ext == "xlsx":
+        return _office_text(path, lambda n: n == "xl/sharedStrings.xml", "t", "si", max_chars, member_limit)
+    if ext == "pdf":
+        return _pdf_text(path, max_chars)
+    if ext in ("html", "htm"):
+        return clean_html_fast(_plain_text(path, max_chars * 4))[:max_chars]
+    if ext in ("txt", "csv", "md"):
+        return _plain_text(path, max_chars)
+    return None
+
+
+# --- Graph ---
+def list_attachments(access_token, message_id, controller=None):
+    """Attachment metadata of one message (no content)."""
+    url = f"{graph_utils.GRAPH_BASE}/me/messages/{quote(message_id, safe='=-_')}/attachments"
+    data = get_page(url, auth_headers(access_token, text_bodies=False), {"$select": ATTACHMENT_FIELDS},
+                    session=session_for(access_token), controller=controller)
+    return data.get("value", [])
+
+
+def download_attachment(access_token, message_id, attachment_id, spool_dir=SPOOL_DIR, controller=None,
+                        max_bytes=None):
+    """
+    Stream an attachment's raw bytes ($value) into a spool file, STREAM_CHUNK at
+    a time; returns the file's path (the caller deletes it). Throttling is backed
+    off like get_page; a body longer than `max_bytes` is abandoned.
+    """
+    url = (f"{graph_utils.GRAPH_BASE}/me/messages/{quote(message_id, safe='=-_')}"
+           f"/attachments/{quote(attachment_id, safe='=-_')}/$value")
+    max_bytes = max_bytes or ATTACHMENT_MAX_MB * 1024 * 1024
+    session = session_for(access_token)
+    controller = controller or fetch_controller()
+    headers = auth_headers(access_token, text_bodies=False)
+    for attempt in range(THROTTLE_ATTEMPTS):
+        with controller.slot(), span("graph.attachment") as s:
+            with session.get(url, headers=headers, stream=True, timeout=120) as r:
+                throttled = r.status_code == 429 or (r.status_code == 503 and "Retry-After" in r.headers)
+                if not throttled:
+                    r.raise_for_status()
+                    fd, path = tempfile.mkstemp(prefix="attachment-", dir=spool_dir)
+                    written = 0
+                    try:
+                        with os.fdopen(fd, "wb") as f:
+                            for block in r.iter_content(STREAM_CHUNK):
+                                written += len(block)
+                                if written > max_bytes:
+                                    raise ValueError(f"attachment larger than {max_bytes} bytes")
+                                f.write(block)
+                    except BaseException:
+                        os.remove(path)
+                        raise
+                    s["bytes"] = written
+                    return path
+                retry_after = retry_after_seconds(r)
+        time.sleep(controller.on_throttle(retry_after, attempt))
+    raise requests.exceptions.RetryError(f"Still throttled after {THROTTLE_ATTEMPTS} attempts: {url}")
+
+
+class AttachmentIngestor:
+    """
+    Fills `message["attachments"]` with [{"name", "contentType", "size", "text"}]
+    for messages that have attachments. Attachments are listed per message,
+    filtered by type and size, streamed to the spool and extracted by a
+    worker pool; a ByteBudget keeps the attachments in flight (downloading or
+    being extracted) under ATTACHMENT_MEMORY_MB. Spool files are deleted
+    as soon as their text is out. Pass `ingestor.enrich` to run_index_pipeline.
+    """
+
+    def __init__(self, access_token, workers=ATTACHMENT_WORKERS, memory_mb=ATTACHMENT_MEMORY_MB,
+                 max_mb=ATTACHMENT_MAX_MB, spool_dir=SPOOL_DIR, controller=None):
+        self.access_token = access_token
+        self.workers = workers
+        self.max_bytes = int(min(max_mb, memory_mb) * 1024 * 1024)
+        self.budget = ByteBudget(int(memory_mb * 1024 * 1024))
+        self.spool_dir = spool_dir
+        self.controller = controller or fetch_controller()
+        self.stats = {"listed": 0, "ingested": 0, "skipped": 0, "failed": 0, "bytes": 0}
+        self._lock = threading.Lock()
+        os.makedirs(spool_dir, exist_ok=True)
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+        incr(f"attachments.{key}", n)
+
+    def _ingest(self, message_id, attachment):
+        held = self.budget.acquire(attachment.get("size") or STREAM_CHUNK)
+        path = None
+        try:
+            path = download_attachment(self.access_token, message_id, attachment["id"], self.spool_dir,
+                                       self.controller, self.max_bytes)
+            with span("attachments.extract", bytes=os.path.getsize(path)):
+                text = extract_text(path, attachment.get("name"))
+            if not text:
+                self._count("skipped")
+                return None
+            self._count("ingested")
+            self._count("bytes", os.path.getsize(path))
+            return {"name": attachment.get("name"), "contentType": attachment.get("contentType"),
+                    "size": attachment.get("size"), "text": text}
+        except Exception as e:
+            self._count("failed")
+            print(f"⚠️ Attachment {attachment.get('name')!r} of {message_id} failed: {e}")
+            return None
+        finally:
+            if path and os.path.exists(path):
+                os.remove(path)
+            self.budget.release(held)
+
+    def _list(self, message):
+        try:
+            listed = list_attachments(self.access_token, message["id"], self.controller)
+        except Exception as e:
+            self._count("failed")
+            print(f"⚠️ Could not list attachments of {message['id']}: {e}")
+            return []
+        self._count("listed", len(listed))
+        keep = [a for a in listed if wanted(a, self.max_bytes) is None]
+        self._count("skipped", len(listed) - len(keep))
+        return keep
+
+    def enrich(self, messages):
+        """Attach extracted attachment text to `messages` (in place) and return them."""
+        todo = [m for m in messages if m.get("hasAttachments") and m.get("id") and "attachments" not in m]
+        if not todo:
+            return messages
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as pool:
+            listings = list(pool.map(self._list, todo))
+            jobs = [(m, pool.submit(self._ingest, m["id"], a)) for m, listed in zip(todo, listings) for a in listed]
+            for m in todo:
+                m["attachments"] = []
+            for m, job in jobs:
+                result = job.result()
+                if result:
+                    m["attachments"].append(result)
+        return messages
@@ -1,6 +1,8 @@
 # auth_utils.py
 import msal, json
 import os
+import threading
+import time
 from dotenv import load_dotenv
 load_dotenv()  # <-- ensures .env is read from current directory
 
@@ -9,44 +11,154 @@ print("CLIENT_ID:", os.getenv("AZ_CLIENT_ID"))
 print("TENANT_ID:", os.getenv("AZ_TENANT_ID"))
 
 CACHE_FILE = "token_cache.json"
+SCOPES = ["Mail.Read", "User.Read"]
+REFRESH_MARGIN = 300  # seconds before expiry the token is renewed in the background
+EXPIRY_SKEW = 30  # a token this close to expiry is no longer handed out
+RETRY_INTERVAL = 30  # seconds between background refresh attempts after a failure
 
-def get_access_token(scopes=["Mail.Read", "User.Read"]):
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+class TokenManager:
+    """
+    Keeps one MSAL app and token cache in memory for the process.
+    Calling the manager returns a valid access token without touching disk;
+    a daemon thread renews it REFRESH_MARGIN seconds before it expires, so
+    long fetches never wait on re-authentication. The cache file is written
+    atomically, and only when MSAL changed it. Pass the manager itself
+    wherever graph_utils expects an access token.
+    """
+
+    def __init__(self, scopes=SCOPES, cache_file=CACHE_FILE):
+        self.scopes = list(scopes)
+        self.cache_file = cache_file
+        self.cache = msal.SerializableTokenCache()
+        if os.path.exists(cache_file):
+            with open(cache_file, "r") as f:
+                self.cache.deserialize(f.read())
+        authority = f"https://login.microsoftonline.com/{os.getenv('AZ_TENANT_ID')}"
+        self.app = msal.PublicClientApplication(os.getenv("AZ_CLIENT_ID"), authority=authority,
+                                                token_cache=self.cache)
+        self._lock = threading.RLock()
+        self._token = None
+        self._expires_at = 0.0
+        self._stop = threading.Event()
+        self._refresher = None
+
+    def __call__(self):
+        """The current access token; blocks only if it has actually expired."""
+        token, expires_at = self._token, self._expires_at
+        if token and time.time() < expires_at - EXPIRY_SKEW:
+            return token
+        with self._lock:
+            if self._token and time.time() < self._expires_at - EXPIRY_SKEW:
+                return self._token
+            if not self._acquire_silent():
+                raise ValueError("❌ Not signed in (or the session expired) — sign in again.")
+            return self._token
+
+    def __bool__(self):
+        return self._token is not None
+
+    def sign_in(self, interactive=True):
+        """Use the cached account if possible, otherwise run the device code flow."""
+        with self._lock:
+            if self._acquire_silent():
+                print("✅ Using cached access token.")
+                return self._token
+            if not interactive:
+                raise ValueError("❌ Could not get access token.")
+
+            print("🔑 No valid token found. Initiating device code flow...")
+            flow = self.app.initiate_device_flow(scopes=self.scopes)
+            if "user_code" not in flow:
+                raise ValueError("Failed to initiate device flow.")
+            print(f"Go to {flow['verification_uri']} and enter code: {flow['user_code']}")
+            result = self.app.acquire_token_by_device_flow(flow)
+            if not self._accept(result):
+                raise ValueError("❌ Could not get access token.")
+            print("✅ Got new access token!")
+            return self._token
+
+    def refresh(self, failed_token=None):
+        """
+        Force a new token (after a 401). Concurrent callers that saw the same
+        rejected token share one refresh.
+        """
+        with self._lock:
+            if failed_token and self._token and failed_token != self._token:
+                return self._token
+            if not self._acquire_silent(force=True):
+                raise ValueError("❌ Token refresh failed — sign in again.")
+            return self._token
+
+    def session(self):
+        """Pooled requests session that signs every Graph request with this manager."""
+        from graph_utils import session_for
+
+        return session_for(self)
+
+    def close(self):
+        self._stop.set()
+
+    def _acquire_silent(self, force=False):
+        accounts = self.app.get_accounts()
+        if not accounts:
+            return False
+        result = self.app.acquire_token_silent(self.scopes, account=accounts[0], force_refresh=force)
+        return self._accept(result)
+
+    def _accept(self, result):
+        if not result or "access_token" not in result:
+            return False
+        self._token = result["access_token"]
+        self._expires_at = time.time() + int(result.get("expires_in", 3600))
+        self._save_cache()
+        self._start_refresher()
+        return True
+
+    def _save_cache(self):
+        if not self.cache.has_state_changed:
+            return
+        tmp = f"{self.cache_file}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(self.cache.serialize())
+        os.replace(tmp, self.cache_file)
+        self.cache.has_state_changed = False
+
+    def _start_refresher(self):
+        if self._refresher is None or not self._refresher.is_alive():
+            self._refresher = threading.Thread(target=self._refresh_loop, name="token-refresh", daemon=True)
+            self._refresher.start()
+
+    def _refresh_loop(self):
+        wait = max(self._expires_at - REFRESH_MARGIN - time.time(), 0)
+        while not self._stop.wait(wait):
+            try:
+                with self._lock:
+                    ok = self._acquire_silent(force=True)
+            except Exception as e:
+                print("⚠️ Background token refresh failed:", e)
+                ok = False
+            if ok:
+                wait = max(self._expires_at - REFRESH_MARGIN - time.time(), RETRY_INTERVAL)
+            else:
+                wait = RETRY_INTERVAL
+
+
+def token_manager(scopes=SCOPES):
+    """The process-wide TokenManager for `scopes`."""
+    key = tuple(scopes)
+    with _managers_lock:
+        if key not in _managers:
+            _managers[key] = TokenManager(scopes)
+        return _managers[key]
+
+
+def get_access_token(scopes=SCOPES):
     """
     Automatically retrieves or refreshes an access token.
     Caches token to token_cache.json for future runs.
     """
-    CLIENT_ID = os.getenv("AZ_CLIENT_ID")
-    TENANT_ID = os.getenv("AZ_TENANT_ID")
-    AUTHORITY = f"https://login.microsoftonline.com/{TENANT_ID}"
-
-    # Load token cache if available
-    cache = msal.SerializableTokenCache()
-    if os.path.exists(CACHE_FILE):
-        cache.deserialize(open(CACHE_FILE, "r").read())
-
-    app = msal.PublicClientApplication(CLIENT_ID, authority=AUTHORITY, token_cache=cache)
-
-    # Try to get a valid token silently
-    accounts = app.get_accounts()
-    if accounts:
-        result = app.acquire_token_silent(scopes, account=accounts[0])
-        if result and "access_token" in result:
-            print("✅ Using cached access token.")
-            return result["access_token"]
-
-    # If silent fails, initiate device code flow
-    print("🔑 No valid token found. Initiating device code flow...")
-    flow = app.initiate_device_flow(scopes=scopes)
-    if "user_code" not in flow:
-        raise ValueError("Failed to initiate device flow.")
-
-    print(f"Go to {flow['verification_uri']} and enter code: {flow['user_code']}")
-    result = app.acquire_token_by_device_flow(flow)
-
-    if "access_token" in result:
-        print("✅ Got new access token!")
-        # Save to cache
-        open(CACHE_FILE, "w").write(cache.serialize())
-        return result["access_token"]
-
-    raise ValueError("❌ Could not get access token.")
+    return token_manager(scopes).sign_in()
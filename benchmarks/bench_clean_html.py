@@ -0,0 +1,98 @@
+# bench_clean_html.py — compare clean_html_fast against the BeautifulSoup clean_html
+# Run from the repo root:  python -m benchmarks.bench_clean_html [num_emails]
+import random
+import sys
+import time
+
+from raganizer import clean_bodies, clean_html, clean_html_fast
+
+WORDS = ("sale offer update meeting invoice giki campus lost found library "
+         "deadline report schedule reminder newsletter event").split()
+
+
+def marketing_email(rng):
+    """Table-heavy newsletter HTML with inline CSS, a style block, tracking pixels and entities."""
+    rows = "".join(
+        f'<tr><td style="padding:8px;font-family:Arial" class="c{i}">'
+        f'<a href="https://example.com/{i}?utm=x&amp;y={i}"><b>{rng.choice(WORDS).title()}</b></a> '
+        f'{" ".join(rng.choice(WORDS) for _ in range(rng.randint(10, 40)))} &nbsp;&amp;&nbsp; 50&#37; off'
+        f'</td></tr>'
+        for i in range(rng.randint(5, 40))
+    )
+    return (
+        "<!DOCTYPE html><html><head><title>Weekly digest</title>"
+        "<style>td{color:#333} .c1{margin:0}</style>"
+        "<script>var tracking = 'x<y';</script></head><body>"
+        "<!--[if mso]><table><tr><td><![endif]-->"
+        f"<table width=\"600\">{rows}</table>"
+        '<img src="https://t.example.com/p.gif" width="1" height="1" alt="">'
+        "<p>Unsubscribe&nbsp;here</p></body></html>"
+    )
+
+
+def malformed_emails():
+    """Adversarial bodies: stray "<" by the thousand, unterminated tags, comments and scripts."""
+    return [
+        "<" * 20000,
+        "x <" * 20000,
+        '<a href="' * 5000,
+        "<!--" * 5000 + "<p>tail</p>",
+        "<p>intro</p><script>" + "var a = b < c;" * 2000,
+    ]
+
+
+# Stray "<" / ">" in prose must survive cleaning, as they do with bs4
+STRAY_BRACKETS = [
+    "<p>if a < b and c > d then</p>",
+    "<div>5 < 6 & 7 > 3</div><p>ok</p>",
+    "<p>Budget < $5k, ETA >= 2 weeks</p>",
+    "x <3 y <b>bold</b>",
+]
+
+
+def words(text):
+    return text.split()
+
+
+def main(n=500):
+    rng = random.Random(42)
+    bodies = [marketing_email(rng) for _ in range(n)]
+    total_kb = sum(len(b) for b in bodies) / 1024
+
+    start = time.perf_counter()
+    reference = [clean_html(b) for b in bodies]
+    t_ref = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fast = [clean_html_fast(b) for b in bodies]
+    t_fast = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pooled = clean_bodies({"contentType": "html", "content": b} for b in bodies)
+    t_pool = time.perf_counter() - start
+
+    # Equivalence is judged on words: the fast path only differs in whitespace
+    mismatches = sum(words(r) != words(f) for r, f in zip(reference, fast))
+    assert fast == pooled, "process-pool output differs from the serial fast path"
+
+    print(f"📨 {n} synthetic marketing emails ({total_kb:.0f} KiB of HTML)")
+    print(f"  clean_html (bs4 html.parser): {t_ref:.3f}s")
+    print(f"  clean_html_fast:              {t_fast:.3f}s  ({t_ref / t_fast:.1f}x)")
+    print(f"  clean_bodies (process pool):  {t_pool:.3f}s  ({t_ref / t_pool:.1f}x)")
+    print(f"  word-level mismatches vs bs4: {mismatches}/{n}")
+
+    # Malformed markup must stay linear and keep the text a stray "<" precedes
+    malformed = malformed_emails()
+    start = time.perf_counter()
+    for b in malformed:
+        clean_html_fast(b)
+    t_bad = time.perf_counter() - start
+    bad_mismatches = sum(words(clean_html(b)) != words(clean_html_fast(b)) for b in STRAY_BRACKETS)
+    print(f"📨 {len(malformed)} adversarial emails ({sum(map(len, malformed)) / 1024:.0f} KiB)")
+    print(f"  clean_html_fast:              {t_bad:.3f}s")
+    print(f"  stray-bracket mismatches vs bs4: {bad_mismatches}/{len(STRAY_BRACKETS)}")
+    return mismatches + bad_mismatches + (t_bad > 1.0)
+
+
+if __name__ == "__main__":
+    sys.exit(1 if main(int(sys.argv[1]) if len(sys.argv) > 1 else 500) else 0)
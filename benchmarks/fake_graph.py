@@ -0,0 +1,155 @@
+# fake_graph.py — local stand-in for Graph /me/messages with paging, latency and throttling
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+_CLAUSE_RE = re.compile(r"receivedDateTime (ge|lt) (\S+)")
+_SENDER_RE = re.compile(r"from/emailAddress/address eq '([^']*)'")
+
+
+def _matches(message, flt):
+    """Evaluate the subset of $filter that graph_utils.build_message_query produces."""
+    received = message["receivedDateTime"]
+    for op, value in _CLAUSE_RE.findall(flt):
+        if (op == "ge" and received < value) or (op == "lt" and received >= value):
+            return False
+    address = message["from"]["emailAddress"]["address"].lower()
+    sender = _SENDER_RE.search(flt)
+    if sender and address != sender.group(1):
+        return False
+    return True
+
+
+class FakeGraphServer:
+    """
+    Serves `messages` (newest first) at http://127.0.0.1:<port>/v1.0/me/messages.
+    Honours $filter / $top / $select and pages with @odata.nextLink ($skip);
+    POST /v1.0/$batch answers GET /me/messages/{id}?$select=body sub-requests.
+    Every request sleeps `latency` (± `jitter`) seconds; every `throttle_every`-th
+    request answers 429 with Retry-After and a `fail_rate` share answer 503.
+    The `Prefer: outlook.body-content-type="text"` header returns text bodies.
+    Use as a context manager; set graph_utils.GRAPH_BASE to `base_url`.
+    """
+
+    def __init__(self, messages, latency=0.02, jitter=0.01, throttle_every=0, retry_after=1,
+                 fail_rate=0.0, seed=0):
+        self.messages = messages
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.fail_rate = fail_rate
+        self.requests = 0
+        self.throttled = 0
+        self.failed = 0
+        self.by_id = {m["id"]: m for m in messages}
+        self.bytes_sent = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._httpd.server_address[1]}/v1.0"
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-graph", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _next_outcome(self):
+        with self._lock:
+            self.requests += 1
+            if self.throttle_every and self.requests % self.throttle_every == 0:
+                self.throttled += 1
+                return 429
+            if self.fail_rate and self._rng.random() < self.fail_rate:
+                self.failed += 1
+                return 503
+            return 200
+
+    def page(self, query, text_bodies):
+        flt = query.get("$filter", "")
+        top = int(query.get("$top", 10))
+        skip = int(query.get("$skip", 0))
+        fields = query.get("$select", "").split(",") if query.get("$select") else None
+        matched = [m for m in self.messages if _matches(m, flt)] if flt else self.messages
+
+        items = []
+        for m in matched[skip:skip + top]:
+            item = dict(m, body=m["textBody"] if text_bodies else m["body"])
+            item.pop("textBody", None)
+            items.append({k: v for k, v in item.items() if k == "id" or not fields or k in fields})
+        data = {"value": items}
+        if skip + top < len(matched):
+            data["@odata.nextLink"] = f"{self.base_url}/me/messages?" + urlencode({**query, "$skip": skip + top})
+        return data
+
+    def batch(self, requests):
+        """Answer body sub-requests of a JSON $batch."""
+        responses = []
+        for sub in requests:
+            mid = urlparse(sub["url"]).path.rsplit("/", 1)[-1]
+            m = self.by_id.get(mid)
+            if m is None:
+                responses.append({"id": sub["id"], "status": 404, "body": {}})
+                continue
+            text = "body-content-type=\"text\"" in (sub.get("headers") or {}).get("Prefer", "")
+            body = m["textBody"] if text else m["body"]
+            responses.append({"id": sub["id"], "status": 200, "body": {"id": mid, "body": body}})
+        return {"responses": responses}
+
+    def _handler(server):
+        class Handler(BaseHTTPRequestHandler):
+            def _begin(self, path):
+                """Simulated latency and injected failures; False if the request was answered already."""
+                delay = server.latency + server._rng.uniform(-server.jitter, server.jitter)
+                time.sleep(max(delay, 0))
+                status = server._next_outcome()
+                if urlparse(self.path).path != path:
+                    status = 404
+                if status == 200:
+                    return True
+                self.send_response(status)
+                if status == 429:
+                    self.send_header("Retry-After", str(server.retry_after))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return False
+
+            def _json(self, data):
+                body = json.dumps(data).encode("utf-8")
+                with server._lock:
+                    server.bytes_sent += len(body)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if not self._begin("/v1.0/me/messages"):
+                    return
+                query = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+                text = "body-content-type=\"text\"" in (self.headers.get("Prefer") or "")
+                self._json(server.page(query, text))
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                if self._begin("/v1.0/$batch"):
+                    self._json(server.batch(payload.get("requests", [])))
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
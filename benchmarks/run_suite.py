@@ -0,0 +1,252 @@
+# run_suite.py — offline end-to-end benchmark: fetch → clean → embed → index → retrieve → answer → concurrent users
+# Run from the repo root:  python -m benchmarks.run_suite [--sizes 200 1000] [--save-baseline]
+#
+# A synthetic mailbox is served by a local fake Graph server (paging, latency,
+# throttling); embeddings are feature-hashed and the LLM is a stub unless
+# --model is given, so runs need no tenant, network or API key. Results are
+# compared against benchmarks/baseline.json and the exit code is 1 on a regression.
+# Timings are machine-specific, so record the baseline (--save-baseline) on the
+# machine that runs the comparison, before changing code. Without one (or
+# without the benchmarked sizes in it) the suite exits with 2.
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from dateutil import parser
+
+import graph_utils
+from benchmarks.fake_graph import FakeGraphServer
+from benchmarks.stubs import HashEmbeddings, StubLLM
+from benchmarks.synthetic_mailbox import generate_mailbox
+from embedding_service import QueryBatcher
+from hybrid_retriever import HybridRetriever
+from lexical_index import LexicalIndex
+from pipeline import run_index_pipeline
+from qa import open_aggregates, retrieve, query_filter, smart_answer
+from raganizer import clean_bodies, emails_to_documents
+from retrieval_service import RetrievalService
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "baseline.json")
+DAYS = 30
+NOISE_FLOOR_MS = 5.0  # latency differences below this are ignored
+QUERIES = [
+    "where is my lost wallet?",
+    "library deadline reminder",
+    "what is my latest email?",
+    "how many emails did I get this week?",
+    "summarize the invoice emails from bank.example.net",
+    "any updates about the hostel registration payment?",
+    "emails from giki about exams",
+    "who are the top senders?",
+]
+
+
+@contextlib.contextmanager
+def quiet(enabled=True):
+    """Swallow the modules' progress prints while timing."""
+    if not enabled:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def percentiles_ms(samples):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(round(0.95 * (len(samples) - 1))))]
+    return statistics.median(samples) * 1000, p95 * 1000
+
+
+def run_size(n, args):
+    """All stages for one mailbox size; returns {metric: value}."""
+    mailbox = generate_mailbox(n, days=DAYS, seed=args.seed, dup_rate=args.dup_rate)
+    end = parser.isoparse(mailbox[0]["receivedDateTime"]) + timedelta(seconds=1)
+    start = end - timedelta(days=DAYS + 1)
+    embeddings = HashEmbeddings() if not args.model else _model_embeddings()
+    metrics = {}
+
+    server = FakeGraphServer(mailbox, latency=args.latency, throttle_every=args.throttle_every,
+                             fail_rate=args.fail_rate, seed=args.seed)
+    graph_base = graph_utils.GRAPH_BASE
+    with server, quiet(not args.verbose):
+        graph_utils.GRAPH_BASE = server.base_url
+        try:
+            # Fresh, unsaved controllers so every run starts from the same settings
+            controller = graph_utils.FetchController(tenant="benchmark", path=None)
+            messages, t = timed(graph_utils.fetch_messages_parallel, "bench-token", start, end,
+                                top=args.page_size, controller=controller)
+            full_bytes = server.bytes_sent
+
+            # Two-phase: headers for the whole range, then bodies via $batch for a tenth of them
+            controller = graph_utils.FetchController(tenant="benchmark", path=None)
+            headers, t_headers = timed(graph_utils.fetch_messages_parallel, "bench-token", start, end,
+                                       top=args.page_size, controller=controller, select=graph_utils.HEADER_FIELDS)
+            header_bytes = server.bytes_sent - full_bytes
+            wanted = [m["id"] for m in headers[::10]]
+            _, t_bodies = timed(graph_utils.fetch_bodies, "bench-token", wanted, controller=controller)
+        finally:
+            graph_utils.GRAPH_BASE = graph_base
+    metrics["fetch_per_s"] = len(messages) / t
+    metrics["headers_per_s"] = len(headers) / t_headers
+    metrics["bodies_per_s"] = len(wanted) / t_bodies
+    metrics["fetch_kib_per_100"] = full_bytes / 1024 / n * 100
+    metrics["headers_kib_per_100"] = header_bytes / 1024 / n * 100
+    metrics["graph_requests"] = server.requests
+    metrics["graph_throttled"] = server.throttled + server.failed
+    if len(messages) != n:
+        raise RuntimeError(f"fetched {len(messages)} of {n} messages")
+
+    html_bodies = [m["body"] for m in mailbox]
+    _, t = timed(clean_bodies, html_bodies)
+    metrics["clean_per_s"] = n / t
+
+    docs, t = timed(emails_to_documents, messages)
+    metrics["chunk_per_s"] = n / t
+
+    _, t = timed(embeddings.embed_documents, [d.page_content for d in docs])
+    metrics["embed_per_s"] = len(docs) / t
+
+    with tempfile.TemporaryDirectory(prefix="bench-index-") as persist_dir, quiet(not args.verbose):
+        pages = [messages[i:i + args.page_size] for i in range(0, n, args.page_size)]
+        (db, stats), t = timed(run_index_pipeline, pages, persist_dir=persist_dir, embeddings=embeddings)
+        metrics["index_per_s"] = n / t
+        # Near-duplicate collapsing: vectors actually stored vs. one per chunk
+        metrics["vectors_per_100"] = stats["embedded"] / n * 100
+        metrics["dedup_saved_pct"] = (1 - stats["embedded"] / len(docs)) * 100
+        _, metrics["reindex_s"] = timed(run_index_pipeline, pages, persist_dir=persist_dir, embeddings=embeddings)
+
+        retriever = HybridRetriever(vectorstore=db, lexical=LexicalIndex(persist_dir), search_kwargs={"k": 8})
+        aggregates = open_aggregates(persist_dir, db)
+        llm = StubLLM(first_token=args.llm_latency)
+
+        samples = [timed(retrieve, retriever, q, query_filter(q))[1] for _ in range(args.repeat) for q in QUERIES]
+        metrics["retrieve_p50_ms"], metrics["retrieve_p95_ms"] = percentiles_ms(samples)
+
+        samples = [timed(smart_answer, q, retriever, llm, aggregates)[1] for _ in range(args.repeat) for q in QUERIES]
+        metrics["answer_p50_ms"], metrics["answer_p95_ms"] = percentiles_ms(samples)
+
+        # `--users` sessions querying one shared service at once (query embeddings micro-batched)
+        service = RetrievalService(persist_dir, embeddings=QueryBatcher(embeddings), llm=llm)
+        work = [(f"user{u}", q) for _ in range(args.repeat) for q in QUERIES for u in range(args.users)]
+        with ThreadPoolExecutor(max_workers=args.users) as pool:
+            samples = list(pool.map(lambda job: timed(service.retrieve, job[1], job[0])[1], work))
+        metrics["concurrent_p50_ms"], metrics["concurrent_p95_ms"] = percentiles_ms(samples)
+    return metrics
+
+
+def _model_embeddings():
+    from embedding_service import LazyEmbeddings
+
+    return LazyEmbeddings()  # the real model, without the embedding cache
+
+
+def compare(results, baseline, tolerance):
+    """Regressions beyond `tolerance`: *_per_s must not drop, *_ms / *_s must not grow."""
+    regressions = []
+    for size, metrics in results.items():
+        for name, value in metrics.items():
+            old = baseline.get(size, {}).get(name)
+            if not old:
+                continue
+            if name.endswith("_per_s"):
+                if value < old * (1 - tolerance):
+                    regressions.append((size, name, old, value))
+            elif name.endswith(("_ms", "_s")):
+                # Timer noise on very short stages is not a regression
+                floor = NOISE_FLOOR_MS if name.endswith("_ms") else NOISE_FLOOR_MS / 1000
+                if value > old * (1 + tolerance) and value - old > floor:
+                    regressions.append((size, name, old, value))
+    return regressions
+
+
+def print_table(results, baseline):
+    names = list(next(iter(results.values())))
+    print(f"{'metric':<18}" + "".join(f"{size:>22}" for size in results))
+    for name in names:
+        row = f"{name:<18}"
+        for size, metrics in results.items():
+            old = baseline.get(size, {}).get(name)
+            delta = f" ({(metrics[name] / old - 1) * 100:+.0f}%)" if old else ""
+            row += f"{metrics[name]:>14.2f}{delta:>8}"
+        print(row)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Offline end-to-end benchmark against a fake Graph server.")
+    ap.add_argument("--sizes", type=int, nargs="+", default=[200, 1000])
+    ap.add_argument("--repeat", type=int, default=3, help="passes over the query set")
+    ap.add_argument("--page-size", type=int, default=100)
+    ap.add_argument("--latency", type=float, default=0.02, help="fake Graph seconds per request")
+    ap.add_argument("--throttle-every", type=int, default=0, help="answer every Nth request with 429")
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="share of requests answered with 503")
+    ap.add_argument("--users", type=int, default=8, help="concurrent sessions for the shared-service stage")
+    ap.add_argument("--llm-latency", type=float, default=0.05, help="stub LLM seconds to first token")
+    ap.add_argument("--model", action="store_true", help="embed with the real model instead of hashing")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--dup-rate", type=float, default=0.3, help="share of near-duplicate messages in the mailbox")
+    ap.add_argument("--baseline", default=BASELINE_FILE)
+    ap.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    ap.add_argument("--tolerance", type=float, default=0.25)
+    ap.add_argument("--output", help="also write the results JSON here")
+    ap.add_argument("--verbose", action="store_true")
+    args = ap.parse_args(argv)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f).get("results", {})
+    missing = [str(n) for n in args.sizes if str(n) not in baseline]
+    if missing and not args.save_baseline:
+        # Fail before spending minutes on a run there is nothing to compare with
+        print(f"❌ No baseline for {', '.join(missing)} messages in {args.baseline}: nothing to compare "
+              f"against. Record one first with --save-baseline (same machine, code before your change).")
+        return 2
+
+    results = {}
+    for n in args.sizes:
+        print(f"📨 Benchmarking a {n}-message mailbox...")
+        results[str(n)] = run_size(n, args)
+
+    print_table(results, baseline)
+
+    record = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("baseline", "save_baseline", "output", "verbose")},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(record, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(record, f, indent=2)
+        print(f"💾 Baseline saved to {args.baseline}")
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    for size, name, old, new in regressions:
+        print(f"❌ {size} messages: {name} regressed {old:.1f} → {new:.1f}")
+    if not regressions:
+        print(f"✅ No regressions beyond {args.tolerance:.0%} of the baseline.")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,60 @@
+# stubs.py — deterministic stand-ins for the embedding model and the chat LLM
+import hashlib
+import math
+import re
+import time
+
+_WORD_RE = re.compile(r"\w+")
+
+
+class HashEmbeddings:
+    """
+    Feature-hashed bag of words, L2-normalised. No model download, identical
+    vectors on every run; keeps vector search meaningful for exact-word queries.
+    """
+
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def _embed(self, text):
+        vector = [0.0] * self.dim
+        for word in _WORD_RE.findall(text.lower()):
+            h = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[h % self.dim] += 1.0 if h & (1 << 63) else -1.0
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+
+    def embed_documents(self, texts):
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+class _Message:
+    def __init__(self, content):
+        self.content = content
+
+
+class StubLLM:
+    """ChatOpenAI look-alike: fixed answer after `first_token` seconds, then `per_token` per word."""
+
+    def __init__(self, first_token=0.05, per_token=0.002):
+        self.first_token = first_token
+        self.per_token = per_token
+        self.prompt_chars = 0
+
+    def _words(self, prompt):
+        self.prompt_chars += len(prompt)
+        return f"Based on {prompt.count('[')} excerpt(s), here is a short stub answer.".split()
+
+    def invoke(self, prompt):
+        words = self._words(str(prompt))
+        time.sleep(self.first_token + self.per_token * len(words))
+        return _Message(" ".join(words))
+
+    def stream(self, prompt):
+        time.sleep(self.first_token)
+        for word in self._words(str(prompt)):
+            time.sleep(self.per_token)
+            yield _Message(word + " ")
@@ -0,0 +1,88 @@
+# synthetic_mailbox.py — deterministic fake mailbox in Graph /me/messages JSON shape
+import random
+from datetime import datetime, timedelta, timezone
+
+WORDS = ("sale offer update meeting invoice giki campus lost found library deadline report "
+         "schedule reminder newsletter event exam project wallet keys grades lecture hostel "
+         "payment registration seminar workshop").split()
+DOMAINS = ["giki.edu.pk", "example.com", "newsletter.example.org", "bank.example.net", "gmail.com"]
+SENDERS = ["registrar", "noreply", "ali", "sara", "it-support", "library", "events", "accounts"]
+SUBJECTS = [
+    "Lost {w} found near the {w2}", "Reminder: {w} deadline", "Weekly {w} newsletter",
+    "Invoice for {w}", "Re: {w} meeting tomorrow", "Fwd: {w} schedule", "{w} and {w2} update",
+]
+
+
+def _sentence(rng, n):
+    return " ".join(rng.choice(WORDS) for _ in range(n)).capitalize() + "."
+
+
+def _html(paragraphs, rng):
+    """Newsletter-style HTML: style block, layout table, links, entities, a tracking pixel."""
+    rows = "".join(
+        f'<tr><td style="padding:8px;font-family:Arial" class="c{i}">'
+        f'<a href="https://example.com/{i}?utm=x&amp;y={i}"><b>{rng.choice(WORDS).title()}</b></a> '
+        f"{p} &nbsp;&amp;&nbsp;</td></tr>"
+        for i, p in enumerate(paragraphs)
+    )
+    return (
+        "<html><head><style>td{color:#333} .c1{margin:0}</style>"
+        "<script>var tracking = 'x<y';</script></head><body>"
+        f'<table width="600">{rows}</table>'
+        '<img src="https://t.example.com/p.gif" width="1" height="1" alt="">'
+        "<p>Unsubscribe&nbsp;here</p></body></html>"
+    )
+
+
+def _reply_text(paragraphs, rng):
+    """Plain reply with a quoted history and a signature, like a typical thread message."""
+    quoted = "\n".join("> " + _sentence(rng, 10) for _ in range(rng.randint(2, 8)))
+    return (
+        "\n\n".join(paragraphs)
+        + f"\n\nOn Mon, 13 Oct 2025 at 09:00, {rng.choice(SENDERS)} wrote:\n{quoted}"
+        + "\n\n--\nSent from my phone"
+    )
+
+
+def generate_mailbox(n, end=None, days=30, seed=42, dup_rate=0.0):
+    """
+    `n` messages spread over the `days` days before `end`, newest first.
+    Each message carries both an HTML and a plain-text rendering of its body
+    (`body` / `textBody`); the fake Graph server picks one per request.
+    A `dup_rate` share are near-copies of an earlier message (same text plus a
+    fresh reference number), like repeated newsletters and notifications.
+    """
+    rng = random.Random(seed)
+    end = end or datetime(2025, 10, 31, tzinfo=timezone.utc)
+    span = days * 86400
+    messages = []
+    for i in range(n):
+        received = end - timedelta(seconds=rng.randrange(span))
+        if dup_rate and messages and rng.random() < dup_rate:
+            original = rng.choice(messages[:20])  # a small pool of recurring senders
+            address = original["from"]["emailAddress"]["address"]
+            subject = original["subject"]
+            paragraphs = original["_paragraphs"] + [f"Reference {rng.randrange(10 ** 6)}."]
+            html = original["body"]["contentType"] == "html"
+        else:
+            address = f"{rng.choice(SENDERS)}@{rng.choice(DOMAINS)}"
+            subject = rng.choice(SUBJECTS).format(w=rng.choice(WORDS), w2=rng.choice(WORDS))
+            paragraphs = [_sentence(rng, rng.randint(8, 40)) for _ in range(rng.randint(1, 12))]
+            html = rng.random() < 0.6
+        text = "\n\n".join(paragraphs) if html else _reply_text(paragraphs, rng)
+        messages.append({
+            "id": f"msg-{seed}-{i:06d}",
+            "subject": subject,
+            "body": {"contentType": "html", "content": _html(paragraphs, rng)} if html
+                    else {"contentType": "text", "content": text},
+            "textBody": {"contentType": "text", "content": text},
+            "bodyPreview": text[:255],
+            "from": {"emailAddress": {"name": address.split("@")[0], "address": address}},
+            "receivedDateTime": received.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "conversationId": f"conv-{seed}-{rng.randrange(max(n // 3, 1)):06d}",
+            "_paragraphs": paragraphs,
+        })
+    for m in messages:
+        del m["_paragraphs"]
+    messages.sort(key=lambda m: m["receivedDateTime"], reverse=True)
+    return messages
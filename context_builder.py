@@ -0,0 +1,124 @@
+# context_builder.py — token-budgeted, deduplicated email context for the LLM
+import os
+import re
+from functools import lru_cache
+
+CONTEXT_MODEL = "gpt-4o-mini"
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+MAX_PASSAGE_TOKENS = int(os.getenv("MAX_PASSAGE_TOKENS", "300"))
+MIN_PASSAGE_TOKENS = 40  # don't bother adding a passage trimmed below this
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n+")
+_WORD_RE = re.compile(r"\w+")
+
+PROMPT_TEMPLATE = (
+    "Answer the question using only these email excerpts. "
+    "Cite excerpts by their [number].\n\n{context}\n\nQuestion: {query}"
+)
+
+
+class _ApproxEncoding:
+    """Word-piece stand-in when tiktoken or its BPE files are unavailable (e.g. offline)."""
+
+    _PIECE_RE = re.compile(r"\w+|[^\w\s]")
+
+    def encode(self, text):
+        return self._PIECE_RE.findall(text)
+
+    def decode(self, pieces):
+        return " ".join(pieces)
+
+
+@lru_cache(maxsize=None)
+def _encoding(model=CONTEXT_MODEL):
+    try:
+        import tiktoken
+
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        print(f"⚠️ tiktoken unavailable ({type(e).__name__}); estimating token counts.")
+        return _ApproxEncoding()
+
+
+def count_tokens(text, model=CONTEXT_MODEL):
+    return len(_encoding(model).encode(text or ""))
+
+
+def _body(doc):
+    """Chunk text without the "Subject:/From:" header the indexer prepends."""
+    text = doc.page_content or ""
+    if text.startswith("Subject:") and "\n\n" in text:
+        text = text.split("\n\n", 1)[1]
+    return text.strip()
+
+
+def _trim(text, query_terms, max_tokens):
+    """Keep the sentences sharing most words with the question, in original order, within max_tokens."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    sentences = [s.strip() for s in _SENTENCE_RE.split(text) if s.strip()]
+    ranked = sorted(
+        range(len(sentences)),
+        key=lambda i: (-len(query_terms & set(_WORD_RE.findall(sentences[i].lower()))), i),
+    )
+    keep, used = set(), 0
+    for i in ranked:
+        cost = count_tokens(sentences[i]) + 1
+        if used + cost > max_tokens:
+            continue
+        keep.add(i)
+        used += cost
+    if not keep:  # one huge sentence: hard cut
+        enc = _encoding()
+        return enc.decode(enc.encode(sentences[ranked[0]])[:max_tokens])
+    return " ".join(sentences[i] for i in sorted(keep))
+
+
+def _citation(n, md):
+    received = (md.get("received") or "")[:10]
+    attachment = f" 📎 {md['attachment']}" if md.get("attachment") else ""
+    return f"[{n}] {md.get('subject') or '(no subject)'}{attachment} — {md.get('from') or 'unknown'} ({received})"
+
+
+def build_context(query, docs, budget=CONTEXT_TOKEN_BUDGET, max_passage_tokens=MAX_PASSAGE_TOKENS):
+    """
+    Turn ranked documents into a compact numbered context of at most `budget` tokens.
+    Lines already included from an earlier (better-ranked) passage — typically
+    quoted thread text — are dropped, and each passage is trimmed to its most
+    query-relevant sentences. Returns (context, citations, context_tokens).
+    """
+    query_terms = set(_WORD_RE.findall(query.lower()))
+    seen_lines = set()
+    passages, citations, used = [], [], 0
+
+    for doc in docs:
+        lines = []
+        for line in _body(doc).split("\n"):
+            key = " ".join(line.lower().split())
+            if key and key not in seen_lines:
+                seen_lines.add(key)
+                lines.append(line.strip())
+        if not lines:
+            continue
+
+        n = len(citations) + 1
+        header = _citation(n, doc.metadata or {})
+        room = min(max_passage_tokens, budget - used - count_tokens(header) - 2)
+        if room < MIN_PASSAGE_TOKENS:
+            break
+        passage = f"{header}\n{_trim(' '.join(lines), query_terms, room)}"
+        passages.append(passage)
+        citations.append(header)
+        used += count_tokens(passage) + 2
+
+    return "\n\n".join(passages), citations, used
+
+
+def build_prompt(query, docs, budget=CONTEXT_TOKEN_BUDGET):
+    """Prompt for the LLM fallback. Returns (prompt, citations, prompt_tokens)."""
+    context, citations, _ = build_context(query, docs, budget=budget)
+    prompt = PROMPT_TEMPLATE.format(context=context, query=query)
+    return prompt, citations, count_tokens(prompt)
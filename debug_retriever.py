@@ -1,6 +1,6 @@
 # debug_retriever.py
 from langchain_community.vectorstores import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
+from embedding_service import get_embeddings
 import os
 
 PERSIST_DIR = "chroma_db_test"  # change if you used a different folder
@@ -8,7 +8,7 @@ EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
 
 def debug_query(query, k=5):
     print("Loading embeddings and Chroma DB...")
-    embeddings = HuggingFaceEmbeddings(model_name=EMBED_MODEL)
+    embeddings = get_embeddings(EMBED_MODEL)
     db = Chroma(persist_directory=PERSIST_DIR, embedding_function=embeddings)
     retriever = db.as_retriever(search_kwargs={"k": k})
 
@@ -0,0 +1,155 @@
+# dedup.py — near-duplicate message clustering (SimHash) so only one copy is embedded
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+
+DEDUP_FILE = "dedup.sqlite"
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "1") != "0"
+MAX_DISTANCE = int(os.getenv("DEDUP_MAX_DISTANCE", "3"))  # differing bits (of 64) across conversations
+THREAD_DISTANCE = int(os.getenv("DEDUP_THREAD_DISTANCE", "8"))  # ...and within one conversation
+MIN_WORDS = 12  # shorter texts ("Thanks!") are never collapsed
+SHINGLE = 3
+BANDS = 4  # 4 × 16-bit bands: any two signatures within 3 bits share a band
+
+_WORD_RE = re.compile(r"\w+")
+_DIGITS = re.compile(r"\d+")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS members (
+    id              TEXT PRIMARY KEY,
+    rep_id          TEXT NOT NULL,
+    conversation_id TEXT,
+    simhash         INTEGER,
+    band0 INTEGER, band1 INTEGER, band2 INTEGER, band3 INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_members_rep ON members(rep_id);
+CREATE INDEX IF NOT EXISTS idx_members_conversation ON members(conversation_id);
+CREATE INDEX IF NOT EXISTS idx_members_band0 ON members(band0);
+CREATE INDEX IF NOT EXISTS idx_members_band1 ON members(band1);
+CREATE INDEX IF NOT EXISTS idx_members_band2 ON members(band2);
+CREATE INDEX IF NOT EXISTS idx_members_band3 ON members(band3);
+"""
+
+
+def simhash(text):
+    """
+    64-bit SimHash of word 3-shingles; numbers are masked so order ids, dates
+    and counters in otherwise identical notifications don't split them.
+    None for texts under MIN_WORDS words.
+    """
+    words = _WORD_RE.findall(_DIGITS.sub("0", (text or "").lower()))
+    if len(words) < MIN_WORDS:
+        return None
+    hashes = [
+        format(int.from_bytes(hashlib.blake2b(" ".join(words[i:i + SHINGLE]).encode("utf-8"),
+                                              digest_size=8).digest(), "little"), "064b")
+        for i in range(len(words) - SHINGLE + 1)
+    ]
+    # Per bit position: set in more than half of the shingle hashes (counted column-wise in C)
+    return int("".join("1" if column.count("1") * 2 > len(hashes) else "0" for column in zip(*hashes)), 2)
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def _bands(signature):
+    return [signature >> (16 * n) & 0xFFFF for n in range(BANDS)]
+
+
+def _signed(signature):
+    """SQLite integers are signed 64-bit."""
+    return signature - (1 << 64) if signature >= 1 << 63 else signature
+
+
+class DedupIndex:
+    """
+    Cluster membership for one index (persist dir): every message indexed with
+    a signature maps to a representative. Representatives are embedded;
+    members point at it, are counted (manifest, aggregates) and keep their own
+    text in the lexical index, so their numbers and ids stay searchable.
+    """
+
+    def __init__(self, persist_dir, max_distance=MAX_DISTANCE, thread_distance=THREAD_DISTANCE):
+        os.makedirs(persist_dir, exist_ok=True)
+        self.path = os.path.join(persist_dir, DEDUP_FILE)
+        self.max_distance = max_distance
+        self.thread_distance = thread_distance
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        # One small write per indexed message: don't fsync each (the manifest is the checkpoint)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def assign(self, message_id, text, conversation_id=None):
+        """
+        Register a message and return the id of its cluster's representative:
+        the closest existing representative within THREAD_DISTANCE bits in the
+        same conversation or MAX_DISTANCE bits anywhere, else the message itself.
+        """
+        signature = simhash(text)
+        with self._lock, self._conn:
+            rep = message_id
+            if signature is not None:
+                rep = self._closest(message_id, signature, conversation_id) or message_id
+                bands = _bands(signature)
+            else:
+                bands = [None] * BANDS
+            self._conn.execute(
+                "INSERT OR REPLACE INTO members (id, rep_id, conversation_id, simhash, band0, band1, band2, band3) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (message_id, rep, conversation_id, None if signature is None else _signed(signature), *bands),
+            )
+            if rep != message_id:
+                # A former representative that is now a copy hands its members over
+                self._conn.execute("UPDATE members SET rep_id = ? WHERE rep_id = ?", (rep, message_id))
+        return rep
+
+    def _closest(self, message_id, signature, conversation_id):
+        bands = _bands(signature)
+        rows = self._conn.execute(
+            "SELECT id, simhash, conversation_id FROM members WHERE id = rep_id AND id != ? "
+            "AND simhash IS NOT NULL AND (conversation_id = ? OR band0 = ? OR band1 = ? OR band2 = ? OR band3 = ?)",
+            (message_id, conversation_id or "\x00", *bands),
+        ).fetchall()
+        best, best_distance = None, None
+        for rep_id, other, other_conversation in rows:
+            distance = hamming(signature, other & ((1 << 64) - 1))
+            limit = self.thread_distance if conversation_id and other_conversation == conversation_id \
+                else self.max_distance
+            if distance <= limit and (best_distance is None or distance < best_distance):
+                best, best_distance = rep_id, distance
+        return best
+
+    def members(self, rep_id):
+        """Ids of every message in `rep_id`'s cluster, the representative included."""
+        with self._lock:
+            return [r[0] for r in self._conn.execute("SELECT id FROM members WHERE rep_id = ?", (rep_id,))]
+
+    def remove(self, message_ids):
+        """
+        Forget removed messages. Returns the orphans: members whose representative
+        was removed and who therefore have no vectors any more. Callers drop their
+        manifest entries so the next indexing run embeds them again.
+        """
+        message_ids = list(message_ids)
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM members WHERE id = ?", [(i,) for i in message_ids])
+            orphans = []
+            for i in range(0, len(message_ids), 500):
+                chunk = message_ids[i:i + 500]
+                orphans += [r[0] for r in self._conn.execute(
+                    f"SELECT id FROM members WHERE rep_id IN ({','.join('?' * len(chunk))})", chunk
+                )]
+            self._conn.executemany("DELETE FROM members WHERE id = ?", [(i,) for i in orphans])
+        return orphans
+
+    def stats(self):
+        with self._lock:
+            total, reps = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(id = rep_id), 0) FROM members"
+            ).fetchone()
+        return {"messages": total, "clusters": reps, "collapsed": total - reps}
@@ -0,0 +1,161 @@
+# embedding_cache.py — persistent, content-addressed embedding cache shared by all indexes
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+from metrics import span
+
+CACHE_FILE = os.getenv("EMBEDDING_CACHE_FILE", "embedding_cache.sqlite")
+MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+TOUCH_BATCH = 1000  # cache hits whose last_used is written back in one statement
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key       TEXT PRIMARY KEY,
+    vector    BLOB NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used);
+"""
+
+
+def normalize_text(text):
+    """Collapse whitespace so re-wrapped copies of the same text share a cache entry."""
+    return " ".join((text or "").split())
+
+
+def cache_key(model_name, text):
+    return hashlib.sha256(f"{model_name}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    SQLite table of float32 vectors keyed by cache_key(model, text).
+    Least-recently-used entries are evicted once `max_entries` is exceeded.
+    Hits are noted in memory and their last_used written TOUCH_BATCH at a
+    time (and before any eviction); the row count is tracked as an upper
+    bound so COUNT(*) only runs when eviction may actually be due.
+    """
+
+    def __init__(self, path=CACHE_FILE, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.executescript(_SCHEMA)
+        self._touched = {}  # key -> last hit time, not yet written
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, keys):
+        """Return a list aligned with `keys`: the cached vector or None."""
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):  # stay under SQLite's variable limit
+                chunk = keys[i:i + 500]
+                marks = ",".join("?" * len(chunk))
+                for key, blob in self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({marks})", chunk
+                ):
+                    found[key] = array("f", blob).tolist()
+            if found:
+                now = time.time()
+                self._touched.update((k, now) for k in found)
+                if len(self._touched) >= TOUCH_BATCH:
+                    with self._conn:
+                        self._flush_touched()
+            self.hits += sum(1 for k in keys if k in found)
+            self.misses += sum(1 for k in keys if k not in found)
+        return [found.get(k) for k in keys]
+
+    def put_many(self, keys, vectors):
+        now = time.time()
+        rows = [(k, array("f", v).tobytes(), now) for k, v in zip(keys, vectors)]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows
+            )
+            self._count += len(rows)  # replaced keys overcount; _evict() recounts before acting
+            if self._count > self.max_entries:
+                self._evict()
+
+    def flush(self):
+        """Write pending last_used updates."""
+        with self._lock, self._conn:
+            self._flush_touched()
+
+    def _flush_touched(self):
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                [(t, k) for k, t in self._touched.items()],
+            )
+            self._touched.clear()
+
+    def _evict(self):
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if self._count > self.max_entries:
+            self._flush_touched()  # recent hits must not be evicted as stale
+            # Trim to 90% so eviction doesn't run on every single put
+            drop = self._count - int(self.max_entries * 0.9)
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                (drop,),
+            )
+            self._count -= drop
+
+    def stats(self):
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "entries": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class CachedEmbeddings:
+    """Embeddings wrapper that only sends texts missing from the cache to the model."""
+
+    def __init__(self, embeddings, model_name, cache=None):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache = cache or EmbeddingCache()
+
+    def embed_documents(self, texts):
+        with span("embed.documents", texts=len(texts)) as s:
+            return self._embed_documents(texts, s)
+
+    def _embed_documents(self, texts, s):
+        keys = [cache_key(self.model_name, t) for t in texts]
+        vectors = self.cache.get_many(keys)
+        todo = [i for i, v in enumerate(vectors) if v is None]
+        s["cache_hits"] = len(texts) - len(todo)
+        if todo:
+            # Identical texts within one batch are embedded once
+            unique = {}
+            for i in todo:
+                unique.setdefault(keys[i], texts[i])
+            fresh = dict(zip(unique, self.embeddings.embed_documents(list(unique.values()))))
+            self.cache.put_many(list(fresh), list(fresh.values()))
+            for i in todo:
+                vectors[i] = fresh[keys[i]]
+        return vectors
+
+    def embed_query(self, text):
+        # Queries are cached separately: some models embed queries differently
+        key = cache_key(self.model_name + ":query", text)
+        with span("embed.query", texts=1) as s:
+            vector = self.cache.get_many([key])[0]
+            s["cache_hits"] = int(vector is not None)
+            if vector is None:
+                vector = self.embeddings.embed_query(text)
+                self.cache.put_many([key], [vector])
+        return vector
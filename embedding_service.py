@@ -0,0 +1,164 @@
+# embedding_service.py — one embedding model per process, imported and loaded lazily
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from embedding_cache import CachedEmbeddings
+from metrics import span
+
+EMBED_MODEL = os.getenv("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+EMBED_THREADS = int(os.getenv("EMBED_THREADS", "0"))  # 0 = let torch decide
+# Concurrent query embeddings arriving within this window share one model call
+QUERY_BATCH_WINDOW_MS = float(os.getenv("QUERY_BATCH_WINDOW_MS", "5"))
+QUERY_BATCH_MAX = int(os.getenv("QUERY_BATCH_MAX", "32"))
+
+_models = {}
+_tokenizers = {}
+_embeddings = {}
+_model_lock = threading.Lock()
+_lock = threading.Lock()
+
+
+def get_model(model_name=EMBED_MODEL):
+    """The process-wide HuggingFace model; torch/langchain are only imported here."""
+    with _model_lock:
+        if model_name not in _models:
+            print(f"🔄 Loading embedding model {model_name}...")
+            if EMBED_THREADS:
+                import torch
+                torch.set_num_threads(EMBED_THREADS)
+            from langchain_huggingface import HuggingFaceEmbeddings
+
+            _models[model_name] = HuggingFaceEmbeddings(
+                model_name=model_name, encode_kwargs={"batch_size": EMBED_BATCH_SIZE}
+            )
+            print("✅ Embedding model ready.")
+        return _models[model_name]
+
+
+def get_tokenizer(model_name=EMBED_MODEL):
+    """
+    The embedding model's tokenizer (only the vocabulary, not the weights), so
+    chunks can be budgeted in the word pieces the model truncates on. None if
+    transformers or the tokenizer files are unavailable.
+    """
+    with _model_lock:
+        if model_name not in _tokenizers:
+            try:
+                from transformers import AutoTokenizer
+
+                _tokenizers[model_name] = AutoTokenizer.from_pretrained(model_name)
+            except Exception as e:
+                print(f"⚠️ Tokenizer for {model_name} unavailable ({type(e).__name__}); estimating chunk sizes.")
+                _tokenizers[model_name] = None
+        return _tokenizers[model_name]
+
+
+class LazyEmbeddings:
+    """Embeddings facade that loads the shared model on first use."""
+
+    def __init__(self, model_name=EMBED_MODEL):
+        self.model_name = model_name
+
+    def embed_documents(self, texts):
+        model = get_model(self.model_name)
+        with span("embed.model", texts=len(texts), batches=-(-len(texts) // EMBED_BATCH_SIZE)):
+            return model.embed_documents(texts)
+
+    def embed_query(self, text):
+        return get_model(self.model_name).embed_query(text)
+
+    def embed_queries(self, texts):
+        """Several queries in one forward pass (models with query-specific settings go one by one)."""
+        model = get_model(self.model_name)
+        if getattr(model, "query_encode_kwargs", None):
+            return [model.embed_query(t) for t in texts]
+        with span("embed.model", texts=len(texts), batches=1):
+            return model.embed_documents(texts)
+
+
+class QueryBatcher:
+    """
+    Embeddings wrapper that micro-batches embed_query(): callers from many
+    threads queue their text, and a worker sends everything that arrives within
+    `window_ms` of the first one (up to `max_batch`) to the model in one call.
+    Documents pass straight through.
+    """
+
+    def __init__(self, embeddings, window_ms=QUERY_BATCH_WINDOW_MS, max_batch=QUERY_BATCH_MAX):
+        self.embeddings = embeddings
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        future = Future()
+        self._queue.put((text, future))
+        self._ensure_worker()
+        return future.result()
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._embed(batch)
+
+    def _embed(self, batch):
+        texts = [text for text, _ in batch]
+        try:
+            with span("embed.query_batch", queries=len(texts), batches=1):
+                embed_many = getattr(self.embeddings, "embed_queries", None)
+                if embed_many is None:
+                    vectors = [self.embeddings.embed_query(t) for t in texts]
+                else:
+                    vectors = embed_many(texts)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), vector in zip(batch, vectors):
+            future.set_result(vector)
+
+
+def get_embeddings(model_name=EMBED_MODEL):
+    """
+    Shared cached embeddings for `model_name`; cheap to call, the model loads
+    on the first miss. Query embeddings from concurrent users are micro-batched.
+    """
+    with _lock:
+        if model_name not in _embeddings:
+            _embeddings[model_name] = CachedEmbeddings(QueryBatcher(LazyEmbeddings(model_name)),
+                                                       model_name=model_name)
+        return _embeddings[model_name]
+
+
+def warm_up(model_name=EMBED_MODEL, background=True):
+    """Load the model now (optionally in a daemon thread) so the first query doesn't pay for it."""
+    if not background:
+        get_model(model_name)
+        return None
+    thread = threading.Thread(target=get_model, args=(model_name,), name="embedding-warmup", daemon=True)
+    thread.start()
+    return thread
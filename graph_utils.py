@@ -1,66 +1,674 @@
 # graph_utils.py
+import json
+import os
+import random
+import threading
+import time
 import requests
 from dateutil import parser
-from datetime import datetime
+from datetime import datetime, date, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import parse_qsl, quote, urlencode, urlsplit, urlunsplit
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+from metrics import incr, span
+
 GRAPH_BASE = "https://graph.microsoft.com/v1.0"
+MESSAGE_FIELDS = "subject,body,bodyPreview,from,receivedDateTime,conversationId,hasAttachments"
+# Two-phase fetch: list these cheap fields first, then only the needed bodies via $batch
+HEADER_FIELDS = "subject,bodyPreview,from,receivedDateTime,conversationId,hasAttachments"
+BATCH_LIMIT = 20  # Graph's maximum number of requests in one JSON $batch
+
+# Graph allows 4 concurrent requests per app per mailbox
+MAX_CONCURRENCY = int(os.getenv("GRAPH_MAX_CONCURRENCY", "4"))
+PAGE_ATTEMPTS = 3  # tries per page before a fetch gives up
+THROTTLE_ATTEMPTS = 8  # throttled (429) responses tolerated per page
+# Adaptive paging: learned page size / concurrency are saved per tenant here
+FETCH_SETTINGS_FILE = os.getenv("GRAPH_FETCH_SETTINGS", "fetch_settings.json")
+MIN_PAGE_SIZE, MAX_PAGE_SIZE, PAGE_SIZE_STEP = 25, 1000, 50
+BACKOFF_BASE, BACKOFF_CAP = 1.0, 60.0  # seconds, when Graph sends no Retry-After
+# Graph converts HTML bodies to text server-side, so most messages need no parsing
+TEXT_BODY_PREFERENCE = 'outlook.body-content-type="text"'
+
+_session = None
+_session_lock = threading.Lock()
+_controllers = {}
+_auth_sessions = {}
+
+# Graph only accepts $orderby together with $filter when the ordered property
+# is also the first one filtered on, so sender-only queries get this
+# open-ended lower bound on receivedDateTime.
+_EPOCH = datetime(1900, 1, 1, tzinfo=timezone.utc)
+
+
+def day_range(date_obj):
+    """Return the [start, end) UTC datetimes covering one calendar day."""
+    start = datetime(date_obj.year, date_obj.month, date_obj.day, tzinfo=timezone.utc)
+    return start, start + timedelta(days=1)
+
+
+def to_graph_datetime(value):
+    """Format a date or datetime as the UTC literal used inside $filter."""
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    if isinstance(value, date):
+        return f"{value.isoformat()}T00:00:00Z"
+    return value
 
 
-def list_messages(access_token, top=20):
+def _quote(value):
+    """Quote a string literal for OData ($filter) by doubling single quotes."""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def build_message_query(start=None, end=None, sender=None, top=20, select=MESSAGE_FIELDS):
     """
-    Fetch Outlook messages using Microsoft Graph API with retries and timeout.
-    Automatically handles broken connections or partial responses.
+    Translate date range / sender filters into Graph query params.
+    `start` is inclusive and `end` exclusive; both are compared on receivedDateTime
+    server-side, so only matching messages are transferred. A sender domain
+    can't be pushed down (Graph's $filter has no endswith() on
+    from/emailAddress/address); see sender_matches.
     """
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Accept-Encoding": "identity",  # disables gzip compression
-    }
+    clauses = []
+    if start is not None or sender:
+        clauses.append(f"receivedDateTime ge {to_graph_datetime(start or _EPOCH)}")
+    if end is not None:
+        clauses.append(f"receivedDateTime lt {to_graph_datetime(end)}")
+    if sender:
+        clauses.append(f"from/emailAddress/address eq {_quote(sender.lower())}")
+
+    params = {"$select": select, "$top": top, "$orderby": "receivedDateTime desc"}
+    if clauses:
+        params["$filter"] = " and ".join(clauses)
+    return params
+
+
+def sender_matches(message, sender=None, domain=None):
+    """Client-side sender / sender-domain filter for listed messages."""
+    address = ((message.get("from") or {}).get("emailAddress") or {}).get("address", "").lower()
+    if sender and address != sender.lower():
+        return False
+    if domain and not address.endswith("@" + domain.lower().lstrip("@")):
+        return False
+    return True
+
+
+class GraphFetchError(Exception):
+    """
+    A Graph listing could not be completed.
+    `items` holds what was fetched before the failure and `cursor` the
+    (url, params) of the page that failed, so callers can resume (for
+    fetch_bodies: (id, body) pairs and the ids still missing).
+    """
+
+    def __init__(self, message, items=None, cursor=None):
+        super().__init__(message)
+        self.items = items or []
+        self.cursor = cursor
+
+
+def graph_session():
+    """
+    Return the process-wide requests session for Graph calls.
+    One keep-alive connection pool (sized for MAX_CONCURRENCY) with retries,
+    shared by every fetch; gzip is left on (requests' default Accept-Encoding).
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            retries = Retry(
+                total=5,  # retry up to 5 times
+                backoff_factor=1,  # wait 1s, 2s, 4s...
+                status_forcelist=[500, 502, 503, 504],
+                allowed_methods=["GET"]
+            )
+            adapter = HTTPAdapter(
+                pool_connections=1, pool_maxsize=max(MAX_CONCURRENCY, 10), max_retries=retries
+            )
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+
+class BearerAuth(requests.auth.AuthBase):
+    """
+    Signs each request with the current token from `token` (a callable, e.g.
+    auth_utils.TokenManager). On a 401 the token is refreshed once, via
+    `token.refresh(failed_token)` when available, and the request is re-sent.
+    """
+
+    def __init__(self, token):
+        self.token = token
+
+    def __call__(self, r):
+        r.headers["Authorization"] = f"Bearer {self.token()}"
+        r.register_hook("response", self._retry_on_401)
+        return r
+
+    def _retry_on_401(self, r, **kwargs):
+        refresh = getattr(self.token, "refresh", None)
+        if r.status_code != 401 or refresh is None or getattr(r.request, "_reauthorized", False):
+            return r
+        incr("graph.auth.refreshes")
+        failed = r.request.headers.get("Authorization", "")[len("Bearer "):]
+        retry = r.request.copy()
+        retry.headers["Authorization"] = f"Bearer {refresh(failed)}"
+        retry._reauthorized = True
+        r.content  # release the connection back to the pool
+        r.close()
+        again = r.connection.send(retry, **kwargs)
+        again.history.append(r)
+        again.request = retry
+        return again
+
+
+def session_for(access_token):
+    """
+    The session to send Graph requests with for `access_token`: the shared
+    graph_session() for a plain token string, or an authorized session (same
+    connection pool, Authorization set per request) for a token callable.
+    """
+    if isinstance(access_token, str):
+        return graph_session()
+    base = graph_session()
+    with _session_lock:
+        session = _auth_sessions.get(id(access_token))
+        if session is None or session.auth.token is not access_token:
+            session = requests.Session()
+            for prefix, adapter in base.adapters.items():
+                session.mount(prefix, adapter)
+            session.auth = BearerAuth(access_token)
+            _auth_sessions[id(access_token)] = session
+        return session
+
+
+def auth_headers(access_token, text_bodies=True):
+    """
+    Request headers; by default Graph is asked to render bodies as plain text.
+    A token callable is applied by session_for()'s session instead.
+    """
+    headers = {"Authorization": f"Bearer {access_token}"} if isinstance(access_token, str) else {}
+    if text_bodies:
+        headers["Prefer"] = TEXT_BODY_PREFERENCE
+    return headers
+
+
+def retry_after_seconds(response):
+    """Retry-After of a response in seconds (delta-seconds or HTTP date), or None."""
+    return parse_retry_after(response.headers.get("Retry-After"))
+
+
+def parse_retry_after(value):
+    """A Retry-After header value in seconds (delta-seconds or HTTP date), or None if unparsable."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        try:
+            return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+        except (TypeError, ValueError):
+            return None
+
+
+def backoff_delay(retry_after=None, attempt=0):
+    """
+    Seconds to wait after a throttled request: Graph's Retry-After plus up to
+    20% jitter (so parallel workers don't come back in lockstep), otherwise
+    exponential backoff with jitter.
+    """
+    if retry_after is not None:
+        return retry_after + random.uniform(0, max(retry_after * 0.2, 0.1))
+    return min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+class FetchController:
+    """
+    Adapts Graph page size and request concurrency to what a tenant tolerates,
+    AIMD style. Every `grow_after` pages served without throttling add one
+    concurrent request and, while per-page throughput (items/s) holds up,
+    PAGE_SIZE_STEP to the page size. A 429 halves the concurrency, shrinks pages
+    by a quarter and pauses every request until Retry-After (with jitter) has
+    passed, so a large pull runs just under the ceiling without getting locked
+    out. The learned settings are saved per tenant in FETCH_SETTINGS_FILE.
+    """
+
+    def __init__(self, tenant=None, path=FETCH_SETTINGS_FILE, max_concurrency=MAX_CONCURRENCY, grow_after=4):
+        self.tenant = tenant or os.getenv("AZ_TENANT_ID") or "default"
+        self.path = path
+        self.max_concurrency = max(1, max_concurrency)
+        self.grow_after = grow_after
+        saved = self._load().get(self.tenant, {})
+        self.page_size = min(max(int(saved.get("page_size", 100)), MIN_PAGE_SIZE), MAX_PAGE_SIZE)
+        self.concurrency = min(max(int(saved.get("concurrency", self.max_concurrency)), 1), self.max_concurrency)
+        self.items_per_s = float(saved.get("items_per_s", 0.0))  # moving average per page
+        self.pages = 0
+        self.throttled = 0
+        self._streak = 0
+        self._active = 0
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @contextmanager
+    def slot(self):
+        """Hold one of the `concurrency` request slots; waits out throttling pauses."""
+        with self._cond:
+            while True:
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    self._cond.wait(pause)
+                elif self._active >= self.concurrency:
+                    self._cond.wait(0.5)
+                else:
+                    break
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+
+    def on_page(self, items, seconds):
+        """Additive increase after a run of successful pages."""
+        with self._cond:
+            self.pages += 1
+            rate = items / seconds if seconds > 0 else 0.0
+            previous = self.items_per_s
+            self.items_per_s = rate if not previous else 0.7 * previous + 0.3 * rate
+            self._streak += 1
+            if self._streak < self.grow_after:
+                return
+            self._streak = 0
+            if self.items_per_s >= previous * 0.95:
+                self.page_size = min(self.page_size + PAGE_SIZE_STEP, MAX_PAGE_SIZE)
+            self.concurrency = min(self.concurrency + 1, self.max_concurrency)
+            self._cond.notify_all()
+
+    def on_throttle(self, retry_after=None, attempt=0):
+        """Multiplicative decrease and a shared pause; returns the pause in seconds."""
+        delay = backoff_delay(retry_after, attempt)
+        with self._cond:
+            self.throttled += 1
+            self._streak = 0
+            self.concurrency = max(1, self.concurrency // 2)
+            self.page_size = max(MIN_PAGE_SIZE, int(self.page_size * 0.75))
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        incr("graph.throttled")
+        print(f"🐢 Graph throttled the request; pausing {delay:.1f}s "
+              f"(concurrency {self.concurrency}, page size {self.page_size})")
+        return delay
+
+    def settings(self):
+        return {
+            "page_size": self.page_size,
+            "concurrency": self.concurrency,
+            "items_per_s": round(self.items_per_s, 1),
+            "throttled": self.throttled,
+        }
+
+    def save(self):
+        """Persist the learned settings for this tenant (atomic rewrite of the shared file)."""
+        if not self.path:
+            return
+        with _session_lock:
+            data = self._load()
+            data[self.tenant] = dict(self.settings(), updated=datetime.now(timezone.utc).isoformat(timespec="seconds"))
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp, self.path)
 
-    url = f"{GRAPH_BASE}/me/messages?$select=subject,body,bodyPreview,from,receivedDateTime&$top={top}"
-    items = []
 
-    # Create a requests session with retries
-    session = requests.Session()
-    retries = Retry(
-        total=5,  # retry up to 5 times
-        backoff_factor=1,  # wait 1s, 2s, 4s...
-        status_forcelist=[500, 502, 503, 504],
-        allowed_methods=["GET"]
-    )
-    session.mount("https://", HTTPAdapter(max_retries=retries))
+def fetch_controller(tenant=None):
+    """The process-wide FetchController of a tenant."""
+    tenant = tenant or os.getenv("AZ_TENANT_ID") or "default"
+    with _session_lock:
+        if tenant not in _controllers:
+            _controllers[tenant] = FetchController(tenant)
+        return _controllers[tenant]
+
+
+def with_page_size(url, top):
+    """Rewrite the $top of a nextLink so an adapted page size applies to the following pages."""
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    if not any(k == "$top" for k, _ in query):
+        return url
+    query = [(k, str(top) if k == "$top" else v) for k, v in query]
+    return urlunsplit(parts._replace(query=urlencode(query, safe="$,'()/:", quote_via=quote)))
+
+
+def get_page(url, headers, params=None, session=None, controller=None):
+    """
+    GET one Graph page through the controller: waits for a request slot, backs
+    off on 429 (and 503 with Retry-After) and feeds the page's throughput back.
+    Other HTTP and connection errors are raised to the caller.
+    """
+    session = session or graph_session()
+    controller = controller or fetch_controller()
+    for attempt in range(THROTTLE_ATTEMPTS):
+        with controller.slot(), span("graph.request") as s:
+            started = time.perf_counter()
+            r = session.get(url, headers=headers, params=params, timeout=60)
+            s["bytes"] = len(r.content)
+            throttled = r.status_code == 429 or (r.status_code == 503 and "Retry-After" in r.headers)
+            if not throttled:
+                r.raise_for_status()
+                data = r.json()
+                s["pages"] = 1
+                s["items"] = len(data.get("value", []))
+                controller.on_page(s["items"], time.perf_counter() - started)
+                return data
+        delay = controller.on_throttle(retry_after_seconds(r), attempt)
+        time.sleep(delay)
+    raise requests.exceptions.RetryError(f"Still throttled after {THROTTLE_ATTEMPTS} attempts: {url}")
+
+
+def iter_pages(url, headers, params=None, session=None, attempts=PAGE_ATTEMPTS, label="", controller=None):
+    """
+    Follow @odata.nextLink from `url`, yielding each page's items as it arrives.
+    Requests go through the FetchController (throttling backoff, adaptive page
+    size and concurrency). A failed page is retried from the same cursor; after
+    `attempts` failures GraphFetchError is raised with the cursor of the page that failed.
+    """
+    session = session or graph_session()
+    controller = controller or fetch_controller()
+    fetched = 0
+    failures = 0
 
     while url:
         try:
-            r = session.get(url, headers=headers, timeout=60)
-            r.raise_for_status()
-            data = r.json()
-            items.extend(data.get("value", []))
-            url = data.get("@odata.nextLink", None)
+            data = get_page(url, headers, params, session=session, controller=controller)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            status = getattr(getattr(e, "response", None), "status_code", None)
+            if status is not None and 400 <= status < 500:
+                # The request itself was rejected (bad filter, permissions): retrying won't help
+                raise GraphFetchError(f"Graph rejected the request{label}: {e}", cursor=(url, params)) from e
+            failures += 1
+            incr("graph.request.retries")
+            print(f"⚠️ Graph connection error{label}:", e)
+            if failures >= attempts:
+                raise GraphFetchError(str(e), cursor=(url, params)) from e
+            print("⏳ Retrying this page...")
+            continue
+
+        failures = 0
+        page = data.get("value", [])
+        fetched += len(page)
+        url = data.get("@odata.nextLink", None)
+        params = None  # nextLink already carries the query
+        if url:
+            url = with_page_size(url, controller.page_size)
+
+        # Progress feedback
+        print(f"Fetched {fetched} messages so far{label}...")
+        yield page
+
+
+def follow_pages(url, headers, params=None, session=None, attempts=PAGE_ATTEMPTS, label="", controller=None):
+    """
+    Like iter_pages but returns all items at once. On failure GraphFetchError
+    carries the partial items instead of silently truncating.
+    """
+    items = []
+    try:
+        for page in iter_pages(url, headers, params, session=session, attempts=attempts, label=label,
+                               controller=controller):
+            items.extend(page)
+    except GraphFetchError as e:
+        e.items = items
+        raise
+    return items
 
-            # Progress feedback
-            print(f"Fetched {len(items)} messages so far...")
 
-        except requests.exceptions.RequestException as e:
-            print("⚠️ Graph connection error:", e)
-            print("⏳ Retrying or skipping this batch...")
-            break  # or continue, depending on your preference
+def _rejected(error):
+    """True if a GraphFetchError comes from Graph refusing the query (HTTP 400)."""
+    response = getattr(error.__cause__, "response", None)
+    return response is not None and response.status_code == 400
+
+
+def iter_message_query(headers, query, session=None, label="", controller=None):
+    """
+    iter_pages over /me/messages for `query` (build_message_query() arguments
+    plus an optional "domain"), yielding only the messages from that sender /
+    domain. The domain is always matched client-side. If Graph rejects the
+    sender $filter (HTTP 400) before the first page, the query is re-sent with
+    the date range only and the sender is matched client-side as well.
+    """
+    query = dict(query)
+    domain = query.pop("domain", None)
+    sender = query.get("sender")
+    started = False
+    try:
+        for page in iter_pages(f"{GRAPH_BASE}/me/messages", headers, build_message_query(**query),
+                               session=session, label=label, controller=controller):
+            started = True
+            yield [m for m in page if sender_matches(m, sender, domain)]
+    except GraphFetchError as e:
+        if started or not sender or not _rejected(e):
+            raise
+        incr("graph.filter_fallbacks")
+        print(f"⚠️ Graph rejected the sender filter{label}; filtering on this side instead.")
+        query["sender"] = None
+        for page in iter_pages(f"{GRAPH_BASE}/me/messages", headers, build_message_query(**query),
+                               session=session, label=label, controller=controller):
+            yield [m for m in page if sender_matches(m, sender, domain)]
 
+
+def follow_message_query(headers, query, session=None, label="", controller=None):
+    """iter_message_query() collected into one list; GraphFetchError carries the partial items."""
+    items = []
+    try:
+        for page in iter_message_query(headers, query, session=session, label=label, controller=controller):
+            items.extend(page)
+    except GraphFetchError as e:
+        e.items = items
+        raise
+    return items
+
+
+def list_messages(access_token, top=None, start=None, end=None, sender=None, domain=None):
+    """
+    Fetch Outlook messages using Microsoft Graph API with retries and timeout.
+    Optional filters (see iter_message_query) are pushed down to Graph where
+    it supports them; `top` is the first page size (default: the tenant's
+    learned one), all pages of the result are followed.
+    Raises GraphFetchError if a page keeps failing.
+    """
+    controller = fetch_controller()
+    query = {"start": start, "end": end, "sender": sender, "domain": domain, "top": top or controller.page_size}
+    try:
+        items = follow_message_query(auth_headers(access_token), query, session=session_for(access_token),
+                                     controller=controller)
+    finally:
+        controller.save()
     print(f"✅ Done fetching {len(items)} total messages.")
     return items
 
 
+def split_range(start, end, slices):
+    """Split [start, end) into `slices` equal, contiguous windows, newest first."""
+    step = (end - start) / slices
+    bounds = [start + step * i for i in range(slices)] + [end]
+    return [(bounds[i], bounds[i + 1]) for i in reversed(range(slices))]
+
+
+def fetch_messages_parallel(access_token, start, end=None, slices=8, max_workers=MAX_CONCURRENCY,
+                            top=None, sender=None, domain=None, controller=None, select=MESSAGE_FIELDS):
+    """
+    Fetch [start, end) by splitting it into time slices that are listed
+    concurrently over the shared connection pool. Results are merged newest
+    first, the same order list_messages returns. The tenant's FetchController
+    decides how many requests are actually in flight and the page size.
+    A slice that fails mid-way is resumed serially from its last cursor once
+    the pool is done; if that fails too, GraphFetchError carries everything
+    fetched up to the gap.
+    """
+    end = end or datetime.now(timezone.utc)
+    controller = controller or fetch_controller()
+    headers = auth_headers(access_token)
+    session = session_for(access_token)
+    windows = split_range(start, end, slices)
+
+    def fetch_slice(n, window):
+        query = {"start": window[0], "end": window[1], "sender": sender, "domain": domain,
+                 "top": top or controller.page_size, "select": select}
+        return follow_message_query(headers, query, session=session, label=f" (slice {n + 1}/{slices})",
+                                    controller=controller)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = [pool.submit(fetch_slice, n, w) for n, w in enumerate(windows)]
+
+    items = []
+    for n, future in enumerate(futures):
+        try:
+            items.extend(future.result())
+            continue
+        except GraphFetchError as e:
+            partial, cursor = e.items, e.cursor
+        print(f"⏳ Resuming slice {n + 1}/{slices} from its last page...")
+        url, params = cursor
+        try:
+            rest = follow_pages(url, headers, params, session=session, controller=controller)
+        except GraphFetchError as e:
+            controller.save()
+            rest = [m for m in e.items if sender_matches(m, sender, domain)]
+            raise GraphFetchError(
+                f"Slice {n + 1}/{slices} failed: {e}", items=items + partial + rest, cursor=e.cursor
+            ) from e
+        partial = partial + [m for m in rest if sender_matches(m, sender, domain)]
+        items.extend(partial)
+
+    controller.save()
+    print(f"✅ Done fetching {len(items)} total messages ({slices} slices; "
+          f"now {controller.page_size}/page, {controller.concurrency} concurrent).")
+    return items
+
+
+def _body_requests(ids):
+    return [
+        {
+            "id": str(n),
+            "method": "GET",
+            "url": f"/me/messages/{quote(mid, safe='=-_')}?$select=body",
+            "headers": {"Prefer": TEXT_BODY_PREFERENCE},
+        }
+        for n, mid in enumerate(ids)
+    ]
+
+
+def _post_body_batch(access_token, ids, session, controller):
+    """
+    Fetch the bodies of up to BATCH_LIMIT messages with one $batch request.
+    Sub-requests throttled by Graph are retried after their Retry-After;
+    messages that no longer exist (404) are left out of the result.
+    """
+    headers = {**auth_headers(access_token, text_bodies=False), "Content-Type": "application/json"}
+    bodies, pending = {}, list(ids)
+    for attempt in range(THROTTLE_ATTEMPTS):
+        with controller.slot(), span("graph.batch", requests=len(pending)) as s:
+            started = time.perf_counter()
+            r = session.post(f"{GRAPH_BASE}/$batch", headers=headers,
+                             json={"requests": _body_requests(pending)}, timeout=60)
+            s["bytes"] = len(r.content)
+        if r.status_code == 429 or (r.status_code == 503 and "Retry-After" in r.headers):
+            time.sleep(controller.on_throttle(retry_after_seconds(r), attempt))
+            continue
+        r.raise_for_status()
+
+        retry, wait = [], None
+        for response in r.json().get("responses", []):
+            mid = pending[int(response["id"])]
+            status = response.get("status")
+            if status == 200:
+                bodies[mid] = (response.get("body") or {}).get("body")
+            elif status in (429, 503):
+                retry.append(mid)
+                after = parse_retry_after((response.get("headers") or {}).get("Retry-After"))
+                if after is not None:
+                    wait = max(wait or 0.0, after)
+            elif status != 404:
+                incr("graph.batch.errors")
+                print(f"⚠️ Body of {mid} failed in $batch: HTTP {status}")
+        controller.on_page(len(pending) - len(retry), time.perf_counter() - started)
+        if not retry:
+            return bodies
+        time.sleep(controller.on_throttle(wait, attempt))
+        pending = retry
+    raise GraphFetchError(f"Still throttled after {THROTTLE_ATTEMPTS} attempts", items=list(bodies.items()))
+
+
+def fetch_bodies(access_token, ids, max_workers=MAX_CONCURRENCY, controller=None):
+    """
+    Phase two: {message id: body} for `ids`, BATCH_LIMIT bodies per $batch
+    request, several batches in flight (bounded by the FetchController).
+    A failed batch doesn't stop the others: if any failed, GraphFetchError is
+    raised once all are done, with every fetched (id, body) in `items` and
+    the ids still missing as its `cursor`.
+    """
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        return {}
+    controller = controller or fetch_controller()
+    session = session_for(access_token)
+    chunks = [ids[i:i + BATCH_LIMIT] for i in range(0, len(ids), BATCH_LIMIT)]
+    bodies, failed, errors = {}, [], []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks)))) as pool:
+        futures = [(chunk, pool.submit(_post_body_batch, access_token, chunk, session, controller))
+                   for chunk in chunks]
+        for chunk, future in futures:
+            try:
+                bodies.update(future.result())
+            except (requests.exceptions.RequestException, ValueError, GraphFetchError) as e:
+                partial = dict(e.items) if isinstance(e, GraphFetchError) else {}
+                bodies.update(partial)
+                failed += [mid for mid in chunk if mid not in partial]
+                errors.append(e)
+    print(f"✅ Fetched {len(bodies)}/{len(ids)} bodies in {len(chunks)} $batch request(s).")
+    if errors:
+        incr("graph.batch.failed", len(errors))
+        raise GraphFetchError(f"{len(errors)}/{len(chunks)} $batch request(s) failed "
+                              f"({len(failed)} bodies missing): {errors[0]}",
+                              items=list(bodies.items()), cursor=failed)
+    return bodies
+
+
+def list_messages_for_date(access_token, date_obj, top=None, sender=None, domain=None):
+    """Fetch only the messages received on `date_obj` (UTC), filtered by Graph."""
+    start, end = day_range(date_obj)
+    return fetch_messages_parallel(access_token, start, end, slices=4, top=top, sender=sender, domain=domain)
+
+
 def filter_messages_for_date(messages, date_obj):
     """
     Filter messages by date (YYYY-MM-DD).
-    Only keeps messages received on the given date.
+    Only keeps messages received on the given date, using the same UTC day
+    boundaries as list_messages_for_date.
     """
+    start, end = day_range(date_obj)
     filtered = []
     for m in messages:
         try:
             dt = parser.isoparse(m.get("receivedDateTime"))
-            if dt.date() == date_obj:
+            if dt.tzinfo is None:
+                dt = dt.replace(tzinfo=timezone.utc)
+            if start <= dt < end:
                 filtered.append(m)
         except Exception:
             continue
@@ -0,0 +1,56 @@
+# hybrid_retriever.py — BM25 + vector retrieval fused with reciprocal rank fusion
+from typing import Any
+
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from metrics import span
+from raganizer import document_id
+
+RRF_K = 60  # standard reciprocal-rank-fusion damping constant
+
+
+def reciprocal_rank_fusion(rankings, rrf_k=RRF_K):
+    """Fuse several ranked id lists: score(id) = Σ 1 / (rrf_k + rank)."""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, 1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Drop-in for db.as_retriever(): runs the Chroma vector search and a BM25
+    search over the lexical index with the same `filter`, then fuses both
+    rankings so exact-term matches are found even when embeddings rank them low.
+    Lexical hits with no vectors (collapsed near-duplicates) come from the
+    text the lexical index keeps for them.
+    """
+
+    vectorstore: Any
+    lexical: Any
+    search_kwargs: dict = {"k": 8}
+    rrf_k: int = RRF_K
+
+    def _get_relevant_documents(self, query, *, run_manager=None, **kwargs):
+        options = {**self.search_kwargs, **kwargs}
+        k = options.get("k", 4)
+        where = options.get("filter")
+
+        with span("chroma.query", results=0) as s:
+            vector_docs = self.vectorstore.similarity_search(query, k=k, filter=where)
+            s["results"] = len(vector_docs)
+        by_id = {document_id(d): d for d in vector_docs}
+        with span("lexical.query"):
+            lexical_ids = [doc_id for doc_id, _ in self.lexical.search(query, k=k, where=where)]
+
+        fused = reciprocal_rank_fusion([list(by_id), lexical_ids], self.rrf_k)[:k]
+        missing = [i for i in fused if i not in by_id]
+        if missing:
+            with span("chroma.get", results=len(missing)):
+                data = self.vectorstore.get(ids=missing, include=["documents", "metadatas"])
+            for doc_id, content, metadata in zip(data["ids"], data["documents"], data["metadatas"]):
+                by_id[doc_id] = Document(page_content=content or "", metadata=metadata or {})
+            by_id.update(self.lexical.documents(i for i in missing if i not in by_id))
+        return [by_id[i] for i in fused if i in by_id]
@@ -0,0 +1,115 @@
+# index_jobs.py — indexing runs in a background thread, with progress, cancel and resume
+import threading
+import time
+
+from pipeline import run_index_pipeline
+from raganizer import INDEX_DIR
+
+_jobs = {}
+_lock = threading.Lock()
+
+
+class IndexJob:
+    """
+    One run_index_pipeline run in a daemon thread. `pages_factory()` must return
+    a fresh iterable of message pages, so a cancelled or failed job can be resumed:
+    the pipeline checkpoints its manifest after every batch and skips what is
+    already indexed. The job outlives Streamlit reruns and disconnected sessions.
+    """
+
+    def __init__(self, pages_factory, persist_dir=INDEX_DIR, scope=None, total=None, label="", **options):
+        self.pages_factory = pages_factory
+        self.persist_dir = persist_dir
+        self.scope = scope
+        self.total = total
+        self.label = label
+        self.options = options
+        self.status = "pending"  # pending | running | done | cancelled | failed
+        self.stats = {}
+        self.error = None
+        self.runs = 0
+        self.started = None
+        self.finished = None
+        self._cancel = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start (or resume) the job unless it is already running."""
+        if self.running:
+            return self
+        self._cancel = threading.Event()
+        self.status, self.error, self.stats = "running", None, {}
+        self.runs += 1
+        self.started, self.finished = time.time(), None
+        self._thread = threading.Thread(target=self._run, name=f"index-job-{self.label}", daemon=True)
+        self._thread.start()
+        return self
+
+    resume = start
+
+    def cancel(self):
+        """Stop after the batch being written; already written batches stay indexed."""
+        self._cancel.set()
+
+    def _run(self):
+        try:
+            _, stats = run_index_pipeline(
+                self.pages_factory(), persist_dir=self.persist_dir, scope=self.scope,
+                on_progress=self._update, cancel=self._cancel, **self.options,
+            )
+            self.stats = stats
+            self.status = "cancelled" if stats.get("cancelled") else "done"
+        except Exception as e:
+            self.error = e
+            self.status = "failed"
+            print(f"❌ Indexing job {self.label} failed: {e}")
+        finally:
+            self.finished = time.time()
+
+    def _update(self, stats):
+        self.stats = stats
+
+    def progress(self):
+        """Snapshot for the UI: status, done/total messages, throughput."""
+        stats = dict(self.stats)
+        done = stats.get("indexed", 0) + stats.get("skipped", 0)
+        elapsed = stats.get("elapsed") or ((self.finished or time.time()) - (self.started or time.time()))
+        return {
+            "label": self.label,
+            "status": self.status,
+            "done": done,
+            "total": self.total,
+            "fraction": min(done / self.total, 1.0) if self.total else None,
+            "indexed": stats.get("indexed", 0),
+            "skipped": stats.get("skipped", 0),
+            "duplicates": stats.get("duplicates", 0),
+            "chunks": stats.get("embedded", 0),
+            "rate": stats.get("indexed", 0) / elapsed if elapsed else 0.0,
+            "elapsed": elapsed,
+            "runs": self.runs,
+            "error": str(self.error) if self.error else None,
+        }
+
+
+def current_job(persist_dir=INDEX_DIR):
+    """The latest job for `persist_dir` in this process, or None."""
+    with _lock:
+        return _jobs.get(persist_dir)
+
+
+def start_job(pages_factory, persist_dir=INDEX_DIR, **kwargs):
+    """
+    Start an indexing job for `persist_dir`. Only one job writes to an index at a
+    time: while one is running it is returned instead of starting another.
+    """
+    with _lock:
+        job = _jobs.get(persist_dir)
+        if job is not None and job.running:
+            return job
+        job = IndexJob(pages_factory, persist_dir=persist_dir, **kwargs)
+        _jobs[persist_dir] = job
+    return job.start()
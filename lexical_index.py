@@ -0,0 +1,182 @@
+# lexical_index.py — persistent BM25 inverted index kept beside the vector index
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+
+LEXICAL_FILE = "lexical.sqlite"
+BM25_K1 = 1.2
+BM25_B = 0.75
+SUBJECT_BOOST = 2  # subject terms count this many times
+
+_WORD_RE = re.compile(r"\w+")
+STOPWORDS = frozenset(
+    "a an and are about any as at be by did do does email emails for from have how i in is it "
+    "me mail mails my of on or show the this to was were what when which who with you your".split()
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    doc_id      TEXT PRIMARY KEY,
+    message_id  TEXT,
+    length      INTEGER NOT NULL,
+    received_ts INTEGER,
+    domain      TEXT,
+    content     TEXT,
+    metadata    TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_docs_message ON docs(message_id);
+CREATE TABLE IF NOT EXISTS postings (
+    term   TEXT NOT NULL,
+    doc_id TEXT NOT NULL,
+    tf     INTEGER NOT NULL,
+    PRIMARY KEY (term, doc_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_postings_doc ON postings(doc_id);
+"""
+
+_STORED_COLUMNS = ("content", "metadata")  # added after the first release: see _migrate
+_FILTER_COLUMNS = {"received_ts", "domain"}
+_OPS = {"$gte": ">=", "$gt": ">", "$lte": "<=", "$lt": "<", "$eq": "=", "$ne": "!="}
+
+
+def tokenize(text):
+    return [t for t in _WORD_RE.findall((text or "").lower()) if t not in STOPWORDS]
+
+
+def _where_sql(where):
+    """Translate the Chroma `where` dicts built by qa.query_filter into SQL on docs."""
+    if not where:
+        return "1=1", []
+    if "$and" in where:
+        parts = [_where_sql(w) for w in where["$and"]]
+        return " AND ".join(p for p, _ in parts), [a for _, args in parts for a in args]
+    (field, cond), = where.items()
+    if field not in _FILTER_COLUMNS:
+        raise ValueError(f"Unsupported lexical filter field: {field}")
+    if not isinstance(cond, dict):
+        cond = {"$eq": cond}
+    (op, value), = cond.items()
+    return f"d.{field} {_OPS[op]} ?", [value]
+
+
+class LexicalIndex:
+    """
+    Term → chunk postings over subject, sender and body, scored with BM25.
+    Filled by the indexers at the same time as Chroma, keyed by the same doc ids.
+    Documents without vectors (collapsed near-duplicates) are added with
+    `keep_text`: their text lives here, and documents() returns it.
+    """
+
+    def __init__(self, persist_dir):
+        os.makedirs(persist_dir, exist_ok=True)
+        self.path = os.path.join(persist_dir, LEXICAL_FILE)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._migrate()
+        self._conn.executescript(_SCHEMA)
+
+    def _migrate(self):
+        """Indexes built before duplicates kept their text lack the stored-text columns."""
+        existing = {r[1] for r in self._conn.execute("PRAGMA table_info(docs)")}
+        if existing:
+            with self._conn:
+                for column in _STORED_COLUMNS:
+                    if column not in existing:
+                        self._conn.execute(f"ALTER TABLE docs ADD COLUMN {column} TEXT")
+
+    def add(self, ids, docs, keep_text=False):
+        """Index (or re-index) documents under the given ids; with `keep_text` their text is stored too."""
+        doc_rows, posting_rows = [], []
+        for doc_id, doc in zip(ids, docs):
+            md = doc.metadata
+            terms = tokenize(doc.page_content) + tokenize(md.get("subject")) * (SUBJECT_BOOST - 1)
+            stored = (doc.page_content, json.dumps(md)) if keep_text else (None, None)
+            doc_rows.append((doc_id, md.get("id"), len(terms), md.get("received_ts"), md.get("domain"), *stored))
+            posting_rows += [(term, doc_id, tf) for term, tf in Counter(terms).items()]
+        with self._lock, self._conn:
+            self._delete(ids)
+            self._conn.executemany(
+                "INSERT INTO docs (doc_id, message_id, length, received_ts, domain, content, metadata) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", doc_rows,
+            )
+            self._conn.executemany("INSERT INTO postings VALUES (?, ?, ?)", posting_rows)
+
+    def delete(self, ids):
+        with self._lock, self._conn:
+            self._delete(ids)
+
+    def delete_messages(self, message_ids):
+        """Drop every document of the given messages, stored-text ones included."""
+        with self._lock, self._conn:
+            for i in range(0, len(message_ids), 500):
+                chunk = list(message_ids[i:i + 500])
+                marks = ",".join("?" * len(chunk))
+                ids = [r[0] for r in self._conn.execute(
+                    f"SELECT doc_id FROM docs WHERE message_id IN ({marks})", chunk
+                )]
+                self._delete(ids)
+
+    def documents(self, ids):
+        """{doc_id: Document} for the ids among `ids` that were added with keep_text."""
+        ids = list(ids)
+        if not ids:
+            return {}
+        from langchain_core.documents import Document
+
+        marks = ",".join("?" * len(ids))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT doc_id, content, metadata FROM docs WHERE doc_id IN ({marks}) AND content IS NOT NULL", ids
+            ).fetchall()
+        return {doc_id: Document(page_content=content, metadata=json.loads(metadata)) for doc_id, content, metadata in rows}
+
+    def _delete(self, ids):
+        rows = [(i,) for i in ids]
+        self._conn.executemany("DELETE FROM postings WHERE doc_id = ?", rows)
+        self._conn.executemany("DELETE FROM docs WHERE doc_id = ?", rows)
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def search(self, query, k=8, where=None):
+        """Top-k (doc_id, score) by BM25 over documents matching `where`."""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        filter_sql, filter_args = _where_sql(where)
+        marks = ",".join("?" * len(terms))
+        with self._lock:
+            n_docs, avg_len = self._conn.execute("SELECT COUNT(*), AVG(length) FROM docs").fetchone()
+            if not n_docs:
+                return []
+            df = dict(self._conn.execute(
+                f"SELECT term, COUNT(*) FROM postings WHERE term IN ({marks}) GROUP BY term", terms
+            ).fetchall())
+            rows = self._conn.execute(
+                f"SELECT p.term, p.doc_id, p.tf, d.length FROM postings p JOIN docs d ON d.doc_id = p.doc_id "
+                f"WHERE p.term IN ({marks}) AND {filter_sql}",
+                terms + filter_args,
+            ).fetchall()
+
+        scores = Counter()
+        for term, doc_id, tf, length in rows:
+            idf = math.log(1 + (n_docs - df[term] + 0.5) / (df[term] + 0.5))
+            norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * length / (avg_len or 1))
+            scores[doc_id] += idf * tf * (BM25_K1 + 1) / norm
+        return scores.most_common(k)
+
+    def backfill_from_chroma(self, db):
+        """Fill an empty index from an existing Chroma collection."""
+        if self.count() == 0:
+            from langchain_core.documents import Document
+
+            data = db.get(include=["documents", "metadatas"])
+            docs = [Document(page_content=c or "", metadata=m or {})
+                    for c, m in zip(data.get("documents") or [], data.get("metadatas") or [])]
+            self.add(data.get("ids") or [], docs)
+        return self.count()
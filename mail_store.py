@@ -0,0 +1,260 @@
+# mail_store.py — local SQLite copy of the mailbox, keyed by Graph message id
+import gzip
+import json
+import sqlite3
+import threading
+import zlib
+from collections import namedtuple
+
+from graph_utils import day_range, to_graph_datetime
+
+STORE_FILE = "mail_store.sqlite"
+BODY_COMPRESSION = 6  # zlib level for stored bodies
+MIGRATE_BATCH = 500
+
+# Headers live in typed columns (the remaining Graph fields as compact JSON);
+# bodies are zlib-compressed in their own table and only read when asked for.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id              TEXT PRIMARY KEY,
+    received        TEXT,
+    sender          TEXT,
+    subject         TEXT,
+    data            TEXT NOT NULL,
+    sender_name     TEXT,
+    preview         TEXT,
+    conversation_id TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_messages_received ON messages(received);
+CREATE TABLE IF NOT EXISTS bodies (
+    id           TEXT PRIMARY KEY REFERENCES messages(id) ON DELETE CASCADE,
+    content_type TEXT,
+    content      BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+_NEW_COLUMNS = ("sender_name", "preview", "conversation_id")
+
+MessageRow = namedtuple("MessageRow", "id received sender sender_name subject preview conversation_id has_body")
+
+_ROW_SQL = (
+    "SELECT m.id, m.received, m.sender, m.sender_name, m.subject, m.preview, m.conversation_id, "
+    "b.id IS NOT NULL FROM messages m LEFT JOIN bodies b ON b.id = m.id"
+)
+_FULL_SQL = "SELECT m.data, b.content_type, b.content FROM messages m LEFT JOIN bodies b ON b.id = m.id"
+_HEADER_SQL = "SELECT m.data, NULL, NULL FROM messages m"
+
+
+def _range_where(start, end):
+    sql, args = " WHERE 1=1", []
+    if start is not None:
+        sql += " AND m.received >= ?"
+        args.append(to_graph_datetime(start))
+    if end is not None:
+        sql += " AND m.received < ?"
+        args.append(to_graph_datetime(end))
+    return sql, args
+
+
+def _range_query(start, end, bodies=True):
+    where, args = _range_where(start, end)
+    return (_FULL_SQL if bodies else _HEADER_SQL) + where + " ORDER BY m.received DESC", args
+
+
+def _pack_body(body):
+    content = (body.get("content") or "").encode("utf-8")
+    return body.get("contentType"), zlib.compress(content, BODY_COMPRESSION)
+
+
+def _unpack_body(content_type, blob):
+    return {"contentType": content_type, "content": zlib.decompress(blob).decode("utf-8")}
+
+
+def _header_row(m):
+    sender = (m.get("from") or {}).get("emailAddress", {})
+    headers = {k: v for k, v in m.items() if k != "body"}
+    return (
+        m["id"],
+        m.get("receivedDateTime"),
+        sender.get("address", ""),
+        sender.get("name", ""),
+        m.get("subject", ""),
+        m.get("bodyPreview", ""),
+        m.get("conversationId"),
+        json.dumps(headers, separators=(",", ":")),
+    )
+
+
+def _message(row):
+    """Rebuild the Graph dict; the body is attached only when selected and stored."""
+    m = json.loads(row[0])
+    if row[2] is not None:
+        m["body"] = _unpack_body(row[1], row[2])
+    return m
+
+
+class MessageStore:
+    """
+    Graph messages persisted in SQLite.
+    `received` is kept in Graph's ISO format (…Z) so range queries compare as text.
+    Listings use rows() (typed header columns, no bodies); full Graph dicts
+    come from get() / messages_between() / iter_pages().
+    """
+
+    def __init__(self, path=STORE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # WAL lets iter_pages() readers coexist with set_bodies() / sync writers
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._migrate()
+        self._conn.executescript(_SCHEMA)
+
+    def _migrate(self):
+        """Older stores kept whole messages, bodies included, in `data`: split them up."""
+        existing = {r[1] for r in self._conn.execute("PRAGMA table_info(messages)")}
+        if not existing or set(_NEW_COLUMNS) <= existing:
+            return
+        with self._lock, self._conn:
+            for name in _NEW_COLUMNS:
+                if name not in existing:
+                    self._conn.execute(f"ALTER TABLE messages ADD COLUMN {name} TEXT")
+            self._conn.executescript(_SCHEMA)
+            last, moved = 0, 0
+            while True:
+                rows = self._conn.execute(
+                    "SELECT rowid, data FROM messages WHERE rowid > ? ORDER BY rowid LIMIT ?", (last, MIGRATE_BATCH)
+                ).fetchall()
+                if not rows:
+                    break
+                self._write([json.loads(r[1]) for r in rows])
+                last, moved = rows[-1][0], moved + len(rows)
+        self._conn.execute("VACUUM")
+        print(f"📦 Moved {moved} stored messages to the compact layout.")
+
+    def _write(self, messages):
+        self._conn.executemany(
+            "INSERT INTO messages (id, received, sender, sender_name, subject, preview, conversation_id, data) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(id) DO UPDATE SET received=excluded.received, "
+            "sender=excluded.sender, sender_name=excluded.sender_name, subject=excluded.subject, "
+            "preview=excluded.preview, conversation_id=excluded.conversation_id, data=excluded.data",
+            [_header_row(m) for m in messages],
+        )
+        self._write_bodies({m["id"]: m["body"] for m in messages if isinstance(m.get("body"), dict)})
+
+    def _write_bodies(self, bodies):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO bodies (id, content_type, content) VALUES (?, ?, ?)",
+            [(mid, *_pack_body(body)) for mid, body in bodies.items() if body is not None],
+        )
+
+    def upsert_messages(self, messages):
+        """Insert or replace messages; a header-only update keeps the body already stored."""
+        messages = [m for m in messages if m.get("id")]
+        with self._lock, self._conn:
+            self._write(messages)
+        return len(messages)
+
+    def set_bodies(self, bodies):
+        """Attach fetched bodies ({id: body}) to stored messages."""
+        if not bodies:
+            return 0
+        with self._lock, self._conn:
+            known = {r[0] for r in self._conn.execute(
+                f"SELECT id FROM messages WHERE id IN ({','.join('?' * len(bodies))})", list(bodies)
+            )}
+            self._write_bodies({mid: body for mid, body in bodies.items() if mid in known})
+        return len(bodies)
+
+    def delete_messages(self, ids):
+        ids = list(ids)
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM messages WHERE id = ?", [(i,) for i in ids])
+        return len(ids)
+
+    def get(self, message_id):
+        with self._lock:
+            row = self._conn.execute(_FULL_SQL + " WHERE m.id = ?", (message_id,)).fetchone()
+        return _message(row) if row else None
+
+    def body(self, message_id):
+        """The stored body of one message, or None if it has not been fetched yet."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content_type, content FROM bodies WHERE id = ?", (message_id,)
+            ).fetchone()
+        return _unpack_body(*row) if row else None
+
+    def rows(self, start=None, end=None, limit=None):
+        """Header rows (no bodies, no JSON decoding), newest first."""
+        where, args = _range_where(start, end)
+        sql = _ROW_SQL + where + " ORDER BY m.received DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            args.append(limit)
+        with self._lock:
+            return [MessageRow(*r[:-1], bool(r[-1])) for r in self._conn.execute(sql, args)]
+
+    def messages_between(self, start=None, end=None, bodies=True):
+        """Messages with start <= receivedDateTime < end, newest first."""
+        sql, args = _range_query(start, end, bodies)
+        with self._lock:
+            rows = self._conn.execute(sql, args).fetchall()
+        return [_message(r) for r in rows]
+
+    def iter_pages(self, start=None, end=None, page_size=100, bodies=True):
+        """Stream messages_between() in pages of `page_size` without loading them all."""
+        sql, args = _range_query(start, end, bodies)
+        # Separate read connection so writers are not blocked while a consumer is slow
+        conn = sqlite3.connect(self.path)
+        try:
+            cur = conn.execute(sql, args)
+            while True:
+                rows = cur.fetchmany(page_size)
+                if not rows:
+                    break
+                yield [_message(r) for r in rows]
+        finally:
+            conn.close()
+
+    def export(self, path, start=None, end=None, page_size=200):
+        """
+        Write the messages in range to `path` as gzip-compressed JSON lines,
+        page by page so memory stays flat. Returns the number written.
+        """
+        written = 0
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            for page in self.iter_pages(start, end, page_size=page_size):
+                for m in page:
+                    f.write(json.dumps(m, ensure_ascii=False) + "\n")
+                written += len(page)
+        return written
+
+    def messages_for_date(self, date_obj):
+        return self.messages_between(*day_range(date_obj))
+
+    def count(self, start=None, end=None):
+        where, args = _range_where(start, end)
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM messages m" + where, args).fetchone()[0]
+
+    # --- sync bookkeeping (delta links etc.) ---
+    def get_state(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_state(self, key, value):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO sync_state (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+                (key, json.dumps(value)),
+            )
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,141 @@
+# metrics.py — lightweight timing spans and counters, exported as JSON lines or Prometheus text
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+METRICS_JSONL = os.getenv("METRICS_JSONL")  # append every finished span here when set
+METRICS_PROM_FILE = os.getenv("METRICS_PROM_FILE", "metrics.prom")
+PROM_PREFIX = "raganizer"
+RECENT_SPANS = 500
+
+_NAME_RE = re.compile(r"[^a-zA-Z0-9_]")
+
+
+class Metrics:
+    """
+    Process-wide registry. `span(name)` times a block and aggregates it per
+    stage (count / total / max); numeric attributes set on the span are summed
+    into counters named "<stage>.<attr>". `incr` bumps a counter directly.
+    """
+
+    def __init__(self, jsonl_path=METRICS_JSONL):
+        self.jsonl_path = jsonl_path
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.timings = {}
+            self.recent = deque(maxlen=RECENT_SPANS)
+            self.since = time.time()
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds, attrs=None):
+        """Record one finished span of `seconds`."""
+        event = {"span": name, "ts": round(time.time(), 3), "ms": round(seconds * 1000, 3),
+                 "thread": threading.current_thread().name}
+        if attrs:
+            event.update(attrs)
+        with self._lock:
+            t = self.timings.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+            t["count"] += 1
+            t["total"] += seconds
+            t["max"] = max(t["max"], seconds)
+            for key, value in (attrs or {}).items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    counter = f"{name}.{key}"
+                    self.counters[counter] = self.counters.get(counter, 0) + value
+            self.recent.append(event)
+            if self.jsonl_path:
+                with open(self.jsonl_path, "a") as f:
+                    f.write(json.dumps(event, default=str) + "\n")
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """Time the block; the yielded dict takes extra attributes (bytes, texts, tokens...)."""
+        start = time.perf_counter()
+        try:
+            yield attrs
+        except BaseException as e:
+            attrs["error"] = type(e).__name__
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, attrs)
+
+    def breakdown(self):
+        """Per-stage rows for display: calls, total/avg/max time and the stage's counters."""
+        with self._lock:
+            timings = {k: dict(v) for k, v in self.timings.items()}
+            counters = dict(self.counters)
+        rows = []
+        for name, t in sorted(timings.items(), key=lambda kv: -kv[1]["total"]):
+            row = {
+                "stage": name,
+                "calls": t["count"],
+                "total_s": round(t["total"], 3),
+                "avg_ms": round(t["total"] / t["count"] * 1000, 2),
+                "max_ms": round(t["max"] * 1000, 2),
+            }
+            for counter, value in counters.items():
+                if counter.startswith(name + "."):
+                    key = counter[len(name) + 1:]
+                    row[key] = value
+                    if t["total"]:
+                        row[f"{key}_per_s"] = round(value / t["total"], 1)
+            rows.append(row)
+        return rows
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "since": self.since,
+                "counters": dict(self.counters),
+                "timings": {k: dict(v) for k, v in self.timings.items()},
+            }
+
+    def write_jsonl(self, path):
+        """Dump the recent spans as JSON lines (METRICS_JSONL streams them instead)."""
+        with self._lock:
+            events = list(self.recent)
+        with open(path, "w") as f:
+            for event in events:
+                f.write(json.dumps(event, default=str) + "\n")
+        return path
+
+    def prometheus_text(self):
+        snap = self.snapshot()
+        lines = []
+        for name, value in sorted(snap["counters"].items()):
+            metric = f"{PROM_PREFIX}_{_NAME_RE.sub('_', name)}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+        for name, t in sorted(snap["timings"].items()):
+            metric = f"{PROM_PREFIX}_{_NAME_RE.sub('_', name)}_seconds"
+            lines += [
+                f"# TYPE {metric} summary",
+                f"{metric}_count {t['count']}",
+                f"{metric}_sum {t['total']:.6f}",
+                f"# TYPE {metric}_max gauge",
+                f"{metric}_max {t['max']:.6f}",
+            ]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path=METRICS_PROM_FILE):
+        """Write the Prometheus text format atomically (for node_exporter's textfile collector)."""
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp, path)
+        return path
+
+
+metrics = Metrics()
+span = metrics.span
+incr = metrics.incr
@@ -0,0 +1,184 @@
+# pipeline.py — streaming fetch → clean → embed → index with bounded memory
+import queue
+import threading
+import time
+
+from dedup import DEDUP_ENABLED, DedupIndex
+from raganizer import INDEX_DIR, IndexWriter, emails_to_documents, group_by_message, is_duplicate, is_indexed
+from embedding_service import get_embeddings
+from metrics import span
+
+_DONE = object()
+
+
+class _AnyEvent:
+    """is_set() of several threading.Events combined."""
+
+    def __init__(self, *events):
+        self.events = events
+
+    def is_set(self):
+        return any(e.is_set() for e in self.events)
+
+
+def _put(q, item, stop):
+    """Blocking put (this is the backpressure); gives up once the pipeline stops."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.2)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _drain(q, stop):
+    """Yield items from `q` until the upstream stage sends _DONE or the pipeline stops."""
+    while not stop.is_set():
+        try:
+            item = q.get(timeout=0.2)
+        except queue.Empty:
+            continue
+        if item is _DONE:
+            return
+        yield item
+
+
+def _start_stage(name, source, work, outbox, stop, errors, flush=None):
+    """Run `work(item)` over `source` in a thread, pushing every result into `outbox`."""
+
+    def run():
+        try:
+            for item in source:
+                for out in work(item):
+                    if not _put(outbox, out, stop):
+                        return
+            for out in (flush() if flush else ()):
+                if not _put(outbox, out, stop):
+                    return
+            _put(outbox, _DONE, stop)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+
+    thread = threading.Thread(target=run, name=f"index-{name}", daemon=True)
+    thread.start()
+    return thread
+
+
+def run_index_pipeline(pages, persist_dir=INDEX_DIR, batch_size=64, queue_size=4,
+                       embeddings=None, on_progress=None, prune=None, scope=None,
+                       cancel=None, checkpoint_every=1, dedup=DEDUP_ENABLED, enrich=None):
+    """
+    Index an iterable of message pages (lists of Graph message dicts) into Chroma.
+    Fetching, HTML cleaning and embedding each run in their own thread, linked by
+    queues holding at most `queue_size` items: only a few pages/batches are in
+    memory at once and a slow stage throttles the ones before it. Each batch is
+    written as soon as it is embedded, so it is queryable while later pages are
+    still downloading.
+    Like make_or_load_chroma (both write through IndexWriter), unchanged
+    messages (per the persist dir's manifest) are skipped before cleaning; with
+    `prune`, indexed messages that were not in `pages` (and, given
+    `scope=(start, end)`, were received in that window) are deleted at the end.
+    By default only a scoped run prunes, as in make_or_load_chroma.
+    `on_progress(stats)` is called from the calling thread after every insert.
+    The manifest is checkpointed every `checkpoint_every` inserted batches, so an
+    interrupted run resumes where it stopped: re-running it skips every message
+    already written; the manifest version (which scopes the answer cache) only
+    changes once the run ends. Setting the `cancel` event stops after the current batch
+    (stats["cancelled"] is True and nothing is pruned).
+    With `dedup`, near-duplicate messages (see dedup.py) are recorded in the
+    manifest and aggregates but only their cluster's representative is
+    embedded; stats["duplicates"] counts them.
+    `enrich(messages)` runs in the clean stage on the messages about to be
+    indexed (unchanged ones are never passed), e.g. AttachmentIngestor.enrich;
+    messages with attachments that were indexed without it are re-indexed.
+    """
+    if prune is None:
+        prune = scope is not None
+    from langchain_community.vectorstores import Chroma
+
+    embeddings = embeddings or get_embeddings()
+    db = Chroma(persist_directory=persist_dir, embedding_function=embeddings)
+    writer = IndexWriter(db, persist_dir)
+    clusters = DedupIndex(persist_dir) if dedup else None
+    known = writer.known
+    seen = set()
+
+    stats = {"fetched": 0, "cleaned": 0, "skipped": 0, "duplicates": 0, "embedded": 0, "indexed": 0,
+             "elapsed": 0.0, "cancelled": False}
+    stop, errors = threading.Event(), []
+    halt = _AnyEvent(stop, cancel) if cancel is not None else stop
+    raw_q, doc_q, vec_q = (queue.Queue(maxsize=queue_size) for _ in range(3))
+    started = time.time()
+    pending = []
+
+    def fetch(page):
+        stats["fetched"] += len(page)
+        yield page
+
+    def clean(page):
+        seen.update(m.get("id") for m in page)
+        todo = [m for m in page if not is_indexed(known.get(m.get("id")), m, ingest_attachments=enrich is not None)]
+        stats["skipped"] += len(page) - len(todo)
+        if enrich and todo:
+            enrich(todo)
+        # One call per page, so large pages are cleaned by clean_bodies' process
+        # pool. Chunks are regrouped into ~batch_size embedding batches; a
+        # message's chunks always stay in one batch so its manifest entry is complete
+        for chunks in group_by_message(emails_to_documents(todo, dedup=clusters)).values():
+            pending.extend(chunks)
+            if len(pending) >= batch_size:
+                yield list(pending)
+                pending.clear()
+        stats["cleaned"] += len(todo)
+
+    def flush():
+        if pending:
+            yield list(pending)
+            pending.clear()
+
+    def embed(batch):
+        texts = [d.page_content for d in batch if not is_duplicate(d)]
+        stats["duplicates"] += len(batch) - len(texts)
+        vectors = []
+        if texts:
+            with span("pipeline.embed", texts=len(texts), batches=1):
+                vectors = embeddings.embed_documents(texts)
+        stats["embedded"] += len(texts)
+        yield batch, vectors
+
+    threads = [
+        _start_stage("fetch", iter(pages), fetch, raw_q, stop, errors),
+        _start_stage("clean", _drain(raw_q, stop), clean, doc_q, stop, errors, flush=flush),
+        _start_stage("embed", _drain(doc_q, stop), embed, vec_q, stop, errors),
+    ]
+
+    try:
+        for n_batches, (batch, vectors) in enumerate(_drain(vec_q, halt), 1):
+            stats["indexed"] += writer.write(batch, vectors)
+            stats["elapsed"] = time.time() - started
+            if n_batches % checkpoint_every == 0:
+                writer.save(final=False)
+            if on_progress:
+                on_progress(dict(stats))
+        stats["cancelled"] = halt.is_set() and not stop.is_set()
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        writer.save()
+
+    if errors:
+        raise errors[0]
+    if stats["cancelled"]:
+        print(f"⏹️ Indexing cancelled after {stats['indexed']} emails; re-run to resume.")
+        return db, stats
+    if prune:
+        removed = writer.prune(seen, scope)
+        if removed:
+            writer.save()
+        stats["removed"] = len(removed)
+    stats["elapsed"] = time.time() - started
+    print(f"✅ Indexed {stats['indexed']} emails into {persist_dir}/ in {stats['elapsed']:.1f}s")
+    return db, stats
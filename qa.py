@@ -1,17 +1,32 @@
+import json
 import os
-from datetime import datetime, timedelta
-from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_openai import ChatOpenAI
-from langchain.chains import RetrievalQA
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from aggregates import AggregateStore
+from context_builder import build_prompt, count_tokens
+from embedding_service import get_embeddings
+from lexical_index import STOPWORDS
+from metrics import incr, metrics, span
+from raganizer import INDEX_DIR
 
 # --- Load embeddings + DB ---
-def load_qa_chain(persist_dir="chroma_db_test"):
+def load_qa_chain(persist_dir=INDEX_DIR):
+    # Heavy imports are deferred until a chain is actually needed
+    from langchain_chroma import Chroma
+    from langchain_openai import ChatOpenAI
+    from langchain.chains import RetrievalQA
+
     print("🔍 Loading Chroma DB and embeddings...")
 
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+    from hybrid_retriever import HybridRetriever
+    from lexical_index import LexicalIndex
+
+    embeddings = get_embeddings()
     db = Chroma(persist_directory=persist_dir, embedding_function=embeddings)
-    retriever = db.as_retriever(search_kwargs={"k": 8})
+    lexical = LexicalIndex(persist_dir)
+    lexical.backfill_from_chroma(db)
+    retriever = HybridRetriever(vectorstore=db, lexical=lexical, search_kwargs={"k": 8})
     llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.2)
 
     qa = RetrievalQA.from_chain_type(llm=llm, retriever=retriever)
@@ -19,49 +34,315 @@ def load_qa_chain(persist_dir="chroma_db_test"):
     return qa, retriever, llm, db
 
 
+def open_aggregates(persist_dir, db=None):
+    """Aggregate store of an index; filled from Chroma metadata if the index predates it."""
+    aggregates = AggregateStore(persist_dir)
+    if db is not None:
+        aggregates.backfill_from_chroma(db)
+    return aggregates
+
+
+MONTHS = {
+    "january": 1, "february": 2, "march": 3, "april": 4,
+    "may": 5, "june": 6, "july": 7, "august": 8,
+    "september": 9, "october": 10, "november": 11, "december": 12
+}
+DOMAIN_ALIASES = {"giki": "giki.edu.pk"}
+# Only explicit cues become filters: "from example.com" / "@example.com" with a
+# country or common generic TLD ("invoice.pdf" is not a sender domain)
+_DOMAIN_RE = re.compile(
+    r"(?:\bfrom\s+@?|@)((?:[a-z0-9-]+\.)+(?:[a-z]{2}|com|org|net|edu|gov|mil|int|info|biz|app|dev))\b"
+)
+_TODAY_RE = re.compile(r"\btoday\b")
+_YESTERDAY_RE = re.compile(r"\byesterday\b")
+_WEEK_RE = re.compile(r"\b(?:this|last|past|previous)\s+week\b")
+_MONTH_RE = re.compile(r"\b(this|last|past|previous)\s+month\b")
+_MONTH_NAME_RE = re.compile(r"\b(" + "|".join(MONTHS) + r")\b")
+# "in may I ask", "march on": these names only count as months when written
+# capitalised mid-sentence ("emails in May") or next to a day / year ("may 5", "3 march")
+_AMBIGUOUS_MONTHS = {"may", "march"}
+_DAY_BEFORE_MONTH_RE = re.compile(r"\b\d{1,2}(?:st|nd|rd|th)?\s+(?:of\s+)?$")
+_DAY_AFTER_MONTH_RE = re.compile(r",?\s*\d")
+_SENTENCE_START_RE = re.compile(r"(?:^|[.!?])\W*$")
+
+# Aggregate intents, matched on word boundaries ("account" is not "count")
+_COUNT_RE = re.compile(r"\b(?:how many|count|number of)\b")
+_LATEST_RE = re.compile(r"\b(?:latest|newest|(?:most )?recent)\b")
+_TOP_SENDERS_RE = re.compile(r"\b(?:top senders?|who sends|most emails)\b")
+_DOMAINS_RE = re.compile(r"\bdomains?\b")
+_PER_RE = re.compile(r"\b(?:per|by|which)\b")
+_ALIAS_RE = re.compile(r"\b(?:" + "|".join(DOMAIN_ALIASES) + r")\b")
+_LOST_FOUND_RE = re.compile(r"\b(?:lost|found)\b")
+# What is left of "how many emails did I get from giki last month?" once the
+# cues, dates and domains are gone; any other word is a topic for retrieval
+_FILLER_WORDS = STOPWORDS | frozenset(
+    "s t we us our get got getting receive received receiving sent send there many much total all so far "
+    "ever inbox mailbox message messages list tell give please has had last past previous ago since until "
+    "till during between through before after up new per each day days week weeks month months year years".split()
+)
+
+
+def _month_start(year, month):
+    if month > 12:
+        year, month = year + 1, month - 12
+    return datetime(year, month, 1, tzinfo=timezone.utc)
+
+
+def mentioned_months(query):
+    """Month numbers named in a question, in the order they are mentioned."""
+    query_lower = query.lower()
+    months = []
+    for match in _MONTH_NAME_RE.finditer(query_lower):
+        name = match.group(1)
+        if name in _AMBIGUOUS_MONTHS and not (
+            _DAY_BEFORE_MONTH_RE.search(query_lower, 0, match.start())
+            or _DAY_AFTER_MONTH_RE.match(query_lower, match.end())
+            or (query[match.start()].isupper() and not _SENTENCE_START_RE.search(query, 0, match.start()))
+        ):
+            continue
+        if MONTHS[name] not in months:
+            months.append(MONTHS[name])
+    return months
+
+
+def query_date_range(query, now=None):
+    """Return the (start, end) UTC window a question asks about, or None."""
+    query_lower = query.lower()
+    now = now or datetime.now(timezone.utc)
+    today = datetime(now.year, now.month, now.day, tzinfo=timezone.utc)
+
+    if _TODAY_RE.search(query_lower):
+        return today, today + timedelta(days=1)
+    if _YESTERDAY_RE.search(query_lower):
+        return today - timedelta(days=1), today
+    if _WEEK_RE.search(query_lower):
+        return today - timedelta(days=7), today + timedelta(days=1)
+
+    months = mentioned_months(query)
+    if months:
+        first, last = months[0], months[-1]
+        # Months later than the current one refer to last year; "november and
+        # february" runs across the new year
+        end_year = now.year if last <= now.month else now.year - 1
+        start_year = end_year if first <= last else end_year - 1
+        return _month_start(start_year, first), _month_start(end_year, last + 1)
+
+    month = _MONTH_RE.search(query_lower)
+    if month:
+        if month.group(1) == "this":
+            return _month_start(now.year, now.month), _month_start(now.year, now.month + 1)
+        if month.group(1) == "past":
+            return today - timedelta(days=30), today + timedelta(days=1)
+        start = _month_start(now.year - (now.month == 1), (now.month - 2) % 12 + 1)
+        return start, _month_start(now.year, now.month)
+    return None
+
+
+def query_domain(query):
+    """Sender domain a question is about ("giki", "from example.com", "@example.com"), or None."""
+    query_lower = query.lower()
+    for alias, domain in DOMAIN_ALIASES.items():
+        if re.search(rf"\b{alias}\b", query_lower):
+            return domain
+    match = _DOMAIN_RE.search(query_lower)
+    return match.group(1) if match else None
+
+
+def topic_words(query):
+    """Words of a question besides aggregate cues, dates and domains: what it is about."""
+    text = query.lower()
+    for pattern in (_DOMAIN_RE, _ALIAS_RE, _TODAY_RE, _YESTERDAY_RE, _WEEK_RE, _MONTH_RE, _MONTH_NAME_RE,
+                    _COUNT_RE, _LATEST_RE, _TOP_SENDERS_RE, _DOMAINS_RE, _PER_RE):
+        text = pattern.sub(" ", text)
+    return [w for w in re.findall(r"[a-z]+", text) if w not in _FILLER_WORDS]
+
+
+def query_filter(query, now=None):
+    """
+    Turn the date / month / domain intents of a question into a Chroma `where`
+    filter, so the vector search only runs over matching emails. Only explicit
+    cues count (see query_date_range / query_domain): a wrong filter hides
+    every relevant email, a missing one merely ranks them among others.
+    """
+    clauses = []
+    date_range = query_date_range(query, now)
+    if date_range:
+        start, end = date_range
+        clauses += [{"received_ts": {"$gte": int(start.timestamp())}},
+                    {"received_ts": {"$lt": int(end.timestamp())}}]
+    domain = query_domain(query)
+    if domain:
+        clauses.append({"domain": domain})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def collapse_chunks(docs, k=None):
+    """Keep the best-ranked chunk of each message, in rank order."""
+    seen, collapsed = set(), []
+    for d in docs:
+        key = d.metadata.get("id") or id(d)
+        if key not in seen:
+            seen.add(key)
+            collapsed.append(d)
+    return collapsed[:k] if k else collapsed
+
+
+def retrieve(retriever, query, where=None):
+    """
+    Vector search, pre-filtered on metadata when `where` is given. Emails are
+    indexed as several chunks, so extra chunks are fetched and collapsed back
+    to (up to k) distinct messages.
+    """
+    k = retriever.search_kwargs.get("k", 4)
+    kwargs = {"k": k * 3}
+    if where:
+        kwargs["filter"] = where
+    with span("retrieve") as s:
+        docs = collapse_chunks(retriever.invoke(query, **kwargs), k)
+        s["docs"] = len(docs)
+    return docs
+
+
+def _listing(rows):
+    return "\n".join(
+        f"From: {r['from']}\nSubject: {r['subject']}\nReceived: {r['received']}\n" for r in rows
+    )
+
+
+def aggregate_answer(query, aggregates, now=None):
+    """
+    Answer count / latest / top-sender / per-domain questions exactly from the
+    aggregate store. Returns None for anything else, including questions about
+    a topic ("how many emails mention the exam?"): those need retrieval.
+    """
+    query_lower = query.lower()
+    if topic_words(query):
+        return None
+    date_range = query_date_range(query, now)
+    filters = {"domain": query_domain(query)}
+    if date_range:
+        filters["start"], filters["end"] = date_range
+
+    if _TOP_SENDERS_RE.search(query_lower):
+        rows = aggregates.top_senders(5, **filters)
+        if not rows:
+            return "📭 No emails found for that question."
+        return "📊 Top senders:\n" + "\n".join(f"{sender}: {n} email(s)" for sender, n in rows)
+
+    if _DOMAINS_RE.search(query_lower) and _PER_RE.search(query_lower):
+        rows = aggregates.per_domain(10, **filters)
+        if not rows:
+            return "📭 No emails found for that question."
+        return "🌐 Emails per domain:\n" + "\n".join(f"{domain or '(unknown)'}: {n}" for domain, n in rows)
+
+    if _COUNT_RE.search(query_lower):
+        count = aggregates.count(**filters)
+        if count == 0:
+            return "📭 You didn’t receive any emails matching that timeframe."
+        senders = [sender for sender, _ in aggregates.top_senders(6, **filters)]
+        senders_list = ", ".join(senders[:5]) + ("..." if len(senders) > 5 else "")
+        return f"📬 You received {count} email(s). Some senders include: {senders_list}"
+
+    if _LATEST_RE.search(query_lower):
+        latest = aggregates.latest(1, **filters)
+        if not latest:
+            return "I couldn’t find any recent emails."
+        latest = latest[0]
+        return (
+            f"Latest email was from {latest['from']} "
+            f"with subject '{latest['subject']}' "
+            f"received on {latest['received']}."
+        )
+
+    if filters["domain"] and not date_range and re.search(r"\bfrom\b", query_lower):
+        rows = aggregates.latest(5, **filters)
+        if rows:
+            return f"📧 Emails from {filters['domain']}:\n{_listing(rows)}"
+    return None
+
+
+def answer_scope(query, now=None):
+    """
+    What an answer depends on besides the wording: the resolved date window /
+    domain and any numbers, so "today" asked tomorrow or "latest 3" vs "latest 5"
+    never share a cached answer.
+    """
+    return json.dumps([query_filter(query, now), re.findall(r"\d+", query)], sort_keys=True)
+
+
 # --- Intelligent answering logic ---
-def smart_answer(query, retriever, llm):
+def smart_answer(query, retriever, llm, aggregates=None, stats=None, cache=None):
+    """
+    Answer a question about the indexed emails. Rule-based branches answer
+    without the LLM; if given, `stats` receives the prompt-token count and
+    citations of an LLM answer. With an AnswerCache, repeated (or near-identical)
+    questions are answered from it without retrieval or the LLM.
+    """
+    if cache is None:
+        with span("answer"):
+            return _answer(query, retriever, llm, aggregates, stats)
+
+    scope = answer_scope(query)
+    with span("answer.cache_lookup"):
+        hit = cache.get(query, scope)
+    if hit is not None:
+        answer, similarity = hit
+        incr("answer.cache_hits")
+        print(f"⚡ Cached answer (similarity {similarity:.2f})")
+        if stats is not None:
+            stats.update({"cached": True, "similarity": similarity})
+        return answer
+    with span("answer"):
+        answer = _answer(query, retriever, llm, aggregates, stats)
+    cache.put(query, answer, scope)
+    return answer
+
+
+def rule_answer(query, retriever, aggregates=None):
+    """
+    Answer from aggregates or a rule-based branch over the retrieved emails.
+    Returns (answer, docs); answer is None when the question needs the LLM.
+    """
     query_lower = query.lower()
-    docs = retriever.get_relevant_documents(query)
-    now = datetime.utcnow()
 
-    # --- 1. COUNTING FEATURES ---
-    if "how many" in query_lower or "count" in query_lower:
+    # --- 0. EXACT AGGREGATES (no retrieval, no LLM) ---
+    if aggregates is not None:
+        answer = aggregate_answer(query, aggregates)
+        if answer is not None:
+            return answer, []
+
+    docs = retrieve(retriever, query, where=query_filter(query))
+    now = datetime.now(timezone.utc)
+
+    # --- 1. COUNTING FEATURES (counts of a topic are left to the LLM) ---
+    if _COUNT_RE.search(query_lower) and not topic_words(query):
         count = 0
         matched_docs = []
 
-        # Handle "today", "yesterday", "week", "month"
+        date_range = query_date_range(query, now)
         for d in docs:
             received = d.metadata.get("received")
-            if not received:
+            if not received or not date_range:
                 continue
             try:
                 dt = datetime.fromisoformat(received.replace("Z", "+00:00"))
-            except:
+            except ValueError:
                 continue
-
-            if "today" in query_lower and dt.date() == now.date():
-                count += 1
-                matched_docs.append(d)
-            elif "yesterday" in query_lower and dt.date() == (now - timedelta(days=1)).date():
-                count += 1
-                matched_docs.append(d)
-            elif "week" in query_lower and dt.date() >= (now - timedelta(days=7)).date():
-                count += 1
-                matched_docs.append(d)
-            elif "month" in query_lower and dt.month == now.month:
+            if date_range[0] <= dt < date_range[1]:
                 count += 1
                 matched_docs.append(d)
 
         if count > 0:
             senders = list({doc.metadata.get("from", "unknown") for doc in matched_docs})
             senders_list = ", ".join(senders[:5]) + ("..." if len(senders) > 5 else "")
-            return f"📬 You received {count} email(s). Some senders include: {senders_list}"
+            return f"📬 You received {count} email(s). Some senders include: {senders_list}", docs
         else:
-            return "📭 You didn’t receive any emails matching that timeframe."
+            return "📭 You didn’t receive any emails matching that timeframe.", docs
 
     # --- 2. FILTER BY DOMAIN ---
-    if "giki" in query_lower:
+    if re.search(r"\bgiki\b", query_lower):
         giki_docs = [d for d in docs if "giki.edu.pk" in str(d.metadata.get("from", "")).lower()]
         if giki_docs:
             result = "\n".join(
@@ -70,24 +351,19 @@ def smart_answer(query, retriever, llm):
                     for d in giki_docs[:5]
                 ]
             )
-            return f"📧 Emails from GIKI:\n{result}"
-        return "No GIKI emails found."
+            return f"📧 Emails from GIKI:\n{result}", docs
+        return "No GIKI emails found.", docs
 
     # --- 3. FILTER BY DATE RANGE (months) ---
-    months = {
-        "january": 1, "february": 2, "march": 3, "april": 4,
-        "may": 5, "june": 6, "july": 7, "august": 8,
-        "september": 9, "october": 10, "november": 11, "december": 12
-    }
-
-    found_months = [m for m in months if m in query_lower]
-    if found_months:
-        month_nums = [months[m] for m in found_months]
+    month_nums = mentioned_months(query)
+    if month_nums:
+        found_months = [name for n in month_nums for name, number in MONTHS.items() if number == n]
+        start, end = query_date_range(query, now)
         month_docs = [
             d for d in docs
-            if d.metadata.get("received") and datetime.fromisoformat(
+            if d.metadata.get("received") and start <= datetime.fromisoformat(
                 d.metadata["received"].replace("Z", "+00:00")
-            ).month in month_nums
+            ) < end
         ]
         if month_docs:
             result = "\n".join(
@@ -96,11 +372,11 @@ def smart_answer(query, retriever, llm):
                     for d in month_docs[:8]
                 ]
             )
-            return f"📬 Emails between {' and '.join(found_months)} — found {len(month_docs)} result(s):\n\n{result}"
-        return f"No emails found between {' and '.join(found_months)}."
+            return f"📬 Emails between {' and '.join(found_months)} — found {len(month_docs)} result(s):\n\n{result}", docs
+        return f"No emails found between {' and '.join(found_months)}.", docs
 
     # --- 4. LOST & FOUND / keyword search ---
-    if "lost" in query_lower or "found" in query_lower:
+    if _LOST_FOUND_RE.search(query_lower):
         lf_docs = [
             d for d in docs if "lost" in d.page_content.lower() or "found" in d.page_content.lower()
         ]
@@ -111,11 +387,11 @@ def smart_answer(query, retriever, llm):
                     for d in lf_docs[:5]
                 ]
             )
-            return f"📦 Lost & Found related emails:\n{result}"
-        return "No lost or found related emails found."
+            return f"📦 Lost & Found related emails:\n{result}", docs
+        return "No lost or found related emails found.", docs
 
     # --- 5. GENERAL QUERY ---
-    if "latest" in query_lower or "recent" in query_lower:
+    if _LATEST_RE.search(query_lower):
         if docs:
             latest = sorted(
                 [d for d in docs if d.metadata.get("received")],
@@ -126,9 +402,88 @@ def smart_answer(query, retriever, llm):
                 f"Latest email was from {latest.metadata.get('from')} "
                 f"with subject '{latest.metadata.get('subject')}' "
                 f"received on {latest.metadata.get('received')}."
-            )
-        return "I couldn’t find any recent emails."
+            ), docs
+        return "I couldn’t find any recent emails.", docs
+
+    return None, docs
+
+
+def _generation(query, docs, stats=None):
+    """Token-budgeted prompt for the LLM fallback; records its size in `stats`."""
+    prompt, citations, prompt_tokens = build_prompt(query, docs)
+    print(f"🧾 LLM prompt: {prompt_tokens} tokens, {len(citations)} excerpt(s)")
+    if stats is not None:
+        stats.update({"prompt_tokens": prompt_tokens, "citations": citations})
+    return prompt, citations, prompt_tokens
+
+
+def _sources(citations):
+    return "\n\nSources:\n" + "\n".join(citations) if citations else ""
+
+
+def _answer(query, retriever, llm, aggregates=None, stats=None):
+    answer, docs = rule_answer(query, retriever, aggregates)
+    if answer is not None:
+        return answer
+
+    # --- 6. Default to LLM reasoning (token-budgeted context) ---
+    prompt, citations, prompt_tokens = _generation(query, docs, stats)
+    with span("llm.invoke", prompt_tokens=prompt_tokens) as s:
+        result = llm.invoke(prompt)
+        answer = result.content.strip() if hasattr(result, "content") else str(result)
+        s["completion_tokens"] = count_tokens(answer)
+    return answer + _sources(citations)
+
+
+def stream_answer(query, retriever, llm, aggregates=None, stats=None, cache=None, on_citations=None):
+    """
+    Streaming smart_answer: yields the answer as text pieces, LLM answers token
+    by token. `on_citations(citations)` is called once retrieval is done and
+    before generation starts; without it the sources are yielded at the end.
+    `stats` gets "ttft" (seconds to the first piece) and "elapsed".
+    """
+    started = time.perf_counter()
+    stats = {} if stats is None else stats
+
+    def timed(pieces):
+        for piece in pieces:
+            if piece and "ttft" not in stats:
+                stats["ttft"] = time.perf_counter() - started
+                print(f"⏱️ First token after {stats['ttft']:.2f}s")
+            yield piece
+        stats["elapsed"] = time.perf_counter() - started
+
+    scope = answer_scope(query) if cache is not None else None
+    if cache is not None:
+        hit = cache.get(query, scope)
+        if hit is not None:
+            answer, similarity = hit
+            incr("answer.cache_hits")
+            stats.update({"cached": True, "similarity": similarity})
+            yield from timed([answer])
+            return
+
+    answer, docs = rule_answer(query, retriever, aggregates)
+    if answer is None:
+        prompt, citations, prompt_tokens = _generation(query, docs, stats)
+        if on_citations is not None and citations:
+            on_citations(citations)
+        parts = []
+        llm_started = time.perf_counter()
+        for piece in timed(chunk.content if hasattr(chunk, "content") else str(chunk)
+                           for chunk in llm.stream(prompt)):
+            if not parts:
+                metrics.observe("llm.first_token", time.perf_counter() - llm_started)
+            parts.append(piece)
+            yield piece
+        answer = "".join(parts).strip()
+        metrics.observe("llm.stream", time.perf_counter() - llm_started,
+                        {"prompt_tokens": prompt_tokens, "completion_tokens": count_tokens(answer)})
+        answer += _sources(citations)
+        if on_citations is None:
+            yield _sources(citations)
+    else:
+        yield from timed([answer])
 
-    # --- 6. Default to LLM reasoning ---
-    result = llm.invoke(f"Answer based on these email snippets: {docs}\n\nQuestion: {query}")
-    return result.content.strip() if hasattr(result, "content") else str(result)
+    if cache is not None:
+        cache.put(query, answer, scope)
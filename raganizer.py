@@ -1,34 +1,480 @@
 # raganizer.py
-from bs4 import BeautifulSoup
-from langchain.docstore.document import Document
-from langchain_huggingface import HuggingFaceEmbeddings
+import hashlib
+import html
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
 
-from langchain_community.vectorstores import Chroma
+from aggregates import AggregateStore, received_timestamp, sender_domain
+from dedup import DedupIndex
+from embedding_service import get_embeddings, get_tokenizer
+from graph_utils import to_graph_datetime
+from lexical_index import LexicalIndex
+from metrics import incr, metrics, span
+
+# langchain / Chroma are imported inside the functions that need them so that
+# importing this module (e.g. at Streamlit startup) stays cheap.
+
+MANIFEST_FILE = "manifest.json"
+INDEX_DIR = "chroma_db"  # one long-lived index for every indexed day
+
+CLEAN_WORKERS = int(os.getenv("CLEAN_WORKERS", "0")) or os.cpu_count() or 1
+PARALLEL_CLEAN_MIN = 256  # below this many bodies a process pool costs more than it saves
+
+# Only "<" + tag name, "/", "!" or "?" opens markup; "a < b" stays text
+_TAG_OPEN = re.compile(r"<(?=[A-Za-z/!?])")
+_RAW_TEXT = re.compile(r"<(script|style|template)\b", re.I)
+_RAW_END = {name: re.compile(rf"</{name}\s*>", re.I) for name in ("script", "style", "template")}
+_SPACES = re.compile(r"[ \t\r\f\v\u00a0\u200b]+")
+_clean_pool = None
+
+# --- Chunking: MiniLM truncates at 256 word pieces, so chunks stay below that ---
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "200"))
+CHUNK_OVERLAP = 20
+# Chunks per message (body + attachments); anything beyond is dropped and its
+# chunks are marked "truncated". High enough that real emails are never cut.
+MAX_CHUNKS = int(os.getenv("MAX_CHUNKS", "200"))
+# Without the model's tokenizer, token counts are estimated; the estimate
+# undercounts rare words, so budgets shrink by this factor to stay under 256
+ESTIMATE_MARGIN = 0.75
+SIGNATURE_LINES = 10  # a "-- " delimiter only starts the signature this close to the end
+SIGN_OFF_BLOCK = 4  # a sign-off ("Thanks!") is only cut when at most this many short lines follow
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_REPLY_MARKER = re.compile(
+    r"^(?:On\b[^\n]{4,200}(?:\n[^\n]{0,100})?wrote:\s*$"
+    r"|-{2,}\s*Original Message\s*-{2,}"
+    r"|From: [^\n]+\n(?:Sent|Date): )",
+    re.M | re.I,
+)
+_FORWARD_MARKER = re.compile(r"^(?:-{2,}\s*Forwarded message\s*-{2,}|Begin forwarded message:)\s*$", re.M | re.I)
+_HEADER_LINE = re.compile(r"^(?:From|Sent|Date|To|Cc|Subject):[^\n]*$", re.M | re.I)
+_SIGNATURE = re.compile(r"^(?:-- |Sent from my [^\n]+|Get Outlook for [^\n]+)$", re.M)
+_SIGN_OFF = re.compile(r"^(?:(?:best|kind|warm|many)?\s*regards|thanks|thank you|cheers|sincerely|best)[,!.]?$", re.I)
+_ABBREVIATION_END = re.compile(r"\b[A-Z][A-Za-z]{0,3}\.$")  # "Ltd.", "Jr.", "Ph.D."
 
 def clean_html(html_text):
     """Remove HTML tags and return plain text."""
     if not html_text:
         return ""
+    from bs4 import BeautifulSoup
+
     return BeautifulSoup(html_text, "html.parser").get_text(separator="\n")
 
-def emails_to_documents(messages):
-    """Convert raw Outlook email JSON to LangChain Document objects."""
+def _normalize_line(line):
+    line = _SPACES.sub(" ", line)
+    return line if line == "-- " else line.strip()  # keep the signature delimiter's trailing space
+
+def normalize_whitespace(text):
+    """Collapse runs of spaces and drop blank lines."""
+    lines = (_normalize_line(line) for line in text.split("\n"))
+    return "\n".join(line for line in lines if line)
+
+def _strip_tags(text):
+    """
+    Replace every tag, comment and script/style/template block with a newline
+    in one left-to-right pass, like html.parser: a "<" that never closes is
+    text. Every search resumes past the previous match and a failed search is
+    never repeated, so adversarial input (thousands of stray "<") stays linear.
+    """
+    out, pos = [], 0
+    missing = set()  # terminators that no longer occur: never searched for twice
+    while True:
+        match = _TAG_OPEN.search(text, pos)
+        if match is None:
+            break
+        start = match.start()
+        terminator = "-->" if text.startswith("<!--", start) else ">"
+        end = -1 if terminator in missing else text.find(terminator, start + 1)
+        if end < 0:
+            if terminator == ">":
+                break  # no ">" anywhere after: the rest is plain text
+            missing.add(terminator)  # an unterminated "<!--" is text; later tags still count
+            out.append(text[pos:start + 1])
+            pos = start + 1
+            continue
+        end += len(terminator)
+        out.append(text[pos:start])
+        out.append("\n")
+        raw = _RAW_TEXT.match(text, start)
+        if raw:
+            close = _RAW_END[raw.group(1).lower()].search(text, end)
+            end = close.end() if close else len(text)  # an unclosed <script> swallows the rest
+        pos = end
+    out.append(text[pos:])
+    return "".join(out)
+
+def clean_html_fast(html_text):
+    """
+    Tokenizer version of clean_html (no DOM): drops script/style blocks and
+    comments, breaks on every tag like get_text(separator="\n") and collapses
+    whitespace. Same words as clean_html, several times faster, and linear in
+    the input length even for malformed markup.
+    """
+    if not html_text:
+        return ""
+    return normalize_whitespace(html.unescape(_strip_tags(html_text)))
+
+def body_text(body):
+    """Plain text of a Graph `body`; text bodies (Prefer: outlook.body-content-type) skip parsing."""
+    body = body or {}
+    content = body.get("content") or ""
+    if (body.get("contentType") or "").lower() == "text":
+        return normalize_whitespace(content)
+    return clean_html_fast(content)
+
+def _body_texts(bodies):
+    return [body_text(b) for b in bodies]
+
+def clean_bodies(bodies, workers=CLEAN_WORKERS):
+    """body_text() over many bodies, fanned out to a process pool for large batches."""
+    global _clean_pool
+    bodies = list(bodies)
+    with span("clean.bodies", texts=len(bodies)):
+        if workers <= 1 or len(bodies) < PARALLEL_CLEAN_MIN:
+            return _body_texts(bodies)
+        if _clean_pool is None:
+            _clean_pool = ProcessPoolExecutor(max_workers=workers)
+        size = -(-len(bodies) // workers)
+        chunks = [bodies[i:i + size] for i in range(0, len(bodies), size)]
+        return [text for part in _clean_pool.map(_body_texts, chunks) for text in part]
+
+def _estimate_tokens(text):
+    """Word-piece estimate: words + punctuation, long runs (ids, base64) cost extra."""
+    return sum(1 + max(0, len(t) - 8) // 4 for t in _TOKEN_RE.findall(text))
+
+def count_tokens(text):
+    """Tokens of `text` for the embedding model: its tokenizer's count, else an estimate."""
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return _estimate_tokens(text)
+    return len(tokenizer(text, add_special_tokens=False)["input_ids"])
+
+def _word_costs(words):
+    """Per-word token counts, tokenized in one batch when the model's tokenizer is available."""
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return [max(1, _estimate_tokens(w)) for w in words]
+    return [max(1, len(ids)) for ids in tokenizer(words, add_special_tokens=False)["input_ids"]]
+
+def _signature_line(line):
+    """A name / title / contact line of a signature block rather than a sentence."""
+    line = line.strip()
+    if len(line.split()) > 6 or "!" in line or "?" in line:
+        return False
+    return not line.endswith(".") or bool(_ABBREVIATION_END.search(line))
+
+def strip_quoted(text, forwarded=False):
+    """
+    Keep only what this email adds: drop '>' quoted lines, the reply history
+    below "On … wrote:" / Outlook "From:/Sent:" headers, and the signature.
+    Forwards keep the forwarded body and only lose its header block.
+    """
+    text = "\n".join(line for line in text.split("\n") if not line.lstrip().startswith(">"))
+    if forwarded or _FORWARD_MARKER.search(text):
+        text = _HEADER_LINE.sub("", _FORWARD_MARKER.sub("", text))
+    else:
+        match = _REPLY_MARKER.search(text)
+        if match and match.start() > 0:
+            text = text[:match.start()]
+
+    for match in _SIGNATURE.finditer(text):
+        if match.start() == 0:
+            continue
+        # "Sent from my …" ends the text anywhere; a "-- " line only near the end
+        if match.group() != "-- " or text.count("\n", match.end()) <= SIGNATURE_LINES:
+            text = text[:match.start()]
+            break
+    lines = [line for line in text.split("\n") if line.strip()]
+    # A sign-off starts the signature block only if no more than a short name /
+    # title block follows it ("Best regards,\nName\nTitle", not "Thanks!\nThe exam is moved…")
+    for i in range(max(1, len(lines) - SIGN_OFF_BLOCK - 1), len(lines)):
+        if _SIGN_OFF.match(lines[i].strip()) and all(map(_signature_line, lines[i + 1:])):
+            lines = lines[:i]
+            break
+    return "\n".join(lines)
+
+def split_tokens(text, budget=CHUNK_TOKENS, overlap=CHUNK_OVERLAP, max_chunks=None):
+    """Split text into pieces of ~`budget` tokens (at most `max_chunks`), overlapping by `overlap`."""
+    words = text.split()
+    if not words:
+        return [""]
+    if get_tokenizer() is None:
+        budget, overlap = int(budget * ESTIMATE_MARGIN), int(overlap * ESTIMATE_MARGIN)
+    costs = _word_costs(words)
+    chunks, start = [], 0
+    while start < len(words) and (max_chunks is None or len(chunks) < max_chunks):
+        end, used = start, 0
+        while end < len(words) and (used + costs[end] <= budget or end == start):
+            used += costs[end]
+            end += 1
+        chunks.append(" ".join(words[start:end]))
+        if end >= len(words):
+            break
+        # step back so the next chunk repeats the last ~overlap tokens
+        back, carried = end, 0
+        while back > start + 1 and carried + costs[back - 1] <= overlap:
+            back -= 1
+            carried += costs[back]
+        start = back
+    return chunks
+
+def attachment_files(m):
+    """[[name, size]] of the attachments ingested into `m` (see attachments.py)."""
+    return [[a.get("name"), a.get("size")] for a in m.get("attachments") or []]
+
+def message_hash(m, attachments=None):
+    """
+    Hash of the message fields that end up in its Documents, including the
+    names and sizes of its attachments. `attachments` ([[name, size]]) stands
+    in for m["attachments"] before they are ingested (see is_indexed).
+    """
+    sender = m.get("from", {}).get("emailAddress", {}).get("address", "")
+    parts = [m.get("subject") or "", sender, m.get("receivedDateTime") or "", m.get("body", {}).get("content") or ""]
+    files = attachment_files(m) if attachments is None or "attachments" in m else attachments
+    parts += sorted(f"{name}\x1e{size}" for name, size in files)
+    return hashlib.sha1("\x1f".join(parts).encode("utf-8")).hexdigest()[:16]
+
+def is_indexed(entry, m, ingest_attachments=False):
+    """
+    True if manifest `entry` is current for message `m`. Attachments are only
+    listed while ingesting, so the ones indexed last time are assumed; with
+    `ingest_attachments`, a message whose attachments were never ingested
+    (indexed before ingestion was on) is not current.
+    """
+    if not entry:
+        return False
+    if ingest_attachments and m.get("hasAttachments") and "attachments" not in entry:
+        return False
+    return entry.get("hash") == message_hash(m, entry.get("attachments") or [])
+
+def emails_to_documents(messages, dedup=None):
+    """
+    Convert raw Outlook email JSON to LangChain Document objects: one per
+    token-bounded chunk of the email's own text (quotes and signature removed),
+    each carrying the parent message's metadata plus its chunk number.
+    With a DedupIndex, the body of a near-duplicate of an already indexed
+    message yields a single placeholder instead (metadata "duplicate_of"; see
+    is_duplicate): it holds the whole text for the lexical index but is never embedded.
+    Extracted attachment text (m["attachments"], see attachments.py) is chunked
+    after the body, each chunk tagged with the attachment's name; a
+    duplicate's attachments are its own and are always chunked.
+    """
+    from langchain_core.documents import Document
+
+    messages = list(messages)
+    texts = clean_bodies(m.get("body") for m in messages)
+    started = time.perf_counter()
     docs = []
-    for m in messages:
+    for m, text in zip(messages, texts):
         subject = m.get("subject", "")
         sender = m.get("from", {}).get("emailAddress", {}).get("address", "")
-        body_html = m.get("body", {}).get("content", "")
-        text = clean_html(body_html)
-        doc_text = f"Subject: {subject}\nFrom: {sender}\n\n{text}"
-        metadata = {"subject": subject, "from": sender, "received": m.get("receivedDateTime")}
-        docs.append(Document(page_content=doc_text, metadata=metadata))
+        header = f"Subject: {subject}\nFrom: {sender}\n\n"
+        forwarded = subject.lower().startswith(("fw:", "fwd:"))
+        body_budget = max(CHUNK_TOKENS - count_tokens(header), 50)
+        own_text = strip_quoted(text, forwarded)
+        metadata = {
+            "id": m.get("id"), "subject": subject, "from": sender, "received": m.get("receivedDateTime"),
+            "received_ts": received_timestamp(m.get("receivedDateTime")), "domain": sender_domain(sender),
+            "conversation_id": m.get("conversationId") or "", "content_hash": message_hash(m),
+        }
+        if "attachments" in m:
+            metadata["attachment_files"] = json.dumps(attachment_files(m))
+        duplicate_of = None
+        if dedup is not None and m.get("id"):
+            rep = dedup.assign(m["id"], own_text, m.get("conversationId"))
+            duplicate_of = rep if rep != m["id"] else None
+        chunks = [] if duplicate_of else [(header, chunk, None) for chunk in split_tokens(own_text, budget=body_budget)]
+        for attachment in m.get("attachments") or []:
+            prefix = f"{header}Attachment: {attachment['name']}\n\n"
+            budget = max(CHUNK_TOKENS - count_tokens(prefix), 50)
+            chunks += [(prefix, chunk, attachment["name"]) for chunk in split_tokens(attachment["text"], budget=budget)]
+        if len(chunks) > MAX_CHUNKS:
+            print(f"✂️ {m.get('id')}: indexing {MAX_CHUNKS} of {len(chunks)} chunks (MAX_CHUNKS).")
+            incr("chunk.truncated")
+            chunks = chunks[:MAX_CHUNKS]
+            metadata["truncated"] = True
+        first = 0
+        if duplicate_of:
+            placeholder = {**metadata, "chunk": 0, "chunks": len(chunks), "duplicate_of": duplicate_of}
+            docs.append(Document(page_content=header + own_text, metadata=placeholder))
+            first = 1
+        for n, (prefix, chunk, attachment) in enumerate(chunks, first):
+            chunk_metadata = {**metadata, "chunk": n, "chunks": len(chunks)}
+            if attachment:
+                chunk_metadata["attachment"] = attachment
+            docs.append(Document(page_content=prefix + chunk, metadata=chunk_metadata))
+    metrics.observe("chunk.documents", time.perf_counter() - started, {"messages": len(messages), "chunks": len(docs)})
     return docs
 
-def make_or_load_chroma(docs, persist_dir="chroma_db"):
-    """Embed emails and store in a persistent Chroma vector database."""
-    print("🔄 Creating embeddings using HuggingFace (offline)...")
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-    chroma = Chroma.from_documents(docs, embedding=embeddings, persist_directory=persist_dir)
-    chroma.persist()
-    print(f"✅ Saved embeddings to {persist_dir}/")
+def is_duplicate(doc):
+    """True for the placeholder of a collapsed near-duplicate (no vectors of its own)."""
+    return bool(doc.metadata.get("duplicate_of"))
+
+def document_id(doc):
+    """Stable Chroma id: Graph message id plus the hash of its content (and the chunk number)."""
+    content_hash = doc.metadata.get("content_hash") or hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()[:16]
+    return f"{doc.metadata.get('id')}:{content_hash}:{doc.metadata.get('chunk', 0)}"
+
+def group_by_message(docs):
+    """{message id: [chunk documents]} in input order."""
+    groups = {}
+    for doc in docs:
+        groups.setdefault(doc.metadata.get("id"), []).append(doc)
+    return groups
+
+# --- Index manifest: which message (and which version of it) is in a persist dir ---
+def load_manifest(persist_dir):
+    path = os.path.join(persist_dir, MANIFEST_FILE)
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            return json.load(f)
+    return {"version": None, "messages": {}}
+
+def save_manifest(persist_dir, manifest, final=True):
+    """
+    Write the manifest atomically. A `final` save (the end of an index run) also
+    bumps its version, a hash of the indexed ids; mid-run checkpoints keep the
+    old one so caches keyed on it (answer_cache.py) survive until the run ends.
+    """
+    os.makedirs(persist_dir, exist_ok=True)
+    if final:
+        ids = sorted(i for entry in manifest["messages"].values() for i in entry["ids"])
+        manifest["version"] = hashlib.sha1("\n".join(ids).encode("utf-8")).hexdigest()[:16]
+    path = os.path.join(persist_dir, MANIFEST_FILE)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, path)
+
+def in_scope(entry, scope):
+    """True if a manifest entry was received inside `scope` = (start, end), or scope is None."""
+    if scope is None:
+        return True
+    start, end = (to_graph_datetime(b) for b in scope)
+    return start <= (entry.get("received") or "") < end
+
+def manifest_entries(docs):
+    """Manifest entries for the messages behind `docs` (all chunks of a message together)."""
+    entries = {}
+    for mid, chunks in group_by_message(docs).items():
+        entry = {
+            "hash": chunks[0].metadata.get("content_hash"),
+            "received": chunks[0].metadata.get("received"),
+            "ids": [document_id(d) for d in chunks if not is_duplicate(d)],
+        }
+        if "attachment_files" in chunks[0].metadata:
+            entry["attachments"] = json.loads(chunks[0].metadata["attachment_files"])
+        if is_duplicate(chunks[0]):
+            entry["dup_of"] = chunks[0].metadata["duplicate_of"]
+        entries[mid] = entry
+    return entries
+
+class IndexWriter:
+    """
+    Bookkeeping shared by make_or_load_chroma and the pipeline: writes batches
+    of chunks to Chroma together with the manifest, aggregates and lexical
+    index, drops the outdated chunks of changed messages, and prunes messages
+    that are gone. Nothing is on disk in the manifest until save().
+    """
+
+    def __init__(self, db, persist_dir):
+        self.db = db
+        self.persist_dir = persist_dir
+        self.manifest = load_manifest(persist_dir)
+        self.known = self.manifest["messages"]
+        self.aggregates = AggregateStore(persist_dir)
+        self.lexical = LexicalIndex(persist_dir)
+
+    def write(self, batch, vectors):
+        """
+        Index `batch` (every chunk of each of its messages) with `vectors` for
+        its non-duplicate chunks, in order. Returns the number of messages.
+        """
+        chunks = [d for d in batch if not is_duplicate(d)]  # collapsed copies have no vectors
+        ids = [document_id(d) for d in chunks]
+        if chunks:
+            with span("chroma.write", chunks=len(chunks)):
+                self.db._collection.upsert(
+                    ids=ids,
+                    embeddings=vectors,
+                    documents=[d.page_content for d in chunks],
+                    metadatas=[d.metadata for d in chunks],
+                )
+        # Drop the previous version of messages whose content changed
+        entries = manifest_entries(batch)
+        stale = [i for mid in entries for i in self.known.get(mid, {}).get("ids", []) if i not in ids]
+        self._delete(stale)
+        self.known.update(entries)
+        self.aggregates.upsert([d.metadata for d in batch])
+        # Collapsed copies keep their own text in the lexical index (order numbers,
+        # amounts): exact-term searches still find them
+        copies = [d for d in batch if is_duplicate(d)]
+        self.lexical.delete_messages(list(entries))
+        self.lexical.add(ids, chunks)
+        self.lexical.add([document_id(d) for d in copies], copies, keep_text=True)
+        return len(entries)
+
+    def prune(self, seen, scope=None):
+        """
+        Delete indexed messages that are not in `seen` and were received inside
+        `scope` = (start, end) (or anywhere if scope is None). Returns their ids.
+        """
+        removed = [mid for mid, entry in self.known.items() if mid not in seen and in_scope(entry, scope)]
+        if not removed:
+            return removed
+        self._delete([i for mid in removed for i in self.known.pop(mid)["ids"]])
+        self.lexical.delete_messages(removed)
+        self.aggregates.delete(removed)
+        # Copies of a removed representative lost their vectors: re-embed them next run
+        for mid in DedupIndex(self.persist_dir).remove(removed):
+            if mid in self.known:
+                self.known[mid]["hash"] = None
+        return removed
+
+    def _delete(self, ids):
+        if ids:
+            with span("chroma.delete", chunks=len(ids)):
+                self.db._collection.delete(ids=ids)
+            self.lexical.delete(ids)
+
+    def save(self, final=True):
+        """Write the manifest (see save_manifest)."""
+        save_manifest(self.persist_dir, self.manifest, final)
+
+def make_or_load_chroma(docs, persist_dir=INDEX_DIR, prune=None, scope=None):
+    """
+    Embed emails into a persistent Chroma store, incrementally.
+    Only documents that are new or whose content changed are embedded (upserted
+    under a stable id); outdated versions are deleted, and with `prune` so are
+    messages in the store that are no longer among `docs`. `scope=(start, end)`
+    limits pruning to messages received in that window (e.g. the re-indexed day).
+    By default only a scoped call prunes: the store holds many days, so an
+    unscoped prune would drop every day but this one (pass prune=True for that).
+    """
+    if prune is None:
+        prune = scope is not None
+    from langchain_community.vectorstores import Chroma
+
+    embeddings = get_embeddings()
+    chroma = Chroma(persist_directory=persist_dir, embedding_function=embeddings)
+    writer = IndexWriter(chroma, persist_dir)
+
+    groups = group_by_message(docs)
+    changed = [d for mid, chunks in groups.items()
+               if writer.known.get(mid, {}).get("hash") != chunks[0].metadata.get("content_hash") for d in chunks]
+    embedded = [d for d in changed if not is_duplicate(d)]
+    if changed:
+        print(f"🔄 Embedding {len(embedded)} new/changed chunks using HuggingFace (offline)...")
+        vectors = embeddings.embed_documents([d.page_content for d in embedded]) if embedded else []
+        writer.write(changed, vectors)
+    removed = writer.prune(set(groups), scope) if prune else []
+
+    if not changed and not removed:
+        print(f"✅ {persist_dir}/ already up to date ({len(writer.known)} emails).")
+        return chroma
+    writer.save()
+    print(f"✅ Saved embeddings to {persist_dir}/ (+{len(embedded)} chunks / -{len(removed)} emails)")
     return chroma
@@ -0,0 +1,117 @@
+# retrieval_service.py — one shared retrieval backend per index for every app session
+import os
+import threading
+from contextlib import contextmanager
+
+from answer_cache import AnswerCache
+from embedding_service import get_embeddings
+from metrics import incr, span
+from qa import open_aggregates, query_filter, retrieve, smart_answer, stream_answer
+
+MAX_INFLIGHT = int(os.getenv("SERVICE_MAX_INFLIGHT", "8"))  # queries served at once, all users
+MAX_USER_INFLIGHT = int(os.getenv("SERVICE_MAX_USER_INFLIGHT", "2"))  # ...and per user
+ADMISSION_TIMEOUT = float(os.getenv("SERVICE_ADMISSION_TIMEOUT", "10"))  # seconds a query may queue
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini")
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+class ServiceBusy(RuntimeError):
+    """A query waited longer than ADMISSION_TIMEOUT for a slot."""
+
+
+class RetrievalService:
+    """
+    Everything a question needs for one index, shared by all sessions: one
+    Chroma client, the lexical and aggregate stores, the answer cache and the
+    LLM client, over the process-wide embedding model (whose query embeddings
+    are micro-batched). Admission control bounds the queries in flight, both
+    overall and per user, so one busy analyst can't starve the others.
+    """
+
+    def __init__(self, persist_dir, embeddings=None, llm=None, max_inflight=MAX_INFLIGHT,
+                 max_user_inflight=MAX_USER_INFLIGHT, timeout=ADMISSION_TIMEOUT):
+        # Heavy imports are deferred until a service is actually needed
+        from langchain_chroma import Chroma
+
+        from hybrid_retriever import HybridRetriever
+        from lexical_index import LexicalIndex
+
+        print(f"🔍 Opening retrieval service for {persist_dir}...")
+        self.persist_dir = persist_dir
+        self.embeddings = embeddings or get_embeddings()
+        self.db = Chroma(persist_directory=persist_dir, embedding_function=self.embeddings)
+        lexical = LexicalIndex(persist_dir)
+        lexical.backfill_from_chroma(self.db)
+        self.retriever = HybridRetriever(vectorstore=self.db, lexical=lexical, search_kwargs={"k": 8})
+        self.aggregates = open_aggregates(persist_dir, self.db)
+        self.answer_cache = AnswerCache(persist_dir, self.embeddings)
+        self._llm = llm
+        self.max_user_inflight = max_user_inflight
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_inflight)
+        self._users = {}
+        self._users_lock = threading.Lock()
+        print("✅ Retrieval service ready.")
+
+    @property
+    def llm(self):
+        if self._llm is None:
+            from langchain_openai import ChatOpenAI
+
+            self._llm = ChatOpenAI(model=LLM_MODEL, temperature=0.2)
+        return self._llm
+
+    def _user_slots(self, user):
+        with self._users_lock:
+            if user not in self._users:
+                self._users[user] = threading.BoundedSemaphore(self.max_user_inflight)
+            return self._users[user]
+
+    @contextmanager
+    def admit(self, user=None):
+        """Hold a per-user and a global slot for the block; ServiceBusy if none frees up in time."""
+        user_slots = self._user_slots(user)
+        with span("service.admission") as s:
+            if not user_slots.acquire(timeout=self.timeout):
+                incr("service.rejected")
+                raise ServiceBusy(f"Too many queries in flight for {user or 'this user'}; try again shortly.")
+            if not self._slots.acquire(timeout=self.timeout):
+                user_slots.release()
+                incr("service.rejected")
+                raise ServiceBusy("The retrieval service is busy; try again shortly.")
+            s["admitted"] = 1
+        try:
+            yield
+        finally:
+            self._slots.release()
+            user_slots.release()
+
+    def retrieve(self, query, user=None, where=None):
+        with self.admit(user):
+            return retrieve(self.retriever, query, where if where is not None else query_filter(query))
+
+    def answer(self, query, user=None, stats=None):
+        with self.admit(user):
+            return smart_answer(query, self.retriever, self.llm, aggregates=self.aggregates, stats=stats,
+                                cache=self.answer_cache)
+
+    def stream(self, query, user=None, stats=None, on_citations=None):
+        """stream_answer() holding the user's slot until the last piece is out."""
+        with self.admit(user):
+            yield from stream_answer(query, self.retriever, self.llm, aggregates=self.aggregates, stats=stats,
+                                     cache=self.answer_cache, on_citations=on_citations)
+
+    def stats(self):
+        with self._users_lock:
+            users = len(self._users)
+        return {"persist_dir": self.persist_dir, "users": users, "answer_cache": self.answer_cache.stats()}
+
+
+def get_service(persist_dir):
+    """The process-wide RetrievalService for `persist_dir`."""
+    with _services_lock:
+        if persist_dir not in _services:
+            _services[persist_dir] = RetrievalService(persist_dir)
+        return _services[persist_dir]
@@ -1,5 +1,5 @@
 from datetime import date
-from graph_utils import list_messages, filter_messages_for_date
+from graph_utils import list_messages_for_date, filter_messages_for_date
 from dotenv import load_dotenv
 import os
 
@@ -8,12 +8,12 @@ ACCESS_TOKEN = os.getenv("ACCESS_TOKEN")
 
 
 
-# Fetch up to 50 messages
-all_msgs = list_messages(ACCESS_TOKEN, top=50)
+# Fetch today's messages (date filter runs on the Graph side)
+today = date.today()
+all_msgs = list_messages_for_date(ACCESS_TOKEN, today, top=50)
 print(f"Fetched {len(all_msgs)} total messages")
 
-# Filter by today's date
-today = date.today()
+# Local filter should agree with the server-side one
 filtered = filter_messages_for_date(all_msgs, today)
 print(f"Messages received today ({today}): {len(filtered)}")
 
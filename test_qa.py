@@ -1,8 +1,14 @@
 # test_qa.py — Interactive test runner for intelligent email QA
-from qa import load_qa_chain, smart_answer
+from answer_cache import AnswerCache
+from embedding_service import get_embeddings
+from qa import load_qa_chain, open_aggregates, stream_answer
+
+PERSIST_DIR = "chroma_db_test"  # the folder test_raganizer.py indexes into
 
 if __name__ == "__main__":
-    qa, retriever, llm, db = load_qa_chain()
+    qa, retriever, llm, db = load_qa_chain(PERSIST_DIR)
+    aggregates = open_aggregates(PERSIST_DIR, db)
+    cache = AnswerCache(PERSIST_DIR, get_embeddings())
 
     print("\n🧠 Smart Email QA Assistant is ready!")
     print("Type a question like:\n")
@@ -23,8 +29,14 @@ if __name__ == "__main__":
 
         print("\n🔎 Thinking...\n")
         try:
-            answer = smart_answer(query, retriever, llm)
-            print("🤖 Answer:\n" + answer + "\n")
+            print("🤖 Answer:")
+            pieces = stream_answer(
+                query, retriever, llm, aggregates=aggregates, cache=cache,
+                on_citations=lambda citations: print("Sources:\n" + "\n".join(citations) + "\n"),
+            )
+            for piece in pieces:
+                print(piece, end="", flush=True)
+            print("\n")
         except Exception as e:
             print(f"❌ Error while processing: {e}\n")
 
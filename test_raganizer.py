@@ -1,31 +1,15 @@
 # test_raganizer.py — adaptive email fetch version
-import json, os, time
+import time
 from datetime import datetime
-from auth_utils import get_access_token
-from graph_utils import list_messages
+from auth_utils import token_manager
+from graph_utils import day_range, fetch_controller
+from mail_store import MessageStore
+from mail_sync import fill_bodies, sync_mailbox, sync_covers
 from raganizer import emails_to_documents, make_or_load_chroma
 
-STATS_FILE = "fetch_stats.json"
-
-# --- Load last stats (if any) ---
-if os.path.exists(STATS_FILE):
-    with open(STATS_FILE, "r") as f:
-        stats = json.load(f)
-        last_top = stats.get("last_top", 50)
-        last_time = stats.get("last_time", 60)
-else:
-    stats = {}
-    last_top, last_time = 50, 60  # default start
-
-# --- Adaptive logic: adjust based on previous runtime ---
-if last_time < 45:  # system handled it easily → increase slightly
-    top = min(last_top + 25, 200)
-elif last_time > 90:  # last run was slow → reduce slightly
-    top = max(last_top - 25, 25)
-else:
-    top = last_top  # keep steady
-
-print(f"⚙️ Adaptive fetch size: {top} emails (based on last runtime ≈ {last_time:.1f}s)\n")
+# Page size and concurrency adapt to throttling and are remembered per tenant
+controller = fetch_controller()
+print(f"⚙️ Adaptive fetch settings: {controller.settings()}\n")
 
 # 1. Ask user for a date
 selected_date_str = input("📅 Enter a date (YYYY-MM-DD): ").strip()
@@ -35,20 +19,25 @@ except ValueError:
     print("❌ Invalid date format. Please use YYYY-MM-DD (e.g., 2025-10-13).")
     exit(1)
 
-# 2. Get (or refresh) token automatically
-ACCESS_TOKEN = get_access_token()
+# 2. Sign in; the manager renews the token in the background during long syncs
+ACCESS_TOKEN = token_manager()
+ACCESS_TOKEN.sign_in()
 
-# 3. Fetch emails
-print("📨 Fetching emails from Outlook...")
+# 3. Sync emails into the local store (only changes after the first run)
+store = MessageStore()
+day_start, _ = day_range(selected_date)
+print("📨 Syncing emails from Outlook...")
 start_time = time.time()
-msgs = list_messages(ACCESS_TOKEN, top=top)
+if sync_covers(store, day_start):
+    sync_mailbox(ACCESS_TOKEN, store)
+else:
+    sync_mailbox(ACCESS_TOKEN, store, since=day_start)
 elapsed = time.time() - start_time
-print(f"📬 Fetched {len(msgs)} total emails in {elapsed:.2f}s")
+print(f"📬 Synced mailbox in {elapsed:.2f}s ({store.count()} messages stored)")
 
-# 4. Filter emails for the selected date
-filtered_msgs = [
-    m for m in msgs if m.get("receivedDateTime", "").startswith(selected_date_str)
-]
+# 4. Read the selected date from the local store; the sync only stores
+# headers, so fetch the bodies not cached yet ($batch) before indexing
+filtered_msgs = fill_bodies(ACCESS_TOKEN, store, store.messages_for_date(selected_date))
 print(f"📅 Found {len(filtered_msgs)} emails for {selected_date_str}")
 
 if not filtered_msgs:
@@ -60,10 +49,8 @@ docs = emails_to_documents(filtered_msgs)
 print(f"📄 Converted {len(docs)} emails to LangChain Documents")
 
 # 6. Create and persist embeddings (offline)
-chroma = make_or_load_chroma(docs, persist_dir="chroma_db_test")
+# Only this day is replaced; other days already in the index are kept
+chroma = make_or_load_chroma(docs, persist_dir="chroma_db_test", scope=day_range(selected_date))
 print("✅ All done! Chroma database is ready for QA.\n")
 
-# --- Save performance stats for next run ---
-with open(STATS_FILE, "w") as f:
-    json.dump({"last_top": top, "last_time": elapsed}, f, indent=2)
-print(f"💾 Saved performance data for next adaptive run (time: {elapsed:.1f}s, top={top})")
+print(f"💾 Learned fetch settings for next run: {controller.settings()}")
@@ -0,0 +1,69 @@
+# conftest.py — a fake Graph for the fetch / sync tests: canned responses behind session_for
+import threading
+
+import pytest
+import requests
+
+import graph_utils
+import mail_sync
+from graph_utils import FetchController
+
+
+class FakeResponse:
+    headers = {}
+    content = b"{}"
+
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self._data = data or {}
+
+    def json(self):
+        return self._data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"HTTP {self.status_code}", response=self)
+
+
+class FakeSession:
+    """
+    requests.Session stand-in. `get(url, params)` / `post(url, json)` handlers
+    return a FakeResponse, a dict (sent as 200) or raise; every request is
+    recorded in `requests` as (method, url, params or json body).
+    """
+
+    def __init__(self, get=None, post=None):
+        self.handlers = {"GET": get, "POST": post}
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def get(self, url, headers=None, params=None, timeout=None):
+        return self._answer("GET", url, params)
+
+    def post(self, url, headers=None, json=None, timeout=None):
+        return self._answer("POST", url, json)
+
+    def _answer(self, method, url, payload):
+        with self._lock:
+            self.requests.append((method, url, payload))
+        result = self.handlers[method](url, payload)
+        return result if isinstance(result, FakeResponse) else FakeResponse(200, result)
+
+
+@pytest.fixture
+def fake_graph(monkeypatch):
+    """
+    install(get=..., post=...) sends every Graph request through a new
+    FakeSession (returned), with a fresh FetchController and no backoff sleeps.
+    """
+    monkeypatch.setattr(graph_utils.time, "sleep", lambda s: None)
+
+    def install(get=None, post=None):
+        session = FakeSession(get, post)
+        controller = FetchController(path=None)
+        for module in (graph_utils, mail_sync):
+            monkeypatch.setattr(module, "session_for", lambda token: session)
+            monkeypatch.setattr(module, "fetch_controller", lambda tenant=None: controller)
+        return session
+
+    return install
@@ -0,0 +1,44 @@
+# test_aggregate_answer.py — which questions the aggregate store answers exactly
+from datetime import datetime, timezone
+
+import pytest
+
+from aggregates import AggregateStore
+from qa import aggregate_answer
+
+NOW = datetime(2026, 3, 15, 12, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def aggregates(tmp_path):
+    store = AggregateStore(str(tmp_path))
+    store.upsert([
+        {"id": "1", "from": "registrar@giki.edu.pk", "subject": "Exam schedule", "received": "2026-02-10T08:00:00Z"},
+        {"id": "2", "from": "library@giki.edu.pk", "subject": "Overdue books", "received": "2026-03-01T08:00:00Z"},
+        {"id": "3", "from": "deals@shop.example.com", "subject": "Spring sale", "received": "2026-03-14T08:00:00Z"},
+    ])
+    return store
+
+
+@pytest.mark.parametrize("question", [
+    "what's the status of my account?",
+    "any discount offers?",
+    "how many emails mention the exam?",
+    "latest news about the hostel fee",
+    "most recent email from the library",
+])
+def test_topical_questions_go_to_retrieval(aggregates, question):
+    assert aggregate_answer(question, aggregates, now=NOW) is None
+
+
+def test_counts(aggregates):
+    assert "3 email(s)" in aggregate_answer("How many emails did I get?", aggregates, now=NOW)
+    assert "1 email(s)" in aggregate_answer("how many emails from giki last month?", aggregates, now=NOW)
+    assert "2 email(s)" in aggregate_answer("count emails from giki", aggregates, now=NOW)
+
+
+def test_latest_and_top_senders(aggregates):
+    assert "Spring sale" in aggregate_answer("what is the latest email?", aggregates, now=NOW)
+    assert "Overdue books" in aggregate_answer("most recent email from giki", aggregates, now=NOW)
+    assert aggregate_answer("who sends me the most emails?", aggregates, now=NOW).startswith("📊 Top senders")
+    assert "giki.edu.pk: 2" in aggregate_answer("emails per domain", aggregates, now=NOW)
@@ -0,0 +1,48 @@
+# test_answer_cache.py — answers stay cached across checkpoints, not across index runs
+import threading
+
+from answer_cache import AnswerCache
+from raganizer import load_manifest, save_manifest
+
+
+class FakeEmbeddings:
+    def embed_query(self, text):
+        # Questions about emails point one way, everything else the other
+        return [1.0, 0.0] if "email" in text else [0.0, 1.0]
+
+
+def index(persist_dir, ids, final):
+    manifest = load_manifest(persist_dir)
+    manifest["messages"] = {i: {"hash": i, "received": None, "ids": [i]} for i in ids}
+    save_manifest(persist_dir, manifest, final=final)
+
+
+def test_checkpoints_keep_answers_and_the_end_of_a_run_drops_them(tmp_path):
+    persist_dir = str(tmp_path)
+    index(persist_dir, ["a"], final=True)
+    cache = AnswerCache(persist_dir, FakeEmbeddings())
+    cache.put("how many emails?", "1")
+
+    index(persist_dir, ["a", "b"], final=False)  # mid-run checkpoint
+    assert cache.get("How many emails") == ("1", 1.0)
+
+    index(persist_dir, ["a", "b"], final=True)  # the run finished
+    assert cache.get("how many emails?") is None
+
+
+def test_counters_under_concurrent_gets(tmp_path):
+    cache = AnswerCache(str(tmp_path), FakeEmbeddings())
+    cache.put("any emails?", "yes")
+
+    def ask():
+        for _ in range(50):
+            cache.get("any emails")
+            cache.get("what is the weather")
+
+    threads = [threading.Thread(target=ask) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (200, 200)
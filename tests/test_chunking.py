@@ -0,0 +1,53 @@
+# test_chunking.py — signature stripping and token-budgeted splitting in raganizer
+import pytest
+
+import raganizer
+from raganizer import CHUNK_TOKENS, body_text, split_tokens, strip_quoted
+
+
+@pytest.fixture(autouse=True)
+def estimated_tokens(monkeypatch):
+    # Budget with the regex estimate (and its margin) whether or not transformers is installed
+    monkeypatch.setattr(raganizer, "get_tokenizer", lambda: None)
+
+
+def own_text(content):
+    return strip_quoted(body_text({"contentType": "text", "content": content}))
+
+
+def test_bare_dashes_are_not_a_signature():
+    assert own_text("Item 1\n--\nItem 2") == "Item 1\n--\nItem 2"
+
+
+def test_signature_delimiter_near_the_end_is_cut():
+    assert own_text("Hello there\nSee below\n-- \nJane\nACME Corp") == "Hello there\nSee below"
+
+
+def test_signature_delimiter_far_from_the_end_is_kept():
+    lines = "\n".join(f"Point {i}" for i in range(raganizer.SIGNATURE_LINES + 5))
+    assert own_text(f"Intro\n-- \n{lines}").endswith(lines)
+
+
+def test_chunks_cover_the_whole_text_within_budget():
+    words = [f"w{i}" for i in range(3000)] + ["aGVsbG8gd29ybGQgdGhpcyBpcyBiYXNlNjQ="]
+    chunks = split_tokens(" ".join(words))
+    assert all(raganizer.count_tokens(c) <= CHUNK_TOKENS * raganizer.ESTIMATE_MARGIN for c in chunks)
+    assert chunks[-1].split()[-1] == words[-1]  # nothing dropped at the end
+
+
+def test_content_after_a_short_thanks_is_kept():
+    text = "Hi all,\nThanks!\nThe exam is moved to Monday 9am in Room 3."
+    assert own_text(text) == text
+
+
+def test_sign_off_followed_by_a_name_block_is_cut():
+    assert own_text("The exam is moved to Monday.\nBest regards,\nJane Doe\nRegistrar, GIKI") == \
+        "The exam is moved to Monday."
+    assert own_text("Hi,\nThanks!\nThe exam is moved.\nBest,\nJane") == "Hi,\nThanks!\nThe exam is moved."
+
+
+def test_underscore_separator_is_not_a_reply_header():
+    text = "Agenda\n____________________\n1. Budget\n2. Hiring"
+    assert own_text(text) == text
+    reply = "Sounds good.\n________________________________\nFrom: Jane <jane@example.com>\nSent: Monday\nOld text"
+    assert own_text(reply) == "Sounds good.\n________________________________"
@@ -0,0 +1,66 @@
+# test_dedup.py — SimHash clustering: who collapses into whom, and what removal orphans
+from dedup import MIN_WORDS, DedupIndex, hamming, simhash
+
+NOTICE = ("Your order has shipped and is on its way. Track the parcel with the link below and "
+          "contact support if it does not arrive within five working days. Order number {n}.")
+OTHER = ("The library will be closed on Friday for maintenance of the heating system. Books due "
+         "that day can be returned on Monday without any late fee being charged to your account.")
+
+
+def test_numbers_do_not_split_otherwise_identical_notices():
+    assert hamming(simhash(NOTICE.format(n=1001)), simhash(NOTICE.format(n=2002))) == 0
+    assert hamming(simhash(NOTICE.format(n=1001)), simhash(OTHER)) > 3
+
+
+def test_short_texts_have_no_signature():
+    assert simhash(" ".join(["thanks"] * (MIN_WORDS - 1))) is None
+
+
+def test_assign_clusters_near_duplicates(tmp_path):
+    index = DedupIndex(str(tmp_path))
+    assert index.assign("a", NOTICE.format(n=1)) == "a"
+    assert index.assign("b", NOTICE.format(n=2)) == "a"
+    assert index.assign("c", OTHER) == "c"
+    assert index.assign("d", "Thanks!") == "d"  # never collapsed
+    assert sorted(index.members("a")) == ["a", "b"]
+    assert index.stats() == {"messages": 4, "clusters": 3, "collapsed": 1}
+
+
+def test_thread_distance_applies_within_a_conversation(tmp_path):
+    edited = OTHER.replace("Friday", "Thursday").replace("Monday", "Tuesday")
+    distance = hamming(simhash(OTHER), simhash(edited))
+    assert distance > 0
+    for n, (conversation, expected) in enumerate([("t1", "a"), ("t2", "b")]):
+        index = DedupIndex(str(tmp_path / str(n)), max_distance=distance - 1, thread_distance=distance)
+        index.assign("a", OTHER, conversation_id="t1")
+        # Close enough within the thread, too far apart across conversations
+        assert index.assign("b", edited, conversation_id=conversation) == expected
+
+
+def test_reassigning_is_idempotent(tmp_path):
+    index = DedupIndex(str(tmp_path))
+    index.assign("a", NOTICE.format(n=1))
+    index.assign("b", NOTICE.format(n=2))
+    assert index.assign("b", NOTICE.format(n=2)) == "a"
+    assert index.stats()["messages"] == 2
+
+
+def test_removing_a_representative_orphans_its_members(tmp_path):
+    index = DedupIndex(str(tmp_path))
+    for mid, n in (("a", 1), ("b", 2), ("c", 3)):
+        index.assign(mid, NOTICE.format(n=n))
+    index.assign("d", OTHER)
+
+    assert sorted(index.remove(["a"])) == ["b", "c"]
+    # Orphans are forgotten too: re-assigning them starts a new cluster
+    assert index.stats()["messages"] == 1
+    assert index.assign("b", NOTICE.format(n=2)) == "b"
+    assert index.assign("c", NOTICE.format(n=3)) == "b"
+
+
+def test_removing_a_member_orphans_nobody(tmp_path):
+    index = DedupIndex(str(tmp_path))
+    index.assign("a", NOTICE.format(n=1))
+    index.assign("b", NOTICE.format(n=2))
+    assert index.remove(["b"]) == []
+    assert index.members("a") == ["a"]
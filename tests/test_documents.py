@@ -0,0 +1,61 @@
+# test_documents.py — emails_to_documents with collapsed duplicates and attachments
+import pytest
+
+pytest.importorskip("langchain_core")
+
+import raganizer
+from dedup import DedupIndex
+from raganizer import emails_to_documents, is_duplicate, is_indexed, manifest_entries, message_hash
+
+INVOICE = ("Dear customer, please find attached the invoice for your recent order with us. "
+           "Payment is due within thirty days of the invoice date. Thank you for your business.")
+
+
+@pytest.fixture(autouse=True)
+def estimated_tokens(monkeypatch):
+    monkeypatch.setattr(raganizer, "get_tokenizer", lambda: None)
+
+
+def invoice(n, attachments=None):
+    m = {"id": f"m{n}", "subject": "Your invoice", "receivedDateTime": f"2026-01-0{n}T09:00:00Z",
+         "from": {"emailAddress": {"address": "billing@shop.example"}}, "hasAttachments": True,
+         "body": {"contentType": "text", "content": INVOICE}}
+    if attachments is not None:
+        m["attachments"] = attachments
+    return m
+
+
+def pdf(n):
+    return {"name": f"invoice{n}.pdf", "contentType": "application/pdf", "size": 1000 + n,
+            "text": f"Invoice INV-{n:04d} total {n * 10} EUR"}
+
+
+def test_duplicates_keep_their_attachments(tmp_path):
+    messages = [invoice(n, [pdf(n)]) for n in (1, 2, 3)]
+    docs = emails_to_documents(messages, dedup=DedupIndex(str(tmp_path)))
+
+    assert sum(is_duplicate(d) for d in docs) == 2  # the bodies of m2 and m3 collapse into m1
+    attached = {d.metadata["attachment"]: d.page_content for d in docs if d.metadata.get("attachment")}
+    assert sorted(attached) == ["invoice1.pdf", "invoice2.pdf", "invoice3.pdf"]
+    assert "INV-0002" in attached["invoice2.pdf"]
+
+    entries = manifest_entries(docs)
+    assert entries["m2"]["dup_of"] == "m1"
+    assert len(entries["m2"]["ids"]) == 1  # the attachment chunk has vectors, the body does not
+    assert entries["m2"]["attachments"] == [["invoice2.pdf", 1002]]
+
+
+def test_message_hash_covers_attachment_names_and_sizes():
+    bare = message_hash(invoice(1))
+    assert message_hash(invoice(1, [])) == bare
+    assert message_hash(invoice(1, [pdf(1)])) != bare
+    assert message_hash(invoice(1, [{**pdf(1), "size": 5}])) != message_hash(invoice(1, [pdf(1)]))
+
+
+def test_messages_indexed_before_attachment_ingestion_are_reindexed():
+    old = manifest_entries(emails_to_documents([invoice(1)]))["m1"]  # no attachments ingested
+    assert is_indexed(old, invoice(1))
+    assert not is_indexed(old, invoice(1), ingest_attachments=True)
+
+    new = manifest_entries(emails_to_documents([invoice(1, [pdf(1)])]))["m1"]
+    assert is_indexed(new, invoice(1), ingest_attachments=True)  # same attachments assumed
@@ -0,0 +1,65 @@
+# test_fetch_bodies.py — $batch body fetch: partial failures and Retry-After parsing
+import threading
+from email.utils import format_datetime
+from datetime import datetime, timezone
+
+import pytest
+
+from conftest import FakeResponse
+from graph_utils import BATCH_LIMIT, FetchController, GraphFetchError, fetch_bodies, parse_retry_after
+
+
+class BatchGraph:
+    """
+    Answers $batch body requests. Batches containing `broken` fail with HTTP
+    500; `throttled` ids are throttled once with an HTTP-date Retry-After.
+    """
+
+    def __init__(self, broken=(), throttled=()):
+        self.broken, self.throttled = set(broken), set(throttled)
+        self._lock = threading.Lock()
+
+    def __call__(self, url, body):
+        requests_ = body["requests"]
+        ids = [r["url"].split("/")[3].split("?")[0] for r in requests_]
+        if self.broken & set(ids):
+            return FakeResponse(500)
+        responses = []
+        for r, mid in zip(requests_, ids):
+            with self._lock:
+                throttle = mid in self.throttled
+                self.throttled.discard(mid)
+            if throttle:
+                responses.append({"id": r["id"], "status": 429,
+                                  "headers": {"Retry-After": format_datetime(datetime.now(timezone.utc), usegmt=True)}})
+            else:
+                responses.append({"id": r["id"], "status": 200,
+                                  "body": {"body": {"contentType": "text", "content": f"body of {mid}"}}})
+        return {"responses": responses}
+
+
+IDS = [f"m{i}" for i in range(BATCH_LIMIT * 3)]
+
+
+def test_http_date_retry_after_in_sub_responses(fake_graph):
+    fake_graph(post=BatchGraph(throttled=IDS[:5]))
+    bodies = fetch_bodies("token", IDS, controller=FetchController(path=None))
+    assert set(bodies) == set(IDS)
+
+
+def test_failed_batch_keeps_the_other_bodies(fake_graph):
+    fake_graph(post=BatchGraph(broken=[IDS[BATCH_LIMIT]]))  # the second batch fails
+    with pytest.raises(GraphFetchError) as excinfo:
+        fetch_bodies("token", IDS, controller=FetchController(path=None))
+
+    err = excinfo.value
+    fetched = dict(err.items)
+    assert set(fetched) == set(IDS[:BATCH_LIMIT] + IDS[2 * BATCH_LIMIT:])
+    assert err.cursor == IDS[BATCH_LIMIT:2 * BATCH_LIMIT]
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("7") == 7.0
+    assert parse_retry_after(format_datetime(datetime(2000, 1, 1, tzinfo=timezone.utc), usegmt=True)) == 0.0
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(None) is None
@@ -0,0 +1,112 @@
+# test_fetch_messages_parallel.py — slice failure and resume in graph_utils.fetch_messages_parallel
+import threading
+from datetime import datetime, timezone
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+import requests
+
+from graph_utils import (
+    FetchController, GraphFetchError, PAGE_ATTEMPTS, build_message_query, fetch_messages_parallel, split_range,
+)
+
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+END = datetime(2026, 1, 5, tzinfo=timezone.utc)
+SLICES = 4
+PAGES = 3  # pages per slice
+PER_PAGE = 2
+
+
+class SlicedGraph:
+    """
+    Graph stand-in: each time slice (numbered like split_range, newest first)
+    has PAGES pages linked by @odata.nextLink. Page `fail_page` of slice
+    `fail_slice` raises a connection error for its first `failures` requests.
+    """
+
+    def __init__(self, fail_slice=None, fail_page=None, failures=0):
+        self.fail_slice, self.fail_page, self.failures = fail_slice, fail_page, failures
+        self.slices = {
+            build_message_query(start=s, end=e)["$filter"]: n
+            for n, (s, e) in enumerate(split_range(START, END, SLICES))
+        }
+        self.requests = []  # (slice, page) of every request, in order
+        self._lock = threading.Lock()
+
+    def __call__(self, url, params):
+        if params and "$filter" in params:
+            n, page = self.slices[params["$filter"]], 0
+        else:
+            query = parse_qs(urlsplit(url).query)
+            n, page = int(query["slice"][0]), int(query["page"][0])
+        with self._lock:
+            self.requests.append((n, page))
+            failing = (n, page) == (self.fail_slice, self.fail_page) and self.failures > 0
+            self.failures -= failing
+        if failing:
+            raise requests.exceptions.ConnectionError(f"connection reset on slice {n} page {page}")
+        data = {"value": [{"id": item_id(n, page, i)} for i in range(PER_PAGE)]}
+        if page + 1 < PAGES:
+            data["@odata.nextLink"] = f"https://fake.graph/next?slice={n}&page={page + 1}&$top={PER_PAGE}"
+        return data
+
+
+def item_id(n, page, i):
+    return f"s{n}-p{page}-{i}"
+
+
+def slice_ids(n, pages=range(PAGES)):
+    return [item_id(n, p, i) for p in pages for i in range(PER_PAGE)]
+
+
+@pytest.fixture
+def sliced_graph(fake_graph):
+    def install(**failure):
+        graph = SlicedGraph(**failure)
+        fake_graph(get=graph)
+        return graph
+
+    return install
+
+
+def fetch():
+    return fetch_messages_parallel("token", START, END, slices=SLICES, max_workers=SLICES,
+                                   controller=FetchController(path=None))
+
+
+def test_all_slices_are_merged_in_order(sliced_graph):
+    graph = sliced_graph()
+    items = fetch()
+    assert [m["id"] for m in items] == [i for n in range(SLICES) for i in slice_ids(n)]
+    assert len(graph.requests) == SLICES * PAGES
+
+
+def test_failed_slice_resumes_from_its_next_link(sliced_graph):
+    # Slice 1's second page fails on every attempt made inside the pool, then recovers
+    graph = sliced_graph(fail_slice=1, fail_page=1, failures=PAGE_ATTEMPTS)
+    items = fetch()
+
+    # Nothing lost or duplicated, finished slices included, order preserved
+    assert [m["id"] for m in items] == [i for n in range(SLICES) for i in slice_ids(n)]
+    # The resume started at the failed page's nextLink, not at the slice's first page
+    assert graph.requests.count((1, 0)) == 1
+    assert graph.requests.count((1, 1)) == PAGE_ATTEMPTS + 1
+    # Finished slices were not fetched again
+    for n in (0, 2, 3):
+        assert sorted(p for s, p in graph.requests if s == n) == list(range(PAGES))
+
+
+def test_resume_failure_keeps_what_was_fetched(sliced_graph):
+    # The page keeps failing during the serial resume as well
+    sliced_graph(fail_slice=1, fail_page=1, failures=PAGE_ATTEMPTS * 2)
+    with pytest.raises(GraphFetchError) as excinfo:
+        fetch()
+
+    err = excinfo.value
+    # Slice 0 completed and slice 1 up to the gap are carried by the error
+    assert [m["id"] for m in err.items] == slice_ids(0) + slice_ids(1, pages=[0])
+    # ...with the cursor of the failed page, ready for another resume
+    url, params = err.cursor
+    assert parse_qs(urlsplit(url).query)["slice"] == ["1"]
+    assert parse_qs(urlsplit(url).query)["page"] == ["1"]
+    assert params is None
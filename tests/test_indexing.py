@@ -0,0 +1,123 @@
+# test_indexing.py — both indexers write through IndexWriter: skip, replace and prune
+import threading
+
+import pytest
+
+pytest.importorskip("langchain_community")
+
+import raganizer
+from aggregates import AggregateStore
+from benchmarks.stubs import HashEmbeddings
+from lexical_index import LexicalIndex
+from pipeline import run_index_pipeline
+from raganizer import emails_to_documents, load_manifest, make_or_load_chroma
+
+DAY1 = ("2026-01-01T00:00:00Z", "2026-01-02T00:00:00Z")
+
+
+@pytest.fixture(autouse=True)
+def offline(monkeypatch):
+    monkeypatch.setattr(raganizer, "get_tokenizer", lambda: None)
+    monkeypatch.setattr(raganizer, "get_embeddings", HashEmbeddings)
+
+
+def message(mid, day, word):
+    return {"id": mid, "subject": f"About {word}", "receivedDateTime": f"2026-01-0{day}T09:00:00Z",
+            "from": {"emailAddress": {"address": "a@example.com"}},
+            "body": {"contentType": "text", "content": f"Notes on {word}"}}
+
+
+def indexed(persist_dir):
+    return set(load_manifest(persist_dir)["messages"])
+
+
+def index(persist_dir, messages, **kwargs):
+    return run_index_pipeline([messages], persist_dir=persist_dir, embeddings=HashEmbeddings(), **kwargs)
+
+
+def test_unscoped_runs_never_prune(tmp_path):
+    d = str(tmp_path)
+    index(d, [message("a", 1, "alpha"), message("b", 2, "beta")])
+    index(d, [message("c", 3, "gamma")])
+    make_or_load_chroma(emails_to_documents([message("d", 3, "delta")]), persist_dir=d)
+    assert indexed(d) == {"a", "b", "c", "d"}
+
+
+def test_scoped_run_prunes_its_window_everywhere(tmp_path):
+    d = str(tmp_path)
+    index(d, [message("a", 1, "alpha"), message("b", 1, "beta"), message("c", 2, "gamma")])
+    _, stats = index(d, [message("a", 1, "alpha")], scope=DAY1)
+
+    assert stats["removed"] == 1
+    assert indexed(d) == {"a", "c"}
+    assert AggregateStore(d).count() == 2
+    assert LexicalIndex(d).search("beta") == []
+
+
+def test_make_or_load_chroma_prunes_like_the_pipeline(tmp_path):
+    d = str(tmp_path)
+    make_or_load_chroma(emails_to_documents([message("a", 1, "alpha"), message("b", 1, "beta"),
+                                             message("c", 2, "gamma")]), persist_dir=d)
+    make_or_load_chroma(emails_to_documents([message("a", 1, "alpha")]), persist_dir=d, scope=DAY1)
+    assert indexed(d) == {"a", "c"}
+    assert LexicalIndex(d).search("beta") == []
+
+
+def test_changed_message_replaces_its_chunks(tmp_path):
+    d = str(tmp_path)
+    db, _ = index(d, [message("a", 1, "alpha")])
+    edited = message("a", 1, "omega")
+    _, stats = index(d, [edited])
+    assert stats["indexed"] == 1
+    assert len(db._collection.get()["ids"]) == 1
+    assert [doc_id.split(":")[0] for doc_id, _ in LexicalIndex(d).search("omega")] == ["a"]
+    assert LexicalIndex(d).search("alpha") == []
+
+
+def test_collapsed_copies_stay_searchable_by_exact_terms(tmp_path):
+    d = str(tmp_path)
+    notice = ("Your order has shipped and is on its way. Track the parcel with the link below and "
+              "contact support if it does not arrive within five working days. Order number {n}.")
+    messages = [{**message(f"m{n}", 1, "order"), "body": {"contentType": "text", "content": notice.format(n=n)}}
+                for n in (1001, 1002)]
+    db, stats = index(d, messages)
+    assert stats["duplicates"] == 1 and len(db._collection.get()["ids"]) == 1
+
+    lexical = LexicalIndex(d)
+    (doc_id, _), = lexical.search("1002")
+    assert doc_id.startswith("m1002:")
+    assert "Order number 1002" in lexical.documents([doc_id])[doc_id].page_content
+
+    index(d, messages[:1], scope=DAY1)
+    assert lexical.search("1002") == []
+
+
+def test_cancelled_run_resumes_where_it_stopped(tmp_path):
+    d = str(tmp_path)
+    pages = [[message(f"m{n}", 1, word)] for n, word in enumerate(("alpha", "beta", "gamma", "delta"))]
+    cancel = threading.Event()
+    _, stats = run_index_pipeline(pages, persist_dir=d, embeddings=HashEmbeddings(), batch_size=1,
+                                  queue_size=1, cancel=cancel, on_progress=lambda s: cancel.set())
+    assert stats["cancelled"] and "removed" not in stats
+    done = indexed(d)
+    assert done and len(done) < 4
+
+    _, stats = run_index_pipeline(pages, persist_dir=d, embeddings=HashEmbeddings(), batch_size=1)
+    assert stats["skipped"] == len(done) and stats["indexed"] == 4 - len(done)
+    assert indexed(d) == {"m0", "m1", "m2", "m3"}
+
+
+def test_checkpoints_keep_the_manifest_version(tmp_path):
+    d = str(tmp_path)
+    index(d, [message("a", 1, "alpha")])
+    before = load_manifest(d)["version"]
+    seen = []
+
+    def progress(stats):
+        manifest = load_manifest(d)
+        seen.append((manifest["version"], set(manifest["messages"])))
+
+    run_index_pipeline([[message("b", 1, "beta")], [message("c", 1, "gamma")]], persist_dir=d,
+                       embeddings=HashEmbeddings(), batch_size=1, on_progress=progress)
+    assert seen[0] == (before, {"a", "b"})
+    assert load_manifest(d)["version"] != before
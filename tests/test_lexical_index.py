@@ -0,0 +1,77 @@
+# test_lexical_index.py — BM25 ranking, filters and stored text of the lexical index
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+
+from lexical_index import LEXICAL_FILE, LexicalIndex
+
+
+def doc(text, mid, subject="", received_ts=0, domain="example.com", **extra):
+    metadata = {"id": mid, "subject": subject, "received_ts": received_ts, "domain": domain, **extra}
+    return SimpleNamespace(page_content=text, metadata=metadata)
+
+
+def test_index_without_stored_text_columns_is_migrated(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / LEXICAL_FILE))
+    conn.executescript("""
+        CREATE TABLE docs (doc_id TEXT PRIMARY KEY, message_id TEXT, length INTEGER NOT NULL,
+                           received_ts INTEGER, domain TEXT);
+        CREATE TABLE postings (term TEXT NOT NULL, doc_id TEXT NOT NULL, tf INTEGER NOT NULL,
+                               PRIMARY KEY (term, doc_id)) WITHOUT ROWID;
+        INSERT INTO docs VALUES ('old:0', 'old', 1, 0, 'example.com');
+        INSERT INTO postings VALUES ('legacy', 'old:0', 1);
+    """)
+    conn.commit()
+    conn.close()
+
+    lexical = LexicalIndex(str(tmp_path))
+    lexical.add(["new:0"], [doc("invoice INV-7", "new")], keep_text=True)
+    assert [i for i, _ in lexical.search("legacy")] == ["old:0"]
+    assert [i for i, _ in lexical.search("inv")] == ["new:0"]
+
+
+def test_delete_messages_drops_every_chunk(tmp_path):
+    lexical = LexicalIndex(str(tmp_path))
+    lexical.add(["a:0", "a:1", "b:0"], [doc("budget", "a"), doc("budget", "a"), doc("budget", "b")])
+    lexical.delete_messages(["a"])
+    assert [i for i, _ in lexical.search("budget")] == ["b:0"]
+
+
+def test_stored_text_comes_back_as_documents(tmp_path):
+    pytest.importorskip("langchain_core")
+    lexical = LexicalIndex(str(tmp_path))
+    lexical.add(["a:0"], [doc("vectors elsewhere", "a")])
+    lexical.add(["b:0"], [doc("Order number 1002", "b", duplicate_of="a")], keep_text=True)
+
+    found = lexical.documents(["a:0", "b:0"])
+    assert list(found) == ["b:0"]
+    assert found["b:0"].page_content == "Order number 1002"
+    assert found["b:0"].metadata["duplicate_of"] == "a"
+
+
+def test_rare_terms_and_subject_matches_rank_first(tmp_path):
+    lexical = LexicalIndex(str(tmp_path))
+    lexical.add(
+        ["a:0", "b:0", "c:0", "d:0"],
+        [doc("Subject: Weekly\nmeeting notes for the week", "a", subject="Weekly"),
+         doc("Subject: Budget review\nmeeting agenda attached", "b", subject="Budget review"),
+         doc("Subject: Weekly\nthe budget came up in the meeting", "c", subject="Weekly"),
+         doc("Subject: Rooms\nmeeting room booked", "d", subject="Rooms")],
+    )
+    assert [i for i, _ in lexical.search("budget meeting")][:2] == ["b:0", "c:0"]
+    assert lexical.search("the of and") == []
+
+
+def test_where_filters_match_the_chroma_syntax(tmp_path):
+    lexical = LexicalIndex(str(tmp_path))
+    lexical.add(
+        ["a:0", "b:0", "c:0"],
+        [doc("invoice", "a", received_ts=100, domain="acme.com"),
+         doc("invoice", "b", received_ts=200, domain="acme.com"),
+         doc("invoice", "c", received_ts=300, domain="other.org")],
+    )
+    recent = {"$and": [{"received_ts": {"$gte": 150}}, {"domain": "acme.com"}]}
+    assert [i for i, _ in lexical.search("invoice", where=recent)] == ["b:0"]
+    with pytest.raises(ValueError):
+        lexical.search("invoice", where={"subject": "invoice"})
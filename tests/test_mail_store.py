@@ -0,0 +1,56 @@
+# test_mail_store.py — MessageStore layout migration and body handling
+import json
+import sqlite3
+
+from mail_store import MessageStore
+
+
+def message(mid, received, body=None):
+    m = {"id": mid, "subject": f"About {mid}", "receivedDateTime": received, "bodyPreview": "preview",
+         "conversationId": "conv-1", "from": {"emailAddress": {"address": "a@example.com", "name": "Ann"}}}
+    if body is not None:
+        m["body"] = {"contentType": "text", "content": body}
+    return m
+
+
+def test_old_store_is_moved_to_the_compact_layout(tmp_path):
+    path = str(tmp_path / "store.sqlite")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE messages (id TEXT PRIMARY KEY, received TEXT, sender TEXT, subject TEXT, data TEXT NOT NULL);
+        CREATE TABLE sync_state (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+    """)
+    old = [message("a", "2026-01-02T09:00:00Z", body="full text"), message("b", "2026-01-03T09:00:00Z")]
+    conn.executemany(
+        "INSERT INTO messages VALUES (?, ?, ?, ?, ?)",
+        [(m["id"], m["receivedDateTime"], "a@example.com", m["subject"], json.dumps(m)) for m in old],
+    )
+    conn.execute("INSERT INTO sync_state VALUES ('delta:inbox', ?)", (json.dumps({"link": "x"}),))
+    conn.commit()
+    conn.close()
+
+    store = MessageStore(path)
+    assert store.count() == 2
+    assert store.get("a") == old[0]
+    assert store.body("b") is None and "body" not in store.get("b")
+    assert "body" not in json.loads(store._conn.execute("SELECT data FROM messages WHERE id = 'a'").fetchone()[0])
+    rows = {r.id: r for r in store.rows()}
+    assert rows["a"].has_body and not rows["b"].has_body
+    assert rows["a"].sender_name == "Ann" and rows["a"].conversation_id == "conv-1"
+    assert store.get_state("delta:inbox") == {"link": "x"}
+    store.close()
+
+    # Reopening a migrated store is a no-op
+    assert MessageStore(path).get("a") == old[0]
+
+
+def test_header_update_keeps_the_stored_body(tmp_path):
+    store = MessageStore(str(tmp_path / "store.sqlite"))
+    store.upsert_messages([message("a", "2026-01-02T09:00:00Z", body="full text")])
+    renamed = dict(message("a", "2026-01-02T09:00:00Z"), subject="Renamed")
+    store.upsert_messages([renamed])
+    assert store.get("a")["subject"] == "Renamed"
+    assert store.body("a") == {"contentType": "text", "content": "full text"}
+
+    store.delete_messages(["a"])
+    assert store.body("a") is None and store.count() == 0
@@ -0,0 +1,103 @@
+# test_mail_sync.py — delta sync state: replay, resume and expired delta tokens
+import pytest
+import requests
+
+from conftest import FakeResponse
+from mail_store import MessageStore
+from mail_sync import sync_covers, sync_mailbox
+
+SINCE = "2026-01-01T00:00:00Z"
+LISTING = f"delta?receivedDateTime ge {SINCE}"
+
+
+def message(mid):
+    return {"id": mid, "subject": mid, "receivedDateTime": "2026-01-02T09:00:00Z",
+            "from": {"emailAddress": {"address": "a@example.com"}}}
+
+
+class DeltaGraph:
+    """
+    /messages/delta: a fresh listing returns `listing` in two pages (or
+    `listing_status`); saved links answer 410 Gone while `expired`.
+    """
+
+    def __init__(self, listing, expired=False, listing_status=200):
+        self.listing, self.expired, self.listing_status = listing, expired, listing_status
+        self.requests = []
+        self.delta_links = 0
+
+    def __call__(self, url, params):
+        self.requests.append(url if params is None else "delta?" + params["$filter"])
+        if params is None and "page=2" in url:
+            return self._last_page(self.listing[1:])
+        if params is None and self.expired:
+            return FakeResponse(410, {"error": {"code": "SyncStateNotFound"}})
+        if params is not None and self.listing_status != 200:
+            return FakeResponse(self.listing_status)
+        if params is not None and len(self.listing) > 1:
+            return {"value": self.listing[:1], "@odata.nextLink": "https://fake.graph/delta?page=2"}
+        return self._last_page(self.listing)
+
+    def _last_page(self, value):
+        self.delta_links += 1
+        return {"value": value, "@odata.deltaLink": f"https://fake.graph/delta?token={self.delta_links}"}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return MessageStore(str(tmp_path / "store.sqlite"))
+
+
+@pytest.fixture
+def delta(fake_graph):
+    def install(**kwargs):
+        graph = DeltaGraph(**kwargs)
+        fake_graph(get=graph)
+        return graph
+
+    return install
+
+
+def test_first_sync_pages_through_and_saves_the_delta_link(store, delta):
+    graph = delta(listing=[message("a"), message("b")])
+    assert sync_mailbox("token", store, since=SINCE) == {"upserted": 2, "removed": 0}
+    assert graph.requests == [LISTING, "https://fake.graph/delta?page=2"]
+    assert store.get_state("delta:inbox")["link"] == "https://fake.graph/delta?token=1"
+    assert sync_covers(store, SINCE) and not sync_covers(store, "2025-12-01T00:00:00Z")
+
+
+def test_later_syncs_replay_the_delta_link(store, delta):
+    delta(listing=[message("a")])
+    sync_mailbox("token", store, since=SINCE)
+    graph = delta(listing=[message("b"), {"id": "a", "@removed": {"reason": "deleted"}}])
+    graph.delta_links = 1
+    assert sync_mailbox("token", store) == {"upserted": 1, "removed": 1}
+    assert graph.requests[0] == "https://fake.graph/delta?token=1"
+    assert [m["id"] for m in store.messages_between()] == ["b"]
+
+
+def test_expired_delta_token_restarts_from_since(store, delta):
+    delta(listing=[message("a")])
+    sync_mailbox("token", store, since=SINCE)
+    graph = delta(listing=[message("a"), message("b")], expired=True)
+
+    assert sync_mailbox("token", store) == {"upserted": 2, "removed": 0}
+    assert graph.requests[:2] == ["https://fake.graph/delta?token=1", LISTING]
+    state = store.get_state("delta:inbox")
+    assert state["complete"] and state["since"] == SINCE
+    assert sync_covers(store, SINCE)
+
+
+def test_failed_resync_leaves_nothing_covered(store, delta):
+    delta(listing=[message("a")])
+    sync_mailbox("token", store, since=SINCE)
+    delta(listing=[], expired=True, listing_status=403)
+    with pytest.raises(requests.exceptions.HTTPError):
+        sync_mailbox("token", store)
+    assert not sync_covers(store, SINCE)
+
+    # The window is kept: the next refresh lists it again instead of replaying the dead link
+    graph = delta(listing=[message("b")])
+    sync_mailbox("token", store)
+    assert graph.requests == [LISTING]
+    assert sync_covers(store, SINCE)
@@ -0,0 +1,47 @@
+# test_message_query.py — sender / domain filters: pushed down where Graph supports them, else client-side
+from conftest import FakeResponse
+from graph_utils import build_message_query, list_messages
+
+MESSAGES = [
+    {"id": "1", "from": {"emailAddress": {"address": "Alice@Example.com"}}},
+    {"id": "2", "from": {"emailAddress": {"address": "bob@other.org"}}},
+    {"id": "3", "from": {"emailAddress": {"address": "carol@mail.example.com"}}},
+    {"id": "4", "from": {"emailAddress": {"address": "dave@example.com"}}},
+]
+
+
+def two_pages(reject_sender=False):
+    """MESSAGES in two pages; optionally answers a sender $filter with 400 like a strict tenant."""
+
+    def get(url, params):
+        if params is None:
+            return {"value": MESSAGES[2:]}
+        if reject_sender and "from/emailAddress/address" in params.get("$filter", ""):
+            return FakeResponse(400)
+        return {"value": MESSAGES[:2], "@odata.nextLink": "https://fake.graph/next"}
+
+    return get
+
+
+def filters(session):
+    return [params.get("$filter", "") for _, _, params in session.requests if params is not None]
+
+
+def test_domain_is_never_sent_to_graph():
+    params = build_message_query(start=None, sender=None)
+    assert "$filter" not in params
+    assert "endswith" not in build_message_query(sender="a@example.com")["$filter"]
+
+
+def test_domain_is_matched_client_side(fake_graph):
+    session = fake_graph(get=two_pages())
+    assert [m["id"] for m in list_messages("token", domain="example.com")] == ["1", "4"]
+    assert all("endswith" not in f for f in filters(session))
+
+
+def test_rejected_sender_filter_falls_back_to_client_side(fake_graph):
+    session = fake_graph(get=two_pages(reject_sender=True))
+    assert [m["id"] for m in list_messages("token", sender="dave@example.com")] == ["4"]
+    # One rejected attempt (not retried), then the query without the sender clause
+    assert len(filters(session)) == 2
+    assert "from/emailAddress/address" not in filters(session)[1]
@@ -0,0 +1,39 @@
+# test_query_dates.py — which words of a question become a date filter
+from datetime import datetime, timezone
+
+import pytest
+
+from qa import mentioned_months, query_date_range
+
+NOW = datetime(2026, 6, 15, 12, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize("query", [
+    "in may I ask what the budget was?",
+    "May I see the exam schedule?",
+    "Thanks. May I ask about the refund?",
+    "did the protesters march to campus",
+    "from march on we meet weekly",
+])
+def test_may_and_march_as_ordinary_words_are_not_months(query):
+    assert mentioned_months(query) == []
+    assert query_date_range(query, NOW) is None
+
+
+@pytest.mark.parametrize("query, months", [
+    ("emails in May", [5]),
+    ("what did registrar send in March?", [3]),
+    ("invoices from may 2025", [5]),
+    ("meeting on 3 march", [3]),
+    ("the 12th of may deadline", [5]),
+    ("emails between february and may", [2]),
+    ("emails between February and May", [2, 5]),
+    ("anything from june", [6]),
+])
+def test_months_in_a_date_context(query, months):
+    assert mentioned_months(query) == months
+
+
+def test_month_range_runs_into_last_year_for_future_months():
+    start, end = query_date_range("emails in November", NOW)
+    assert (start, end) == (datetime(2025, 11, 1, tzinfo=timezone.utc), datetime(2025, 12, 1, tzinfo=timezone.utc))